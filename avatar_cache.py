@@ -0,0 +1,102 @@
+#Sidney Chan
+#Kellie Kaw
+# Content-addressed avatar store: images are keyed by their SHA-256 hash and kept
+# in a small in-memory LRU backed by an LRU-evicted directory on disk.
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+def hash_avatar(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class AvatarCache:
+    def __init__(self, directory="avatar_cache", max_memory_items=64, max_disk_bytes=5 * 1024 * 1024):
+        self.directory = directory
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()  # hash -> bytes
+        self._disk = OrderedDict()    # hash -> size, least recently used first
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._load_disk_index()
+
+    def _load_disk_index(self):
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_bytes += size
+
+    def _path(self, avatar_hash):
+        return os.path.join(self.directory, avatar_hash)
+
+    def put(self, data, expected_hash=None):
+        """Stores avatar bytes and returns their hash, or None if they do not match expected_hash."""
+        avatar_hash = hash_avatar(data)
+        if expected_hash and avatar_hash != expected_hash:
+            return None
+        with self._lock:
+            self._remember(avatar_hash, data)
+            if avatar_hash not in self._disk:
+                self._write_disk(avatar_hash, data)
+        return avatar_hash
+
+    def get(self, avatar_hash):
+        """Returns avatar bytes for a hash, or None if not cached."""
+        with self._lock:
+            data = self._memory.get(avatar_hash)
+            if data is not None:
+                self._memory.move_to_end(avatar_hash)
+                return data
+            if avatar_hash not in self._disk:
+                return None
+            try:
+                with open(self._path(avatar_hash), 'rb') as f:
+                    data = f.read()
+                os.utime(self._path(avatar_hash))
+            except OSError:
+                self._forget_disk(avatar_hash)
+                return None
+            self._disk.move_to_end(avatar_hash)
+            self._remember(avatar_hash, data)
+            return data
+
+    def __contains__(self, avatar_hash):
+        return avatar_hash in self._memory or avatar_hash in self._disk
+
+    def _remember(self, avatar_hash, data):
+        self._memory[avatar_hash] = data
+        self._memory.move_to_end(avatar_hash)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _write_disk(self, avatar_hash, data):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path(avatar_hash), 'wb') as f:
+                f.write(data)
+        except OSError:
+            return  # Memory copy is still usable
+        self._disk[avatar_hash] = len(data)
+        self._disk_bytes += len(data)
+        while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+            oldest = next(iter(self._disk))
+            try:
+                os.remove(self._path(oldest))
+            except OSError:
+                pass
+            self._forget_disk(oldest)
+
+    def _forget_disk(self, avatar_hash):
+        size = self._disk.pop(avatar_hash, None)
+        if size is not None:
+            self._disk_bytes -= size
@@ -0,0 +1,71 @@
+#Sidney Chan
+#Kellie Kaw
+# Counts datagrams for a chatty burst workload over loopback, with and without coalescing.
+# Run from the project root: python benchmarks/coalescing.py [bursts]
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import protocol
+from network import NetworkHandler
+
+SENDER = "alice@127.0.0.1"
+TARGET = "bob@127.0.0.1"
+
+
+def burst():
+    # A DM with its ACK, then a LIKE and a FOLLOW to the same peer
+    dm = protocol.create_dm_message(SENDER, TARGET, "see you at 3")
+    return [
+        dm,
+        protocol.create_ack_message(dm["MESSAGE_ID"], "RECEIVED"),
+        protocol.create_like_message(SENDER, TARGET, dm["TIMESTAMP"], "LIKE"),
+        protocol.create_follow_message(SENDER, TARGET),
+    ]
+
+
+def run(bursts, window):
+    sender = NetworkHandler(port=51201, coalesce_window=window)
+    receiver = NetworkHandler(port=51202, coalesce_window=0)
+    addr = ("127.0.0.1", 51202)
+    wire = [[protocol.serialize_message(m) for m in burst()] for _ in range(bursts)]
+    counts = {"messages": 0, "datagrams": 0}
+    expected = bursts * 4
+
+    def receive():
+        # Drains the socket while the sender runs so the kernel buffer never overflows
+        idle_since = time.monotonic()
+        while counts["messages"] < expected and time.monotonic() - idle_since < 1:
+            from_batch = bool(receiver._ready)
+            message, _ = receiver.receive()
+            if message is None:
+                continue
+            idle_since = time.monotonic()
+            counts["messages"] += 1
+            if not from_batch:
+                counts["datagrams"] += 1  # A fresh recvfrom, not a message unpacked from an earlier BATCH
+
+    thread = threading.Thread(target=receive)
+    thread.start()
+    for messages in wire:
+        for message in messages:
+            sender.send_to(message, addr)
+        time.sleep(0.005)  # Bursts arrive a few milliseconds apart
+    thread.join()
+    sender.close()
+    receiver.close()
+    return counts["messages"], counts["datagrams"]
+
+
+def main():
+    bursts = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    for label, window in (("no coalescing", 0), ("2 ms window", 0.002)):
+        received, datagrams = run(bursts, window)
+        print(f"{label:14} {received} messages in {datagrams} datagrams ({received / max(datagrams, 1):.1f} per datagram)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#Sidney Chan
+#Kellie Kaw
+# Simulates relaying one POST through a network of gossip-mode peers with the Gossip class.
+# Each peer only knows a random subset of the others; the author sends to its followers
+# and seeds `fanout` random peers. Reports how many peers the post reached and at what cost.
+# Run from the project root: python benchmarks/gossip_sim.py [peers] [loss]
+import os
+import random
+import sys
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gossip import Gossip
+
+VIEW_SIZE = 30   # Peers each node has discovered
+FOLLOWERS = 20
+
+
+def simulate(peers, fanout, loss, seed=1):
+    rng = random.Random(seed)
+    views = [rng.sample([p for p in range(peers) if p != node], VIEW_SIZE) for node in range(peers)]
+    nodes = [Gossip(fanout=fanout, rng=random.Random(seed + node)) for node in range(peers)]
+    post = {"MESSAGE_ID": "m1", "TIMESTAMP": str(int(time.time())), "TTL": "3600"}
+    author = 0
+    nodes[author].first_seen(post["MESSAGE_ID"])
+    followers = rng.sample(range(1, peers), FOLLOWERS)
+
+    queue = deque()  # (receiver, sender, message)
+    packets = 0
+    for target in followers + nodes[author].pick_targets(views[author], exclude=set(followers)):
+        queue.append((target, author, post))
+    while queue:
+        node, sender, message = queue.popleft()
+        packets += 1
+        if rng.random() < loss or not nodes[node].first_seen(message["MESSAGE_ID"]):
+            continue
+        if fanout and nodes[node].should_forward(message):
+            relayed = nodes[node].relay_copy(message)
+            for target in nodes[node].pick_targets(views[node], exclude={author, sender}):
+                queue.append((target, node, relayed))
+    reached = sum(1 for node in nodes if node._seen) - 1
+    return reached, packets
+
+
+def main():
+    peers = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    loss = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    print(f"{peers} peers, {FOLLOWERS} followers, {loss:.0%} loss, max 6 hops")
+    for fanout in range(0, 6):
+        reached, packets = simulate(peers, fanout, loss)
+        label = "followers only" if fanout == 0 else f"fanout {fanout}"
+        print(f"{label:15} reached {reached:5} ({reached / (peers - 1):6.1%}) with {packets:6} datagrams")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#Sidney Chan
+#Kellie Kaw
+# Measures bytes retained per stored DM: full parsed-message dicts versus StoredMessage records.
+# Run from the project root: python benchmarks/history_memory.py [message_count]
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import protocol
+from storage import History, StoredMessage
+
+PHRASES = ["hi", "are you coming to lunch?", "ok", "see you at 3", "lol", "sent you the file", "thanks!"]
+
+
+def datagrams(count, peers=50):
+    rng = random.Random(1)
+    senders = [f"user{i}@10.0.0.{i + 2}" for i in range(peers)]
+    out = []
+    for i in range(count):
+        sender = rng.choice(senders)
+        message = protocol.create_dm_message(sender, "me@10.0.0.1", rng.choice(PHRASES))
+        out.append(protocol.serialize_message(message))
+    return out
+
+
+def measure(store, wire):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    history = store(protocol.parse_message(d) for d in wire)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    used = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del history
+    return used / len(wire)
+
+
+def store_dicts(messages):
+    history = {}
+    for message in messages:
+        history.setdefault(message['FROM'], []).append(message)
+    return history
+
+
+def store_records(messages):
+    history = History()
+    for message in messages:
+        history.append(message['FROM'], StoredMessage.from_message(message))
+    return history
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    wire = datagrams(count)
+    as_dicts = measure(store_dicts, wire)
+    as_records = measure(store_records, wire)
+    print(f"Messages: {count}")
+    print(f"parsed dicts    : {as_dicts:8.0f} bytes/message")
+    print(f"StoredMessage   : {as_records:8.0f} bytes/message")
+    print(f"reduction       : {as_dicts / as_records:8.1f}x")
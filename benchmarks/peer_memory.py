@@ -0,0 +1,67 @@
+#Sidney Chan
+#Kellie Kaw
+# Measures the memory held per online peer: the old parsed-PROFILE dicts versus slotted Peer objects.
+# Run from the project root: python benchmarks/peer_memory.py [peer_count]
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import protocol
+from peers import Peer, address_of
+
+PORT = 50999
+
+
+def profile_for(i):
+    user_id = f"user{i}@10.0.{i // 250}.{i % 250 + 1}"
+    message = protocol.create_profile_message(user_id, f"User {i}", "Hanging out on the LAN", "image/png",
+                                              avatar_hash=f"{i:064x}", avatar_size=18000)
+    return protocol.serialize_message(message)
+
+
+def measure(build, count):
+    # Datagrams are parsed inside the measured window, so only what each layout retains is counted
+    datagrams = [profile_for(i) for i in range(count)]
+    address_of.cache_clear()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    table = build(protocol.parse_message(d) for d in datagrams)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    used = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del table
+    return used / count
+
+
+def build_dicts(messages):
+    # Previous layout: the parsed PROFILE dict itself, plus a copy of the inline avatar
+    avatar = "A" * 24000
+    table = {}
+    for message in messages:
+        info = dict(message)
+        info["AVATAR_DATA"] = avatar[:-1] + "B"  # A distinct string per peer, as received off the wire
+        table[info["USER_ID"]] = info
+    return table
+
+
+def build_dicts_no_avatar(messages):
+    return {message["USER_ID"]: dict(message) for message in messages}
+
+
+def build_peers(messages):
+    table = {}
+    for message in messages:
+        peer = Peer(message["USER_ID"], address_of(message["USER_ID"], PORT))
+        peer.update_from_profile(message)
+        table[peer.user_id] = peer
+    return table
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(f"Peers: {count}")
+    print(f"dict with inline avatar : {measure(build_dicts, count):10.0f} bytes/peer")
+    print(f"dict, avatar by hash    : {measure(build_dicts_no_avatar, count):10.0f} bytes/peer")
+    print(f"slotted Peer            : {measure(build_peers, count):10.0f} bytes/peer")
@@ -0,0 +1,61 @@
+#Sidney Chan
+#Kellie Kaw
+# Measures SearchIndex build time and query latency over a synthetic message history.
+# Run from the project root: python benchmarks/search_latency.py [message_count]
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search import SearchIndex
+from storage import StoredMessage
+
+WORDS = ("lunch meeting file project deadline game party coffee library exam notes review "
+         "network packet socket token profile avatar group chat weekend movie dinner train "
+         "homework laptop music photo thanks later tomorrow today morning evening").split()
+
+
+def build(count, peers=200, groups=20):
+    rng = random.Random(1)
+    users = [f"user{i}@10.0.{i // 250}.{i % 250 + 2}" for i in range(peers)]
+    index = SearchIndex()
+    start_ts = 1_700_000_000
+    for i in range(count):
+        sender = rng.choice(users)
+        content = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12))) + f" ref{rng.randrange(100000)}"
+        record = StoredMessage(sender, start_ts + i, content)
+        kind = rng.choice(("DM", "DM", "POST", "GROUP"))
+        scope = f"g{rng.randrange(groups)}" if kind == "GROUP" else sender
+        index.add(kind, scope, record)
+    return index, users
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    t0 = time.perf_counter()
+    index, users = build(count)
+    print(f"indexed {count} messages in {time.perf_counter() - t0:.1f} s")
+
+    queries = [
+        ("lunch", {}),
+        ("lunch coffee", {}),
+        ("ref4242", {}),
+        ("proj*", {}),
+        ("meeting deadline", {"peer": users[3]}),
+        ("party", {"group": "g7"}),
+        ("exam notes", {"sender": users[10], "kind": "DM"}),
+        ("movie", {"since": 1_700_000_000 + count // 2}),
+    ]
+    for query, filters in queries:
+        runs = 20
+        t0 = time.perf_counter()
+        for _ in range(runs):
+            hits = index.search(query, **filters)
+        ms = (time.perf_counter() - t0) / runs * 1000
+        print(f"{query!r:22} {str(filters)[:40]:40} {len(hits):3} hits  {ms:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
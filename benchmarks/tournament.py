@@ -0,0 +1,160 @@
+#Sidney Chan
+#Kellie Kaw
+# Plays N simultaneous Tic-Tac-Toe games between two bot players over loopback, using the
+# real TICTACTOE_INVITE / ACK / TICTACTOE_MOVE / TICTACTOE_RESULT messages and tokens.
+# At most `concurrent` games are in flight; each finished game starts the next one (moves are
+# not resent, so flooding the socket with every invite at once would just stall games).
+# Reports games per second and how long each move waited for the opponent's reply.
+# Run from the project root: python benchmarks/tournament.py [games] [x bot] [o bot] [concurrent]
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import protocol
+from bots import BOTS
+from network import NetworkHandler
+from tictactoe import GameTable
+
+
+class Player:
+    def __init__(self, user_id, port, bot, capacity):
+        self.user_id = user_id
+        self.bot = bot
+        self.net = NetworkHandler(port=port, multicast=False)
+        self.games = GameTable(capacity)
+        self.peer_addr = None
+        self.opponent_id = None
+        self.to_invite = 0   # Games still to be started once a slot frees up
+        self.invites = {}    # MESSAGE_ID -> invite we sent
+        self.sent_at = {}    # GAMEID -> when our last move went out
+        self.latencies = []  # Seconds from our move to the opponent's reply
+        self.finished = 0
+        self.results = {"WIN": 0, "LOSS": 0, "DRAW": 0}
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def send(self, message):
+        self.net.send_to(protocol.serialize_message(message), self.peer_addr)
+
+    def invite(self, count):
+        for _ in range(min(count, self.to_invite)):
+            self.to_invite -= 1
+            gameid = self.games.allocate(self.opponent_id)
+            invite = protocol.create_ttt_invite(self.user_id, self.opponent_id, gameid, "X")
+            self.invites[invite["MESSAGE_ID"]] = invite
+            self.send(invite)
+
+    def play(self, gameid, opponent_id):
+        game = self.games.get(opponent_id, gameid)
+        symbol = game.my_symbol
+        position = self.bot.choose_move(game, symbol)
+        game.make_move(symbol, position, game.turn, self.user_id)
+        self.sent_at[gameid] = time.perf_counter()
+        self.send(protocol.create_ttt_move(self.user_id, opponent_id, gameid, position, symbol, game.turn))
+        if game.winner or game.is_draw:
+            result = "WIN" if game.winner else "DRAW"
+            line = ','.join(map(str, game.winning_line)) if game.winner else None
+            self.send(protocol.create_ttt_result(self.user_id, opponent_id, gameid, result, symbol, line))
+            self.finish(gameid, opponent_id, result)
+
+    def finish(self, gameid, opponent_id, result):
+        self.games.end(opponent_id, gameid)
+        self.sent_at.pop(gameid, None)
+        self.results[result] += 1
+        self.finished += 1
+        self.invite(1)
+
+    def handle(self, message):
+        msg_type = message.get("TYPE")
+        sender = message.get("FROM")
+        if msg_type != protocol.MessageType.ACK and not protocol.validate_token(message.get("TOKEN"), "game", sender):
+            return
+        gameid = message.get("GAMEID")
+
+        if msg_type == protocol.MessageType.TICTACTOE_INVITE:
+            symbol = "O" if message["SYMBOL"] == "X" else "X"
+            x, o = (sender, self.user_id) if symbol == "O" else (self.user_id, sender)
+            self.games.start(gameid, x, o, symbol)
+            self.send(protocol.create_ack_message(message["MESSAGE_ID"], "ACCEPTED"))
+            if symbol == "X":
+                self.play(gameid, sender)
+
+        elif msg_type == protocol.MessageType.ACK:
+            invite = self.invites.pop(message.get("MESSAGE_ID"), None)
+            if invite and message.get("STATUS") == "ACCEPTED":
+                self.games.start(invite["GAMEID"], self.user_id, invite["TO"], "X")
+                self.play(invite["GAMEID"], invite["TO"])
+
+        elif msg_type == protocol.MessageType.TICTACTOE_MOVE:
+            self.send(protocol.create_ack_message(message["MESSAGE_ID"], "RECEIVED"))
+            game = self.games.get(sender, gameid)
+            if game is None:
+                return
+            sent_at = self.sent_at.pop(gameid, None)
+            if sent_at is not None:
+                self.latencies.append(time.perf_counter() - sent_at)
+            game.make_move(message["SYMBOL"], int(message["POSITION"]), message["TURN"], sender)
+            game.turn += 2
+            if game.winner or game.is_draw:
+                self.finish(gameid, sender, "LOSS" if game.winner else "DRAW")
+            else:
+                self.play(gameid, sender)
+
+        elif msg_type == protocol.MessageType.TICTACTOE_RESULT:
+            self.send(protocol.create_ack_message(message["MESSAGE_ID"], "RECEIVED"))
+
+    def run(self):
+        while not self.stop.is_set():
+            data, _ = self.net.receive()
+            if data is not None:
+                self.handle(protocol.parse_message(data))
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def main():
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    x_bot = sys.argv[2] if len(sys.argv) > 2 else "minimax"
+    o_bot = sys.argv[3] if len(sys.argv) > 3 else "random"
+    concurrent = int(sys.argv[4]) if len(sys.argv) > 4 else 100
+    # Room for twice the games in flight, so a freed GAMEID is not reinvited before the
+    # old game's last datagrams have landed (UDP may reorder them)
+    alice = Player("alice@127.0.0.1", 51301, BOTS[x_bot](), 2 * concurrent)
+    bob = Player("bob@127.0.0.1", 51302, BOTS[o_bot](), 2 * concurrent)
+    alice.peer_addr = ("127.0.0.1", 51302)
+    bob.peer_addr = ("127.0.0.1", 51301)
+    alice.opponent_id = bob.user_id
+    alice.to_invite = games
+    alice.thread.start()
+    bob.thread.start()
+
+    start = time.perf_counter()
+    alice.invite(concurrent)
+    deadline = start + 60
+    while (alice.finished < games or bob.finished < games) and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    for player in (alice, bob):
+        player.stop.set()
+    for player in (alice, bob):
+        player.thread.join()
+        player.net.close()
+
+    done = min(alice.finished, bob.finished)
+    latencies = [t * 1000 for t in alice.latencies + bob.latencies]
+    print(f"{done}/{games} games ({x_bot} as X vs {o_bot} as O, {concurrent} at a time) in {elapsed:.2f} s: {done / elapsed:.0f} games/s")
+    print(f"X results: {alice.results}")
+    print(f"move latency over {len(latencies)} moves: p50 {percentile(latencies, 50):.2f} ms, "
+          f"p90 {percentile(latencies, 90):.2f} ms, p99 {percentile(latencies, 99):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+#Sidney Chan
+#Kellie Kaw
+# Computer players for Tic-Tac-Toe. A bot picks a cell for the side to move in a
+# TicTacToe game; the client uses one with --bot, and benchmarks/tournament.py
+# plays many games between them.
+import random
+from tictactoe import FULL_BOARD, completes_line
+
+
+class RandomBot:
+    def __init__(self, rng=None):
+        self.rng = rng or random.Random()
+
+    def choose_move(self, game, symbol):
+        return self.rng.choice(game.free_cells())
+
+
+class MinimaxBot:
+    """Perfect play. Positions are memoized by (own marks, opponent marks), shared by every instance."""
+
+    _memo = {}  # (mine, theirs) -> (score, move) for the player holding `mine` to move
+
+    def choose_move(self, game, symbol):
+        mine, theirs = (game.x_bits, game.o_bits) if symbol == "X" else (game.o_bits, game.x_bits)
+        return self._search(mine, theirs)[1]
+
+    def _search(self, mine, theirs):
+        key = (mine, theirs)
+        best = self._memo.get(key)
+        if best is not None:
+            return best
+        best = (-2, None)
+        occupied = mine | theirs
+        for cell in range(9):
+            if occupied >> cell & 1:
+                continue
+            after = mine | 1 << cell
+            if completes_line(after):
+                score = 1
+            elif after | theirs == FULL_BOARD:
+                score = 0
+            else:
+                score = -self._search(theirs, after)[0]
+            if score > best[0]:
+                best = (score, cell)
+                if score == 1:
+                    break
+        self._memo[key] = best
+        return best
+
+
+BOTS = {"random": RandomBot, "minimax": MinimaxBot}
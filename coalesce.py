@@ -0,0 +1,123 @@
+#Sidney Chan
+#Kellie Kaw
+# Packs small messages bound for the same address into one BATCH datagram.
+# A BATCH is an LSNP header listing each message's byte length, a blank line,
+# then the messages back to back. Messages wait at most one short flush window.
+import threading
+import time
+import protocol
+
+BATCH_PREFIX = f"TYPE:{protocol.MessageType.BATCH}\n".encode('utf-8')
+
+
+def encode_batch(messages):
+    header = f"TYPE:{protocol.MessageType.BATCH}\nLENGTHS:{','.join(str(len(m)) for m in messages)}\n\n"
+    return header.encode('utf-8') + b"".join(messages)
+
+
+def decode_batch(datagram):
+    """Returns the list of message bytes packed in a BATCH datagram, or [] if it is malformed."""
+    end = datagram.find(b"\n\n")
+    if end < 0:
+        return []
+    header = protocol.parse_message(datagram[:end].decode('utf-8', errors='replace'))
+    try:
+        lengths = [int(n) for n in header.get('LENGTHS', "").split(',') if n]
+    except ValueError:
+        return []
+    body = datagram[end + 2:]
+    if sum(lengths) != len(body):
+        return []
+    messages = []
+    offset = 0
+    for length in lengths:
+        messages.append(body[offset:offset + length])
+        offset += length
+    return messages
+
+
+def batch_overhead(count):
+    # Header bytes for a batch of `count` messages, assuming up to 4-digit lengths
+    return len(BATCH_PREFIX) + len("LENGTHS:\n\n") + 5 * count
+
+
+class Coalescer:
+    """Per-address send buffers flushed by a background thread after `window` seconds.
+
+    send(data, addr) is called for each datagram; a buffer is flushed early when the
+    next message would push the batch past max_size. A buffer holding a single
+    message is sent as that plain message, without the BATCH header.
+    """
+
+    def __init__(self, send, window=0.002, max_size=1200):
+        self._send = send
+        self.window = window
+        self.max_size = max_size
+        self._buffers = {}  # addr -> (due time, [message bytes], total bytes)
+        self._cond = threading.Condition()
+        self._stopped = False
+        self.messages = 0   # Messages handed to the coalescer
+        self.datagrams = 0  # Datagrams actually sent for them
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, data, addr):
+        flush = None
+        with self._cond:
+            self.messages += 1
+            entry = self._buffers.get(addr)
+            if entry is not None and entry[2] + len(data) + batch_overhead(len(entry[1]) + 1) > self.max_size:
+                flush = self._buffers.pop(addr)[1]
+                entry = None
+            if entry is None:
+                self._buffers[addr] = (time.monotonic() + self.window, [data], len(data))
+                self._cond.notify()
+            else:
+                entry[1].append(data)
+                self._buffers[addr] = (entry[0], entry[1], entry[2] + len(data))
+        if flush:
+            self._emit(flush, addr)
+
+    def flush(self, addr=None):
+        """Sends what is buffered for addr (or for every address) right away."""
+        with self._cond:
+            if addr is None:
+                pending = [(a, entry[1]) for a, entry in self._buffers.items()]
+                self._buffers.clear()
+            else:
+                entry = self._buffers.pop(addr, None)
+                pending = [(addr, entry[1])] if entry else []
+        for a, messages in pending:
+            self._emit(messages, a)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self.flush()
+
+    def _emit(self, messages, addr):
+        with self._cond:
+            self.datagrams += 1
+        try:
+            self._send(messages[0] if len(messages) == 1 else encode_batch(messages), addr)
+        except OSError:
+            pass  # Socket closed during shutdown
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                if not self._buffers:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                next_due = min(entry[0] for entry in self._buffers.values())
+                if next_due > now:
+                    self._cond.wait(next_due - now)
+                    continue
+                due = [addr for addr, entry in self._buffers.items() if entry[0] <= now]
+                pending = [(addr, self._buffers.pop(addr)[1]) for addr in due]
+            for addr, messages in pending:
+                self._emit(messages, addr)
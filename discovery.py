@@ -0,0 +1,200 @@
+#Sidney Chan
+#Kellie Kaw
+# Discovery reply scheduling. Replies to PING and to PROFILEs from new peers are
+# delayed by a random jitter, deduplicated per peer and rate capped, so a burst of
+# nodes booting together does not turn into a broadcast storm.
+import random
+import threading
+import time
+import protocol
+from peers import address_of
+
+
+class DiscoveryReplier:
+    def __init__(self, network_handler, profile_cache, logger, max_delay=1.0, reply_cooldown=30,
+                 broadcast_threshold=3, broadcast_interval=10):
+        self.network_handler = network_handler
+        self.profile_cache = profile_cache
+        self.logger = logger
+        self.max_delay = max_delay                      # Upper bound of the random reply jitter
+        self.reply_cooldown = reply_cooldown            # Answer the same address at most once per cooldown
+        self.broadcast_threshold = broadcast_threshold  # Pending replies at which one broadcast replaces unicasts
+        self.broadcast_interval = broadcast_interval    # Minimum gap between reply broadcasts
+        self._pending = {}     # ip -> due time
+        self._last_reply = {}  # ip -> time we last sent our profile there
+        self._last_broadcast = float('-inf')
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request_reply(self, ip):
+        """Schedules our PROFILE for a peer after a random delay. Duplicate requests are ignored."""
+        now = time.monotonic()
+        with self._cond:
+            if ip in self._pending:
+                return False
+            if now - self._last_reply.get(ip, float('-inf')) < self.reply_cooldown:
+                return False
+            self._pending[ip] = now + random.uniform(0, self.max_delay)
+            self._cond.notify()
+        return True
+
+    def reply_now(self, ip):
+        """Sends our PROFILE to a peer that asked for it directly, still honouring the cooldown."""
+        now = time.monotonic()
+        with self._cond:
+            if now - self._last_reply.get(ip, float('-inf')) < self.reply_cooldown:
+                return False
+            self._pending.pop(ip, None)
+            self._last_reply[ip] = now
+        self._send([ip])
+        return True
+
+    def note_broadcast(self):
+        """Records that our profile was just broadcast, which satisfies every pending reply."""
+        now = time.monotonic()
+        with self._cond:
+            self._last_broadcast = now
+            for ip in self._pending:
+                self._last_reply[ip] = now
+            self._pending.clear()
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                if not self._pending:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                next_due = min(self._pending.values())
+                if next_due > now:
+                    self._cond.wait(next_due - now)
+                    continue
+
+                if len(self._pending) >= self.broadcast_threshold and now - self._last_broadcast >= self.broadcast_interval:
+                    # Enough peers are waiting that a single broadcast is cheaper than unicasts
+                    targets = None
+                    self._last_broadcast = now
+                    for ip in self._pending:
+                        self._last_reply[ip] = now
+                    self._pending.clear()
+                else:
+                    targets = [ip for ip, due in self._pending.items() if due <= now]
+                    for ip in targets:
+                        del self._pending[ip]
+                        self._last_reply[ip] = now
+                self._prune(now)
+
+            self._send(targets)
+
+    def _prune(self, now):
+        if len(self._last_reply) > 1024:
+            cutoff = now - self.reply_cooldown
+            self._last_reply = {ip: t for ip, t in self._last_reply.items() if t >= cutoff}
+
+    def _send(self, targets):
+        frame = self.profile_cache.frame()
+        try:
+            if targets is None:
+                self.network_handler.broadcast(frame)
+                self.logger.log(self.profile_cache.message, origin="Broadcast")
+            else:
+                for ip in targets:
+                    self.network_handler.unicast(frame, ip)
+                    self.logger.log(self.profile_cache.message, origin=f"Sent to {ip}")
+        except OSError:
+            pass  # Socket closed during shutdown
+
+
+class DirectorySync:
+    """Bootstraps a freshly started node from its first neighbors' peer directories.
+
+    The first few peers discovered after startup are asked for a PEER_LIST digest;
+    profiles that are missing or stale locally are then requested directly. With a
+    relay, its directory (sent when it hears our first PING) replaces the neighbors'
+    and missing profiles are requested from the relay's cache instead.
+    """
+
+    def __init__(self, network_handler, user_id, logger, max_neighbors=2, window=30, pace_every=32, relay_id=None,
+                 retry_after=5):
+        self.network_handler = network_handler
+        self.user_id = user_id
+        self.logger = logger
+        self.max_neighbors = max_neighbors  # How many neighbors to ask for their directory
+        self.window = window                # Seconds after startup during which neighbors are asked
+        self.pace_every = pace_every        # Yield briefly after this many profile requests
+        self.relay_id = relay_id
+        self.retry_after = retry_after      # A profile still missing this long after we asked may be asked for again
+        self.started = time.monotonic()
+        self._asked = set()
+        self._requested = {}  # peer_id -> time we last requested its profile
+        self._lock = threading.Lock()
+
+    def on_peer_discovered(self, peer_id):
+        """Asks a newly discovered peer for its directory while still bootstrapping."""
+        if self.relay_id:
+            return False
+        with self._lock:
+            if len(self._asked) >= self.max_neighbors or peer_id in self._asked:
+                return False
+            if time.monotonic() - self.started > self.window:
+                return False
+            self._asked.add(peer_id)
+        request = protocol.create_peer_list_request(self.user_id, peer_id)
+        target_addr = address_of(peer_id, self.network_handler.port)
+        self.network_handler.send_to(protocol.serialize_message(request), target_addr)
+        self.logger.log(request, origin=f"Sent to {target_addr[0]}")
+        return True
+
+    def answer(self, requester_id, online_peers):
+        """Sends our known peers as packed PEER_LIST messages."""
+        entries = [(peer_id, peer.profile_digest) for peer_id, peer in list(online_peers.items()) if peer_id != requester_id]
+        target_addr = online_peers.address(requester_id)
+        for message in protocol.create_peer_list_messages(self.user_id, requester_id, entries):
+            self.network_handler.send_to(protocol.serialize_message(message), target_addr)
+            self.logger.log(message, origin=f"Sent to {target_addr[0]}")
+
+    def missing_peers(self, message, online_peers):
+        """Returns peers from a PEER_LIST whose profile we lack or hold in a stale version."""
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            for peer_id, digest in protocol.parse_peer_list(message):
+                if peer_id == self.user_id or '@' not in peer_id:
+                    continue
+                # Still waiting on an earlier request; once it is overdue the request or reply was lost
+                if now - self._requested.get(peer_id, float('-inf')) < self.retry_after:
+                    continue
+                known = online_peers.get(peer_id)
+                if known is not None and (digest is None or known.profile_digest == digest):
+                    continue
+                self._requested[peer_id] = now
+                missing.append(peer_id)
+            if len(self._requested) > 4096:
+                self._requested = {p: t for p, t in self._requested.items() if now - t < self.retry_after}
+        return missing
+
+    def fetch_profiles(self, peer_ids):
+        """Requests each missing profile directly, pacing the burst."""
+        for i, peer_id in enumerate(peer_ids):
+            request = protocol.create_profile_request(self.user_id, peer_id)
+            target_addr = address_of(self.relay_id or peer_id, self.network_handler.port)
+            try:
+                self.network_handler.send_to(protocol.serialize_message(request), target_addr)
+            except OSError:
+                continue
+            self.logger.log(request, origin=f"Sent to {target_addr[0]}")
+            if (i + 1) % self.pace_every == 0:
+                time.sleep(0.001)
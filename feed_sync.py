@@ -0,0 +1,119 @@
+#Sidney Chan
+#Kellie Kaw
+# Anti-entropy catch-up after a peer reappears. Each side sends the other a FEED_DIGEST
+# with its high-water marks for that peer's posts and group messages; the peer answers
+# with only what lies past those marks, so catch-up traffic scales with what was missed.
+# History lookups can wait on the SQLite writer, so they run on a worker thread and the
+# receive loop only does the cheap checks.
+import queue
+import threading
+import time
+import protocol
+from peers import address_of
+
+
+class FeedSync:
+    """Asks (re)discovered peers for the posts and group messages we missed from them.
+
+    Every item is served by its own author: posts are re-sent as POSTs with their original
+    MESSAGE_ID and TIMESTAMP, group messages come from the sender's retransmit buffer and
+    pass through the normal in-order delivery path.
+    """
+
+    def __init__(self, network_handler, user_id, logger, cooldown=60, max_posts=100, max_pending=1024):
+        self.network_handler = network_handler
+        self.user_id = user_id
+        self.logger = logger
+        self.cooldown = cooldown    # Ask the same peer at most once per cooldown
+        self.max_posts = max_posts  # Newest posts re-sent per digest at most
+        self._asked = {}            # peer_id -> time we last sent it a digest
+        self._answered = {}         # address we last answered -> time, so a digest cannot be replayed for amplification
+        self._lock = threading.Lock()
+        self._work = queue.Queue(max_pending)  # (function, args) for the worker; catch-up is best effort when full
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def on_peer_discovered(self, peer_id, following, post_history, group_receiver, groups):
+        """Sends a newly (re)discovered peer our marks for it, if we follow it or share a group.
+
+        Returns True if a digest was queued.
+        """
+        follows = peer_id in following
+        marks = [mark for mark in group_receiver.marks(peer_id) if mark[0] in groups]
+        if not follows and not marks:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if now - self._asked.get(peer_id, float('-inf')) < self.cooldown:
+                return False
+            self._asked[peer_id] = now
+        return self._submit(self._send_digest, peer_id, follows, post_history, marks)
+
+    def answer(self, message, target_addr, source_addr, followers, post_history, group_sequencer, groups):
+        """Sends the requester our posts and group messages past its marks. Returns True if an answer was queued.
+
+        The reply goes to the address FROM names, so each address is answered at most once per
+        cooldown. Posts are only served to followers, and group messages only if the digest
+        came from that address.
+        """
+        requester = message.get('FROM')
+        now = time.monotonic()
+        with self._lock:
+            if now - self._answered.get(target_addr, float('-inf')) < self.cooldown:
+                return False
+            self._answered[target_addr] = now
+            if len(self._answered) > 4096:
+                self._answered = {addr: t for addr, t in self._answered.items() if now - t < self.cooldown}
+        since = message.get('POSTS_SINCE', "")
+        posts_since = int(since) if since.isdigit() and requester in followers else None
+        group_marks = protocol.parse_group_marks(message) if source_addr[0] == target_addr[0] else []
+        if posts_since is None and not group_marks:
+            return False
+        return self._submit(self._serve, requester, target_addr, posts_since, group_marks,
+                            post_history, group_sequencer, groups)
+
+    def _send_digest(self, peer_id, follows, post_history, marks):
+        posts_since = post_history.latest(peer_id) if follows else None
+        digest = protocol.create_feed_digest(self.user_id, peer_id, posts_since, marks)
+        target_addr = address_of(peer_id, self.network_handler.port)
+        self.network_handler.send_to(protocol.serialize_message(digest), target_addr)
+        self.logger.log(digest, origin=f"Sent to {target_addr[0]}")
+
+    def _serve(self, requester, target_addr, posts_since, group_marks, post_history, group_sequencer, groups):
+        frames = []
+        if posts_since is not None:
+            for record in post_history.newer_than(self.user_id, posts_since, self.max_posts):
+                post = protocol.create_post_message(self.user_id, record.content, message_id=record.message_id,
+                                                    timestamp=record.timestamp)
+                frames.append(protocol.serialize_message(post))
+        for group_id, epoch, seq in group_marks:
+            group = groups.get(group_id)
+            if group is None or requester not in group.members:
+                continue
+            if epoch != str(group_sequencer.epoch):
+                seq = 0  # We restarted since it last heard from us: everything still buffered is new to it
+            frames += [self._retoken(frame) for frame in group_sequencer.buffered_after(group_id, seq)]
+        # Sent back to back, so the coalescer packs them into a few BATCH datagrams
+        for frame in frames:
+            self.network_handler.send_to(frame, target_addr)
+
+    def _submit(self, work, *args):
+        try:
+            self._work.put_nowait((work, args))
+        except queue.Full:
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            work, args = self._work.get()
+            try:
+                work(*args)
+            except OSError:
+                pass  # Socket closed during shutdown
+
+    def _retoken(self, frame):
+        # Buffered frames may carry a token that has expired while the peer was away
+        message = protocol.parse_message(frame)
+        message['TOKEN'] = protocol.issue_token(self.user_id, "group")
+        return protocol.serialize_message(message)
@@ -0,0 +1,220 @@
+#Sidney Chan
+#Kellie Kaw
+# Windowed FILE_CHUNK streams with cumulative + selective acknowledgements.
+# The receiver ACKs every `every` chunks or after a short delay with FILE_ACK
+# (CUM = chunks received in order, SACK = ranges received beyond that); the
+# sender keeps a window of chunks in flight and resends only the gaps.
+import threading
+import time
+
+
+def format_ranges(ranges):
+    return ",".join(f"{a}-{b}" if a != b else str(a) for a, b in ranges)
+
+
+def parse_ranges(text):
+    """Parses '5-9,12' into [(5, 9), (12, 12)], skipping malformed parts."""
+    ranges = []
+    for part in (text or "").split(','):
+        a, _, b = part.partition('-')
+        try:
+            ranges.append((int(a), int(b or a)))
+        except ValueError:
+            continue
+    return ranges
+
+
+class ChunkAckTracker:
+    """Receiver side: records arriving chunk indexes and decides when to acknowledge.
+
+    send_ack(cum, sack) is called with the cumulative count and a SACK range
+    string, after `every` new chunks, `delay` seconds after an unacknowledged
+    chunk, or as soon as the last missing chunk arrives.
+    """
+
+    def __init__(self, total, send_ack, every=16, delay=0.2, max_ranges=32):
+        self.total = total
+        self.send_ack = send_ack
+        self.every = every
+        self.delay = delay
+        self.max_ranges = max_ranges
+        self.received = bytearray(total)
+        self.count = 0
+        self.cum = 0       # Every chunk below this index has arrived
+        self.highest = -1
+        self._unacked = 0  # New chunks since the last ACK
+        self._last_ack = 0.0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, index):
+        """Records a chunk. Returns False for duplicates and out-of-range indexes."""
+        with self._lock:
+            if not 0 <= index < self.total:
+                return False
+            is_new = not self.received[index]
+            if is_new:
+                self.received[index] = 1
+                self.count += 1
+                self.highest = max(self.highest, index)
+                while self.cum < self.total and self.received[self.cum]:
+                    self.cum += 1
+                self._unacked += 1
+                if self._unacked < self.every and not self.complete:
+                    if self._timer is None:
+                        self._timer = threading.Timer(self.delay, self._fire)
+                        self._timer.daemon = True
+                        self._timer.start()
+                    return True
+            elif self._unacked or time.monotonic() - self._last_ack < self.delay:
+                return False  # An ACK is already due, or one just went out
+            # Enough new chunks, the last one, or a duplicate suggesting our ACK was lost
+            self._cancel_timer()
+            ack = self._snapshot()
+        self.send_ack(*ack)
+        return is_new
+
+    @property
+    def complete(self):
+        return self.count == self.total
+
+    def missing(self):
+        return [i for i in range(self.total) if not self.received[i]]
+
+    def _snapshot(self):
+        self._unacked = 0
+        self._last_ack = time.monotonic()
+        ranges = []
+        i = self.cum
+        while i <= self.highest and len(ranges) < self.max_ranges:
+            if self.received[i]:
+                start = i
+                while i + 1 <= self.highest and self.received[i + 1]:
+                    i += 1
+                ranges.append((start, i))
+            i += 1
+        return self.cum, format_ranges(ranges)
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _fire(self):
+        with self._lock:
+            self._timer = None
+            if not self._unacked:
+                return
+            ack = self._snapshot()
+        self.send_ack(*ack)
+
+    def close(self):
+        with self._lock:
+            self._cancel_timer()
+
+
+class ChunkSender:
+    """Sender side: keeps up to `window` chunks in flight and retransmits only what is missing.
+
+    make_chunk(i) builds the FILE_CHUNK message for chunk i and send(message) puts it
+    on the wire. Chunks the receiver has SACKed past are resent right away; any other
+    chunk unacknowledged for `rto` seconds is resent. The transfer gives up after
+    `max_stalls` consecutive rto periods without progress.
+    """
+
+    def __init__(self, total, make_chunk, send, window=64, rto=1.0, max_stalls=5):
+        self.total = total
+        self.make_chunk = make_chunk
+        self.send = send
+        self.window = window
+        self.rto = rto
+        self.max_stalls = max_stalls
+        self.acked = bytearray(total)
+        self.acked_count = 0
+        self.base = 0           # Lowest unacknowledged chunk
+        self.next_new = 0       # Next chunk never sent
+        self.sent_at = {}       # chunk index -> last send time, for chunks in flight
+        self.transmissions = 0
+        self.acks = 0
+        self._gaps = set()      # Chunks the last ACK reported missing below a SACKed one
+        self._fast_resent = set()
+        self._finished = False  # The receiver confirmed the file (FILE_RECEIVED)
+        self._aborted = False   # We stopped before it did, e.g. because the peer left
+        self._cond = threading.Condition()
+
+    def on_ack(self, cum, sack):
+        """Applies a FILE_ACK. cum and sack are the parsed CUM count and SACK ranges."""
+        with self._cond:
+            self.acks += 1
+            for i in range(self.base, min(cum, self.total)):
+                self._mark(i)
+            top = -1
+            for a, b in sack:
+                for i in range(max(a, 0), min(b, self.total - 1) + 1):
+                    self._mark(i)
+                top = max(top, b)
+            self._gaps = {i for i in range(self.base, min(top, self.total)) if not self.acked[i]}
+            self._cond.notify()
+
+    def on_chunk_ack(self, index):
+        """Applies a per-chunk ACK from a peer that does not send FILE_ACK."""
+        with self._cond:
+            self._mark(index)
+            self._cond.notify()
+
+    def finish(self):
+        """Stops the transfer, e.g. once FILE_RECEIVED arrives."""
+        with self._cond:
+            self._finished = True
+            self._cond.notify()
+
+    def abort(self):
+        """Stops the transfer as failed, e.g. because the peer left."""
+        with self._cond:
+            self._aborted = True
+            self._cond.notify()
+
+    def _mark(self, i):
+        if 0 <= i < self.total and not self.acked[i]:
+            self.acked[i] = 1
+            self.acked_count += 1
+            self.sent_at.pop(i, None)
+            self._fast_resent.discard(i)
+            while self.base < self.total and self.acked[self.base]:
+                self.base += 1
+
+    def run(self):
+        """Sends the whole file. Returns True if every chunk was acknowledged, False if it was aborted or stalled."""
+        last_progress = time.monotonic()
+        progress_mark = 0
+        while True:
+            with self._cond:
+                if self._aborted:
+                    return False
+                if self._finished or self.acked_count == self.total:
+                    return self.acked_count == self.total or self._finished
+                now = time.monotonic()
+                if self.acked_count != progress_mark:
+                    progress_mark = self.acked_count
+                    last_progress = now
+                elif now - last_progress > self.rto * self.max_stalls:
+                    return False
+
+                # Each gap is fast-retransmitted once; if that copy is lost too, the rto timer resends it
+                to_send = sorted(i for i in self._gaps if not self.acked[i] and i not in self._fast_resent)
+                self._fast_resent.update(to_send)
+                self._gaps.clear()
+                resent = set(to_send)
+                to_send += [i for i, t in self.sent_at.items() if now - t >= self.rto and i not in resent]
+                while self.next_new < self.total and self.next_new - self.base < self.window:
+                    to_send.append(self.next_new)
+                    self.next_new += 1
+                for i in to_send:
+                    self.sent_at[i] = now
+                if not to_send:
+                    wait = min(self.sent_at.values(), default=now) + self.rto - now
+                    self._cond.wait(max(0.01, wait))
+                    continue
+            for i in to_send:
+                self.send(self.make_chunk(i))
+                self.transmissions += 1
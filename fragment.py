@@ -0,0 +1,189 @@
+#Sidney Chan
+#Kellie Kaw
+# Transport-level fragmentation for LSNP messages too large for one datagram.
+# Any encoded message above the threshold is sent as numbered FRAGMENT datagrams:
+# a short LSNP header, a blank line, then a raw slice of the original bytes. The
+# receiver reassembles them in a bounded buffer and NACKs only the missing pieces.
+import os
+import threading
+import time
+from collections import OrderedDict
+import protocol
+
+FRAGMENT_PREFIX = f"TYPE:{protocol.MessageType.FRAGMENT}\n".encode('utf-8')
+NACK_PREFIX = f"TYPE:{protocol.MessageType.FRAGMENT_NACK}\n".encode('utf-8')
+MAX_FRAGMENTS = 1024
+MAX_NACK_INDEXES = 256  # Keeps a NACK within one datagram; the rest are asked for next round
+
+
+def split_message(data, fragment_size):
+    """Splits encoded message bytes into FRAGMENT datagrams sharing a fresh FRAG_ID."""
+    frag_id = os.urandom(6).hex()
+    pieces = [data[i:i + fragment_size] for i in range(0, len(data), fragment_size)]
+    if len(pieces) > MAX_FRAGMENTS:
+        raise ValueError(f"Message of {len(data)} bytes needs more than {MAX_FRAGMENTS} fragments")
+    total = len(pieces)
+    return frag_id, [encode_fragment(frag_id, i, total, piece) for i, piece in enumerate(pieces)]
+
+
+def encode_fragment(frag_id, index, total, payload):
+    header = f"TYPE:{protocol.MessageType.FRAGMENT}\nFRAG_ID:{frag_id}\nINDEX:{index}\nTOTAL:{total}\n\n"
+    return header.encode('utf-8') + payload
+
+
+def decode_fragment(datagram):
+    """Returns (frag_id, index, total, payload), or None if the header is malformed."""
+    end = datagram.find(b"\n\n")
+    if end < 0:
+        return None
+    header = protocol.parse_message(datagram[:end].decode('utf-8', errors='replace'))
+    try:
+        index = int(header['INDEX'])
+        total = int(header['TOTAL'])
+    except (KeyError, ValueError):
+        return None
+    frag_id = header.get('FRAG_ID')
+    if not frag_id or not 0 <= index < total <= MAX_FRAGMENTS:
+        return None
+    return frag_id, index, total, datagram[end + 2:]
+
+
+def encode_nack(frag_id, missing):
+    message = {"TYPE": protocol.MessageType.FRAGMENT_NACK, "FRAG_ID": frag_id, "MISSING": ",".join(map(str, missing))}
+    return protocol.serialize_message(message).encode('utf-8')
+
+
+def decode_nack(datagram):
+    """Returns (frag_id, [missing indexes]), or None if malformed."""
+    message = protocol.parse_message(datagram.decode('utf-8', errors='replace'))
+    frag_id = message.get('FRAG_ID')
+    try:
+        missing = [int(i) for i in message.get('MISSING', "").split(',') if i]
+    except ValueError:
+        return None
+    return (frag_id, missing) if frag_id else None
+
+
+class SentFragments:
+    """Recently sent fragment sets, kept so that NACKed pieces can be resent.
+
+    Bounded by entry count and total bytes; the oldest sets are dropped first.
+    """
+
+    def __init__(self, max_entries=64, max_bytes=4 * 1024 * 1024, ttl=30):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # frag_id -> (sent time, [datagrams])
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, frag_id, datagrams):
+        size = sum(len(d) for d in datagrams)
+        with self._lock:
+            self._entries[frag_id] = (time.monotonic(), datagrams)
+            self._bytes += size
+            self._trim()
+
+    def get(self, frag_id, indexes):
+        """Returns the stored datagrams for the given fragment indexes."""
+        with self._lock:
+            entry = self._entries.get(frag_id)
+            if entry is None:
+                return []
+            datagrams = entry[1]
+            return [datagrams[i] for i in indexes if 0 <= i < len(datagrams)]
+
+    def _trim(self):
+        cutoff = time.monotonic() - self.ttl
+        while self._entries:
+            frag_id, (sent, datagrams) = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and self._bytes <= self.max_bytes and sent >= cutoff:
+                break
+            del self._entries[frag_id]
+            self._bytes -= sum(len(d) for d in datagrams)
+
+
+class _Partial:
+    __slots__ = ('addr', 'total', 'pieces', 'size', 'started', 'last_activity', 'nacks')
+
+    def __init__(self, addr, total, now):
+        self.addr = addr
+        self.total = total
+        self.pieces = {}
+        self.size = 0
+        self.started = now
+        self.last_activity = now
+        self.nacks = 0
+
+
+class Reassembler:
+    """Collects fragments per (sender address, FRAG_ID) until a message is complete.
+
+    Memory is bounded by the number of messages in flight and their total bytes;
+    when either limit is hit the oldest partial message is dropped. A partial that
+    stops receiving fragments is NACKed a few times, then discarded.
+    """
+
+    def __init__(self, max_messages=64, max_bytes=8 * 1024 * 1024, nack_after=0.2, max_nacks=3, timeout=10):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.nack_after = nack_after  # Silence before asking for the missing fragments
+        self.max_nacks = max_nacks
+        self.timeout = timeout        # Give up on a message this long after its first fragment
+        self._partials = OrderedDict()  # (addr, frag_id) -> _Partial
+        self._bytes = 0
+
+    def add(self, addr, frag_id, index, total, payload):
+        """Stores one fragment. Returns the complete message bytes once every piece has arrived."""
+        now = time.monotonic()
+        key = (addr, frag_id)
+        partial = self._partials.get(key)
+        if partial is None:
+            partial = self._partials[key] = _Partial(addr, total, now)
+        elif partial.total != total:
+            return None
+        partial.last_activity = now
+        if index in partial.pieces:
+            return None
+        partial.pieces[index] = payload
+        partial.nacks = 0  # Progress; allow fresh NACKs if it stalls again
+        partial.size += len(payload)
+        self._bytes += len(payload)
+
+        if len(partial.pieces) == total:
+            self._drop(key)
+            return b"".join(partial.pieces[i] for i in range(total))
+        while self._partials and (len(self._partials) > self.max_messages or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._partials)))
+        return None
+
+    def _drop(self, key):
+        partial = self._partials.pop(key, None)
+        if partial is not None:
+            self._bytes -= partial.size
+
+    def due(self):
+        """Expires stale partials and returns [(addr, frag_id, missing indexes)] that should be NACKed now."""
+        now = time.monotonic()
+        nacks = []
+        for key, partial in list(self._partials.items()):
+            if now - partial.started > self.timeout or (partial.nacks >= self.max_nacks and now - partial.last_activity >= self.nack_after):
+                self._drop(key)
+                continue
+            if now - partial.last_activity >= self.nack_after:
+                missing = [i for i in range(partial.total) if i not in partial.pieces][:MAX_NACK_INDEXES]
+                partial.nacks += 1
+                partial.last_activity = now
+                nacks.append((partial.addr, key[1], missing))
+        return nacks
+
+    def next_deadline(self):
+        """Seconds until due() may have work to do, or None if nothing is in flight."""
+        if not self._partials:
+            return None
+        now = time.monotonic()
+        return max(0.0, min(p.last_activity + self.nack_after for p in self._partials.values()) - now)
+
+    def __len__(self):
+        return len(self._partials)
@@ -0,0 +1,54 @@
+#Sidney Chan
+#Kellie Kaw
+# Epidemic relaying of POSTs. A peer in gossip mode forwards each new post to a few
+# random peers, so posts reach readers the author cannot unicast to. Forwarding is
+# bounded by a hop count and the post's TTL, and each MESSAGE_ID is relayed once.
+import random
+import time
+from collections import OrderedDict
+
+
+class Gossip:
+    def __init__(self, fanout=3, max_hops=6, seen_limit=8192, rng=None):
+        self.fanout = fanout          # Peers each relay forwards a post to
+        self.max_hops = max_hops      # Posts that have travelled this many hops are not forwarded again
+        self.seen_limit = seen_limit  # MESSAGE_IDs remembered for deduplication
+        self.rng = rng or random.Random()
+        self._seen = OrderedDict()
+
+    def first_seen(self, message_id):
+        """Records a MESSAGE_ID. Returns False if it was already seen."""
+        if message_id in self._seen:
+            self._seen.move_to_end(message_id)
+            return False
+        self._seen[message_id] = None
+        if len(self._seen) > self.seen_limit:
+            self._seen.popitem(last=False)
+        return True
+
+    @staticmethod
+    def hops(message):
+        hops = str(message.get('HOPS', "0"))
+        return int(hops) if hops.isdigit() else 0
+
+    def should_forward(self, message, now=None):
+        if self.hops(message) >= self.max_hops:
+            return False
+        try:
+            expires = int(message['TIMESTAMP']) + int(message['TTL'])
+        except (KeyError, ValueError):
+            return False
+        return (now or time.time()) < expires
+
+    def pick_targets(self, candidates, exclude=()):
+        """Chooses up to fanout peers at random, skipping the excluded ones."""
+        pool = [c for c in candidates if c not in exclude]
+        if len(pool) <= self.fanout:
+            return pool
+        return self.rng.sample(pool, self.fanout)
+
+    def relay_copy(self, message):
+        """The message as it should be forwarded: identical apart from one more hop."""
+        relayed = dict(message)
+        relayed['HOPS'] = self.hops(message) + 1
+        return relayed
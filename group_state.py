@@ -0,0 +1,242 @@
+#Sidney Chan
+#Kellie Kaw
+# Reliable group messaging. Each sender numbers its GROUP_MESSAGEs per group (SEQ,
+# scoped by an EPOCH that changes when the client restarts). Receivers deliver in
+# order through a small reorder buffer and send GROUP_NACK only for missing numbers;
+# senders answer from a bounded retransmit buffer. A GROUP_SYNC sent once after a
+# burst carries the last SEQ, so a lost final message is noticed too.
+# Membership is a set with a version number; GROUP_UPDATEs are ADD/REMOVE deltas
+# against a BASE_VERSION, and a member that falls behind fetches a GROUP_SNAPSHOT.
+import sys
+import threading
+import time
+from collections import OrderedDict
+from file_transfer import format_ranges
+
+
+def split_members(text):
+    return {sys.intern(m.strip()) for m in (text or "").split(",") if m.strip()}
+
+
+class Group:
+    __slots__ = ('group_id', 'name', 'owner', 'members', 'version')
+
+    def __init__(self, group_id, name, owner, members=(), version=1):
+        self.group_id = group_id
+        self.name = name
+        self.owner = owner
+        self.members = set(members)  # user_ids, including the owner
+        self.version = version       # Bumped by every membership change
+
+    @classmethod
+    def from_message(cls, message):
+        """Builds a group from a GROUP_CREATE or GROUP_SNAPSHOT."""
+        version = message.get('VERSION', "1")
+        return cls(message.get('GROUP_ID'), message.get('GROUP_NAME'), message.get('FROM'),
+                   split_members(message.get('MEMBERS')), int(version) if str(version).isdigit() else 1)
+
+    def apply_update(self, message):
+        """Applies a GROUP_UPDATE's ADD/REMOVE deltas.
+
+        Returns True if applied (or already applied) and False if the update was
+        made against a version we do not have, in which case a snapshot is needed.
+        """
+        base = message.get('BASE_VERSION', "")
+        version = message.get('VERSION', "")
+        if base.isdigit() and version.isdigit():
+            if int(version) <= self.version:
+                return True  # Duplicate or older than what we hold
+            if int(base) != self.version:
+                return False
+            self.version = int(version)
+        # Updates from peers without versions are applied as they come
+        self.members |= split_members(message.get('ADD'))
+        self.members -= split_members(message.get('REMOVE'))
+        return True
+
+    def members_field(self):
+        return ",".join(sorted(self.members))
+
+
+class GroupSequencer:
+    """Sender side: numbers our messages per group and keeps recent ones for retransmission.
+
+    send_sync(group_id, last_seq) is called sync_delay seconds after the last message of a burst.
+    """
+
+    def __init__(self, send_sync=None, buffer_size=256, sync_delay=1.0):
+        self.epoch = int(time.time())
+        self.send_sync = send_sync
+        self.buffer_size = buffer_size
+        self.sync_delay = sync_delay
+        self._next = {}    # group_id -> next SEQ to assign
+        self._sent = {}    # group_id -> OrderedDict of SEQ -> serialized message
+        self._timers = {}  # group_id -> pending GROUP_SYNC timer
+        self._lock = threading.Lock()
+
+    def next_seq(self, group_id):
+        with self._lock:
+            seq = self._next.get(group_id, 1)
+            self._next[group_id] = seq + 1
+            return seq
+
+    def remember(self, group_id, seq, serialized):
+        """Keeps a sent message for NACK repair and schedules the trailing GROUP_SYNC."""
+        with self._lock:
+            sent = self._sent.setdefault(group_id, OrderedDict())
+            sent[seq] = serialized
+            while len(sent) > self.buffer_size:
+                sent.popitem(last=False)
+            if self.send_sync and group_id not in self._timers:
+                timer = threading.Timer(self.sync_delay, self._fire_sync, args=(group_id,))
+                timer.daemon = True
+                self._timers[group_id] = timer
+                timer.start()
+
+    def lookup(self, group_id, seqs):
+        """Returns the stored messages for the requested SEQs that are still buffered."""
+        with self._lock:
+            sent = self._sent.get(group_id, {})
+            return [sent[seq] for seq in seqs if seq in sent]
+
+    def last_seq(self, group_id):
+        with self._lock:
+            return self._next.get(group_id, 1) - 1
+
+    def buffered_after(self, group_id, seq):
+        """Returns the buffered messages with a SEQ above seq, oldest first."""
+        with self._lock:
+            sent = self._sent.get(group_id, {})
+            return [serialized for s, serialized in sent.items() if s > seq]
+
+    def _fire_sync(self, group_id):
+        with self._lock:
+            self._timers.pop(group_id, None)
+            last_seq = self._next.get(group_id, 1) - 1
+        if last_seq > 0:
+            self.send_sync(group_id, last_seq)
+
+    def forget(self, group_id):
+        with self._lock:
+            self._sent.pop(group_id, None)
+            timer = self._timers.pop(group_id, None)
+        if timer:
+            timer.cancel()
+
+
+class _Stream:
+    __slots__ = ('epoch', 'expected', 'known_end', 'pending', 'nacked_at', 'nacks')
+
+    def __init__(self, epoch, expected):
+        self.epoch = epoch
+        self.expected = expected   # Next SEQ to deliver
+        self.known_end = expected  # One past the highest SEQ we know the sender has sent
+        self.pending = {}          # SEQ -> message received ahead of a gap
+        self.nacked_at = 0.0
+        self.nacks = 0
+
+
+class GroupReceiver:
+    """Receiver side: per (group, sender) in-order delivery with gap detection.
+
+    Methods return (messages now deliverable in order, NACKs to send), where each NACK
+    is (group_id, sender, epoch, SEQ range string). A gap that stays unrepaired after
+    max_nacks requests, or that would overflow the reorder buffer, is skipped.
+    """
+
+    def __init__(self, reorder_limit=64, nack_interval=0.5, max_nacks=4, max_nack_span=256):
+        self.reorder_limit = reorder_limit
+        self.nack_interval = nack_interval
+        self.max_nacks = max_nacks
+        self.max_nack_span = max_nack_span  # Never ask for more than this many SEQs at once
+        self._streams = {}  # (group_id, sender) -> _Stream
+        self.skipped = 0    # Messages given up on
+        self._lock = threading.Lock()
+
+    def on_message(self, group_id, sender, epoch, seq, message):
+        with self._lock:
+            stream = self._streams.get((group_id, sender))
+            if stream is None or stream.epoch != epoch:
+                # First message we see from this sender (or it restarted): start from here
+                stream = self._streams[(group_id, sender)] = _Stream(epoch, seq)
+            if seq < stream.expected or seq in stream.pending:
+                return [], []  # Duplicate, e.g. a retransmission we no longer need
+            stream.pending[seq] = message
+            new_from = stream.known_end
+            stream.known_end = max(stream.known_end, seq + 1)
+            delivered = self._drain(stream)
+            nacks = []
+            if stream.pending:
+                if len(stream.pending) > self.reorder_limit:
+                    delivered += self._skip_gap(stream)
+                elif seq > new_from:
+                    # This message revealed a new gap; ask for just that part right away
+                    nacks = self._nack(group_id, sender, stream, time.monotonic(), start=new_from)
+            return delivered, nacks
+
+    def on_sync(self, group_id, sender, epoch, last_seq):
+        """Handles a GROUP_SYNC. Returns NACKs if the sender has sent more than we have."""
+        with self._lock:
+            stream = self._streams.get((group_id, sender))
+            if stream is None or stream.epoch != epoch:
+                self._streams[(group_id, sender)] = _Stream(epoch, last_seq + 1)
+                return []
+            stream.known_end = max(stream.known_end, last_seq + 1)
+            now = time.monotonic()
+            if stream.expected >= stream.known_end or now - stream.nacked_at < self.nack_interval:
+                return []  # Up to date, or a NACK for this gap is already out
+            return self._nack(group_id, sender, stream, now)
+
+    def marks(self, sender):
+        """(group_id, epoch, last SEQ delivered) for each stream we hold from a sender."""
+        with self._lock:
+            return [(group_id, stream.epoch, stream.expected - 1)
+                    for (group_id, s), stream in self._streams.items() if s == sender]
+
+    def due(self):
+        """Re-sends NACKs for gaps still open and skips gaps that will not be repaired."""
+        now = time.monotonic()
+        delivered, nacks = [], []
+        with self._lock:
+            for (group_id, sender), stream in self._streams.items():
+                if stream.expected >= stream.known_end or now - stream.nacked_at < self.nack_interval:
+                    continue
+                if stream.nacks >= self.max_nacks:
+                    delivered += self._skip_gap(stream)
+                else:
+                    nacks += self._nack(group_id, sender, stream, now)
+        return delivered, nacks
+
+    def _drain(self, stream):
+        delivered = []
+        while stream.expected in stream.pending:
+            delivered.append(stream.pending.pop(stream.expected))
+            stream.expected += 1
+        if delivered:
+            stream.nacks = 0
+        return delivered
+
+    def _skip_gap(self, stream):
+        # Give up on the oldest gap (or on a lost tail when nothing is buffered)
+        resume = min(stream.pending) if stream.pending else stream.known_end
+        self.skipped += resume - stream.expected
+        stream.expected = resume
+        stream.nacks = 0
+        return self._drain(stream)
+
+    def _nack(self, group_id, sender, stream, now, start=None):
+        # Every SEQ from start (default: the next expected) up to the highest known one that has not arrived
+        start = stream.expected if start is None else max(start, stream.expected)
+        upper = min(stream.known_end, start + self.max_nack_span)
+        missing = [seq for seq in range(start, upper) if seq not in stream.pending]
+        if not missing:
+            return []
+        stream.nacked_at = now
+        stream.nacks += 1
+        ranges = []
+        for seq in missing:
+            if ranges and ranges[-1][1] == seq - 1:
+                ranges[-1][1] = seq
+            else:
+                ranges.append([seq, seq])
+        return [(group_id, sender, stream.epoch, format_ranges(ranges))]
@@ -14,9 +14,9 @@ class Logger:
 
     def _get_display_name(self, user_id):
         # Return display name if known, else user_id (for non verbose printing)
-        peer_info = self.online_peers.get(user_id)
-        if peer_info:
-            return peer_info.get('DISPLAY_NAME') or user_id
+        peer = self.online_peers.get(user_id)
+        if peer:
+            return peer.display_name or user_id
         return user_id
     
     def log(self, message, origin=None):
@@ -76,7 +76,8 @@ class Logger:
             print_safe(f"You've been added to {message.get('GROUP_NAME')}")
         elif msg_type == protocol.MessageType.GROUP_UPDATE:
             group_id = message.get("GROUP_ID")
-            group_name = self.groups.get(group_id, {}).get("GROUP_NAME", "Unknown Group")
+            group = self.groups.get(group_id)
+            group_name = group.name if group else "Unknown Group"
             print_safe(f"The group \"{group_name}\" member list was updated")
         elif msg_type == protocol.MessageType.GROUP_MESSAGE:
             if from_id == self.user_id: 
@@ -2,40 +2,71 @@
 #Kellie Kaw
 import secrets
 import protocol
-from network import NetworkHandler
+from network import NetworkHandler, multicast_address
 from logger import Logger
 import time
 import argparse
 import threading
-from collections import defaultdict
 import math
 import base64
 import socket
 import os   
+import queue
 from shared import print_safe 
-from tictactoe import TicTacToe
+from tictactoe import GameTable
+from bots import BOTS
+from tokens import RevocationStore, TokenManager
+from profile_cache import ProfileCache
+from avatar_cache import AvatarCache, hash_avatar
+from discovery import DiscoveryReplier, DirectorySync
+from feed_sync import FeedSync
+from peers import PeerTable, AdaptiveHeartbeat, address_of
+from storage import History, PostIndex, StoredMessage, to_timestamp
+from persistence import SQLiteStore, GROUP_KIND
+from search import SearchIndex, SearchHit, parse_query, fts_query, KINDS
+from file_transfer import ChunkAckTracker, ChunkSender, parse_ranges
+from group_state import Group, GroupSequencer, GroupReceiver, split_members
+from gossip import Gossip
+from outbox import Outbox, RecentIds
 
 # --- Data Structures ---
-online_peers = {}
-message_history = defaultdict(list) # Stores posts and DMs
-post_history = defaultdict(list)
+online_peers = PeerTable() # Evicts peers that stop sending traffic
+message_history = History() # DMs per peer, stored as compact StoredMessage records
+post_history = PostIndex() # Posts indexed by (author, TIMESTAMP) and MESSAGE_ID, with like counts
+group_history = History() # GROUP_MESSAGEs per group_id
+search_index = SearchIndex() # Inverted index over this session's DMs, posts and group messages
 followers = set()
 following = set()
 incoming_files = {}
 pending_file_offers = {}
 sent_file_offers = {}
 retry_counts = {}
-pending_chunks = {}
-groups = {}
+pending_chunks = {} # chunk MESSAGE_ID -> (fileid, chunk index), for peers that ACK each chunk
+outgoing_transfers = {} # fileid -> ChunkSender
+completed_files = {} # fileid -> (sender user_id, total chunks), to re-ACK late retransmissions
+group_sequencer = GroupSequencer() # SEQs and a retransmit buffer for the group messages we send
+group_receiver = GroupReceiver() # In-order delivery and gap NACKs for group messages we receive
+post_gossip = Gossip() # Deduplicates POSTs by MESSAGE_ID and picks relay targets
+relay_posts = False # Set by --gossip: forward new posts to a few random peers
+relay_id = None # Set by --relay: a relay answers discovery and serves profiles and avatars
+outbox = Outbox() # DMs, follows and likes awaiting an ACK, queued per peer while it is away
+delivered_ids = RecentIds() # MESSAGE_IDs of reliable messages already handled, to drop resends
+RELIABLE_TYPES = (protocol.MessageType.DM, protocol.MessageType.FOLLOW, protocol.MessageType.UNFOLLOW, protocol.MessageType.LIKE)
+groups = {} # group_id -> Group (membership set + version)
+snapshot_requests = {} # group_id -> owner we asked for its GROUP_SNAPSHOT
 liked_posts = {}
-issued_tokens = set()
-revoked_tokens = set()
+token_manager = TokenManager(protocol.create_token) # Reuses live tokens per scope and tracks all issued
+revoked_tokens = RevocationStore() # Forgets tokens once they expire
 show_only_group_messages = False
 sent_invites = {}
-received_invites = {}
-active_game_ids = set()
-active_games = {}
-game_in_progress = False
+games = GameTable() # Active Tic-Tac-Toe games by GAMEID; hands out our own GAMEIDs
+ttt_bot = None # Set by --bot: picks our Tic-Tac-Toe moves instead of asking
+game_turns = queue.Queue() # (opponent, GAMEID, game) where it is our move: queued by the receive loop, played by the input thread
+heartbeat = AdaptiveHeartbeat() # PING period, shortened while peers churn
+store = None # SQLiteStore when running with --db
+avatar_cache = AvatarCache() # Content-addressed, LRU-evicted avatar store
+own_avatar = {} # 'hash', 'type' and base64 'data' of our avatar, served on AVATAR_REQUEST
+pending_avatar_requests = {} # avatar hash -> threading.Event set when the bytes arrive
 
 
 expected_scope_map = {
@@ -46,10 +77,16 @@ expected_scope_map = {
     protocol.MessageType.UNFOLLOW: "follow",
     protocol.MessageType.FILE_OFFER: "file",
     protocol.MessageType.FILE_CHUNK: "file",
+    protocol.MessageType.FILE_ACK: "file",
     protocol.MessageType.REVOKE: "chat",
     protocol.MessageType.GROUP_CREATE: "group",
     protocol.MessageType.GROUP_UPDATE: "group",
     protocol.MessageType.GROUP_MESSAGE: "group",
+    protocol.MessageType.GROUP_NACK: "group",
+    protocol.MessageType.GROUP_SYNC: "group",
+    protocol.MessageType.GROUP_SNAPSHOT_REQUEST: "group",
+    protocol.MessageType.GROUP_SNAPSHOT: "group",
+    protocol.MessageType.FEED_DIGEST: "broadcast",
     protocol.MessageType.TICTACTOE_INVITE: "game",
     protocol.MessageType.TICTACTOE_MOVE: "game",
     protocol.MessageType.TICTACTOE_RESULT: "game"
@@ -69,11 +106,13 @@ def send_file_offer_with_retry(network_handler, user_id, logger, target_user_id,
         'fileid': fileid,
         'filesize': filesize
     }
-    target_ip = target_user_id.split('@')[1]
+    target_addr = online_peers.address(target_user_id)
     
     for i in range(3):
-        network_handler.unicast(protocol.serialize_message(file_offer_message), target_ip)
-        logger.log(file_offer_message, origin=f"Sent to {target_ip} (attempt {i+1})")
+        if online_peers.is_departed(target_user_id): # Don't burn retries on a peer that left
+            break
+        network_handler.send_to(protocol.serialize_message(file_offer_message), target_addr)
+        logger.log(file_offer_message, origin=f"Sent to {target_addr[0]} (attempt {i+1})")
         time.sleep(10) # Wait for 10 seconds for an ACK
         if message_id not in sent_file_offers: # ACK received
             return
@@ -82,41 +121,139 @@ def send_file_offer_with_retry(network_handler, user_id, logger, target_user_id,
         print_safe(f"\n> No response for file offer {message_id}. Giving up.")
         del sent_file_offers[message_id]
 
-def send_chunk_with_retry(network_handler, user_id, logger, target_user_id, fileid, i, total_chunks, chunk_data):
-    encoded_chunk = base64.b64encode(chunk_data).decode('utf-8')
-    chunk_message = protocol.create_file_chunk_message(user_id, target_user_id, fileid, i, total_chunks, len(encoded_chunk), encoded_chunk)
-    message_id = chunk_message['MESSAGE_ID']
-    pending_chunks[message_id] = chunk_message
-    target_ip = target_user_id.split('@')[1]
-
-    for _ in range(3):
-        network_handler.unicast(protocol.serialize_message(chunk_message), target_ip)
-        logger.log(chunk_message, origin=f"Sent to {target_ip} (chunk {i+1}/{total_chunks})")
-        time.sleep(1) # Wait for 1 second for an ACK
-        if message_id not in pending_chunks: # ACK received
-            return
-
-    if message_id in pending_chunks:
-        print_safe(f"\n> No response for chunk {i+1}. Giving up.")
-        del pending_chunks[message_id]
-
-def generate_gameid():
-    for i in range (256):
-        game_id = f"g{i}"
-        if game_id not in active_game_ids:
-            active_game_ids.add(game_id)
-            return game_id
-        
-    raise RuntimeError("No available game IDs")
+CHUNK_SIZE = 640 # Keeps each base64 FILE_CHUNK under the 1200-byte fragmentation threshold
+
+def send_file_chunks(network_handler, user_id, logger, target_user_id, filepath, fileid, filesize):
+    """Streams a file with a window of chunks in flight; FILE_ACKs say which chunks to resend."""
+    total_chunks = max(1, math.ceil(filesize / CHUNK_SIZE))
+    target_addr = online_peers.address(target_user_id)
+
+    with open(filepath, 'rb') as f:
+        def make_chunk(i):
+            f.seek(i * CHUNK_SIZE)
+            encoded_chunk = base64.b64encode(f.read(CHUNK_SIZE)).decode('utf-8')
+            chunk_message = protocol.create_file_chunk_message(user_id, target_user_id, fileid, i, total_chunks, len(encoded_chunk), encoded_chunk)
+            pending_chunks[chunk_message['MESSAGE_ID']] = (fileid, i)
+            return chunk_message
+
+        def send(chunk_message):
+            if online_peers.is_departed(target_user_id): # Don't burn retries on a peer that left
+                transfer.abort()
+                return
+            network_handler.send_to(protocol.serialize_message(chunk_message), target_addr)
+            logger.log(chunk_message, origin=f"Sent to {target_addr[0]} (chunk {chunk_message['CHUNK_INDEX']+1}/{total_chunks})")
+
+        transfer = ChunkSender(total_chunks, make_chunk, send)
+        outgoing_transfers[fileid] = transfer
+        try:
+            if not transfer.run():
+                print_safe(f"\n> No response for file {fileid}. Giving up.")
+        finally:
+            del outgoing_transfers[fileid]
+            for message_id in [m for m, (fid, _) in list(pending_chunks.items()) if fid == fileid]:
+                pending_chunks.pop(message_id, None)
+
+def send_file_ack(network_handler, user_id, logger, target_user_id, fileid, cum, sack):
+    file_ack = protocol.create_file_ack_message(user_id, target_user_id, fileid, cum, sack)
+    target_addr = online_peers.address(target_user_id)
+    network_handler.send_to(protocol.serialize_message(file_ack), target_addr)
+    logger.log(file_ack, origin=f"Sent to {target_addr[0]}")
+
+def send_reliable(message, target_user_id, logger):
+    """Sends a DM, FOLLOW, UNFOLLOW or LIKE through the outbox, which keeps it until it is ACKed."""
+    if outbox.submit(target_user_id, message, online=not online_peers.is_departed(target_user_id)):
+        logger.log(message, origin=f"Sent to {online_peers.address(target_user_id)[0]}")
+    else:
+        print_safe(f"{target_user_id} is offline; the message will be delivered when they are back.")
+
+def is_known_peer(peer_id):
+    # Peers that went quiet are still valid targets; the outbox holds messages for them
+    return peer_id in online_peers or online_peers.is_departed(peer_id)
+
+def persist_group(group_id):
+    if store:
+        group = groups[group_id]
+        store.save_group(group_id, group.name, group.owner, group.members_field(), group.version)
+
+def group_audience(group_id):
+    return multicast_address(f"group:{group_id}")
+
+def follower_audience(poster_id):
+    return multicast_address(f"followers:{poster_id}")
+
+def send_to_audience(network_handler, serialized, audience, recipients):
+    """Delivers a message to recipients with one multicast to the audience address,
+    unicasting only to peers that have not advertised multicast support."""
+    recipients = [r for r in recipients if not online_peers.is_departed(r)]
+    unicast_to = []
+    for recipient in recipients:
+        peer = online_peers.get(recipient)
+        if peer is None or not peer.multicast:
+            unicast_to.append(recipient)
+    if len(unicast_to) < len(recipients) and not network_handler.multicast(serialized, audience):
+        unicast_to = recipients
+    for recipient in unicast_to:
+        network_handler.send_to(serialized, online_peers.address(recipient))
+
+def group_members(group_id):
+    group = groups.get(group_id)
+    return group.members if group else set()
+
+def request_group_snapshot(network_handler, user_id, group_id, owner, logger):
+    request = protocol.create_group_snapshot_request(user_id, owner, group_id)
+    snapshot_requests[group_id] = owner
+    if len(snapshot_requests) > 256:
+        snapshot_requests.pop(next(iter(snapshot_requests)))
+    target_addr = online_peers.address(owner)
+    network_handler.send_to(protocol.serialize_message(request), target_addr)
+    logger.log(request, origin=f"Sent to {target_addr[0]}")
+
+def leave_group(network_handler, group_id):
+    network_handler.leave_group(group_audience(group_id))
+    group_sequencer.forget(group_id)
+    if groups.pop(group_id, None) and store:
+        store.delete_group(group_id)
+    if group_id in group_history:
+        del group_history[group_id] # Also drops its messages from search
+
+def send_group_sync(network_handler, user_id, group_id, last_seq):
+    if group_id not in groups:
+        return
+    sync = protocol.create_group_sync(user_id, group_id, group_sequencer.epoch, last_seq)
+    send_to_audience(network_handler, protocol.serialize_message(sync), group_audience(group_id), group_members(group_id) - {user_id})
+
+def send_group_nacks(network_handler, user_id, nacks, logger):
+    for group_id, sender, epoch, seqs in nacks:
+        nack = protocol.create_group_nack(user_id, sender, group_id, epoch, seqs)
+        target_addr = online_peers.address(sender)
+        network_handler.send_to(protocol.serialize_message(nack), target_addr)
+        logger.log(nack, origin=f"Sent to {target_addr[0]}")
+
+def deliver_group_messages(messages, logger, origin):
+    # Group messages are logged when delivered in order, not when they arrive
+    for message in messages:
+        logger.log(message, origin=origin)
+        group_history.append(message.get("GROUP_ID"), StoredMessage.from_message(message))
+
+def restore_state():
+    """Restores follows, groups and likes from the store. Histories load lazily per peer."""
+    followers.update(store.load_follows("follower"))
+    following.update(store.load_follows("following"))
+    for group_id, group_name, owner, members, version in store.load_groups():
+        groups[group_id] = Group(group_id, group_name, owner, split_members(members), version)
+    for author, post_timestamp in store.load_likes():
+        liked_posts[(author, post_timestamp)] = None
 
 def send_ttt_invite_with_retry(user_id, target_user_id, gameid, symbol, network_handler, logger):
     msg = protocol.create_ttt_invite(user_id, target_user_id, gameid, symbol)
-    target_ip = target_user_id.split('@')[1]
+    target_addr = online_peers.address(target_user_id)
     message_id = msg['MESSAGE_ID']
     sent_invites[message_id] = msg
 
     for attempt in range(3):
-        network_handler.unicast(protocol.serialize_message(msg), target_ip)
+        if online_peers.is_departed(target_user_id):
+            break
+        network_handler.send_to(protocol.serialize_message(msg), target_addr)
         logger.log(msg)
         time.sleep(10)
         if message_id not in sent_invites:
@@ -125,46 +262,48 @@ def send_ttt_invite_with_retry(user_id, target_user_id, gameid, symbol, network_
     if message_id in sent_invites:
         print_safe(f"\n> No response from {target_user_id}. Giving up.")
         del sent_invites[message_id]
+        games.release(gameid)
 
-def end_condition(ttt_game, user_id, opponent_id, gameid, symbol, target_ip, network_handler, logger):
-    global game_in_progress
+def end_condition(ttt_game, user_id, opponent_id, gameid, symbol, target_addr, network_handler, logger):
     if ttt_game.winner:
         print_safe(f"Game over! Winner: {ttt_game.winner}")
         winning_line = ','.join(map(str, ttt_game.winning_line))
         result_msg = protocol.create_ttt_result(user_id, opponent_id, gameid, "WIN", symbol, winning_line)
-        network_handler.unicast(protocol.serialize_message(result_msg), target_ip)
+        network_handler.send_to(protocol.serialize_message(result_msg), target_addr)
         logger.log(result_msg)
         ttt_game.print_board()
-        game_in_progress = False
+        games.end(opponent_id, gameid)
         return True
     elif ttt_game.is_draw:
         print_safe("Game ended in a draw.")
         result_msg = protocol.create_ttt_result(user_id, opponent_id, gameid, "DRAW", symbol, None)
-        network_handler.unicast(protocol.serialize_message(result_msg), target_ip)
+        network_handler.send_to(protocol.serialize_message(result_msg), target_addr)
         logger.log(result_msg)
         ttt_game.print_board()
-        game_in_progress = False
+        games.end(opponent_id, gameid)
         return True
     return False
 
 def make_move(gameid, ttt_game, user_id, network_handler, logger):
-    global game_in_progress
-    game_in_progress = True
+    """Prompts for and sends our move. Only called from the input thread, unless a bot plays for us."""
     while True:
         symbol = ttt_game.my_symbol
         turn_number = ttt_game.turn
         opponent_id = ttt_game.player_o if symbol == "X" else ttt_game.player_x
-        target_ip = opponent_id.split('@')[1]
+        target_addr = online_peers.address(opponent_id)
 
-        if end_condition(ttt_game, user_id, opponent_id, gameid, symbol, target_ip, network_handler, logger):
+        if end_condition(ttt_game, user_id, opponent_id, gameid, symbol, target_addr, network_handler, logger):
             return
 
         ttt_game.print_board()
-        try:
-            pos = int(input("Enter your move position (0-8): ").strip())
-        except ValueError:
-            print_safe("Invalid input. Please enter a number from 0 to 8.")
-            continue
+        if ttt_bot:
+            pos = ttt_bot.choose_move(ttt_game, symbol)
+        else:
+            try:
+                pos = int(input("Enter your move position (0-8): ").strip())
+            except ValueError:
+                print_safe("Invalid input. Please enter a number from 0 to 8.")
+                continue
 
         
         success, msg = ttt_game.make_move(symbol, pos, turn_number, user_id)
@@ -173,36 +312,57 @@ def make_move(gameid, ttt_game, user_id, network_handler, logger):
             continue
 
         move_msg = protocol.create_ttt_move(user_id, opponent_id, gameid, pos, symbol, turn_number)
-        network_handler.unicast(protocol.serialize_message(move_msg), target_ip)
+        network_handler.send_to(protocol.serialize_message(move_msg), target_addr)
         logger.log(move_msg)
         print_safe(f"Move accepted at position {pos}.")
 
-        if end_condition(ttt_game, user_id, opponent_id, gameid, symbol, target_ip, network_handler, logger):
+        if end_condition(ttt_game, user_id, opponent_id, gameid, symbol, target_addr, network_handler, logger):
             return
         
         break
-        
 
+def queue_turn(opponent_id, gameid):
+    # Called from the receive loop, which must never wait on input()
+    ttt_game = games.get(opponent_id, gameid)
+    game_turns.put((opponent_id, gameid, ttt_game))
+    if ttt_game and (ttt_game.winner or ttt_game.is_draw):
+        print_safe(f"\n> Game {gameid} is over. Press Enter to see the result.")
+    else:
+        print_safe(f"\n> Your move in game {gameid}. Press Enter to play.")
+
+def play_queued_turns(network_handler, user_id, logger):
+    """Prompts for our move in each game whose turn came up while the menu was open."""
+    while True:
+        try:
+            opponent_id, gameid, ttt_game = game_turns.get_nowait()
+        except queue.Empty:
+            return
+        # A finished game is still shown even if the opponent's RESULT already removed it
+        if ttt_game and (games.get(opponent_id, gameid) is ttt_game or ttt_game.winner or ttt_game.is_draw):
+            make_move(gameid, ttt_game, user_id, network_handler, logger)
 
-def broadcast_profile(network_handler, profile_message, logger):
+
+def broadcast_profile(network_handler, profile_cache, logger, discovery_replier=None):
     """Periodically broadcasts the user's profile."""
     while not shutdown_event.is_set():
-        serialized_message = protocol.serialize_message(profile_message)
-        network_handler.broadcast(serialized_message)
-        logger.log(profile_message, origin="Broadcast")
+        network_handler.broadcast(profile_cache.frame())
+        if discovery_replier:
+            discovery_replier.note_broadcast() # The broadcast answers any pending replies
+        logger.log(profile_cache.message, origin="Broadcast")
         time.sleep(300) # Broadcast every 5 minutes as per spec
 
-# Broadcast ping every 5 minutes
+# Broadcast ping every 30s-5min depending on peer churn; the interval is advertised so peers know when to expire us
 def broadcast_ping(network_handler, user_id, logger):
     while not shutdown_event.is_set():
-        ping_message = protocol.create_ping_message(user_id)
+        interval = heartbeat.next_interval()
+        ping_message = protocol.create_ping_message(user_id, interval)
         network_handler.broadcast(protocol.serialize_message(ping_message))
         logger.log(ping_message, origin="Broadcast")
-        time.sleep(300)
+        shutdown_event.wait(interval)
 
 def send_revoke_messages(network_handler, user_id, tokens):
-    for token in tokens:
-        revoke_message = protocol.create_revoke_message(user_id, token)
+    # Tokens are packed into a few bulk REVOKE messages instead of one datagram each
+    for revoke_message in protocol.create_bulk_revoke_messages(user_id, tokens):
         network_handler.broadcast(protocol.serialize_message(revoke_message))
 
 def print_menu():
@@ -213,7 +373,8 @@ def print_menu():
     print_safe("[4] Files")
     print_safe("[5] Groups")
     print_safe("[6] Tic-Tac-Toe")
-    print_safe("[7] Exit")
+    print_safe("[7] Search")
+    print_safe("[8] Exit")
 
 def posts_menu():
     print_safe("\n--- Posts Menu ---")
@@ -257,84 +418,156 @@ def ttt_menu():
     print_safe("[2] Accept Invite")
     print_safe("[3] Back")
     
+PAGE_SIZE = 10
+
 def display_posts(user_id):
-    if post_history[user_id]:
-        print_safe(f"--- Posts by {user_id} ---")
-        for post in post_history[user_id]:
-            print_safe(f"{user_id} [{post.get('TIMESTAMP')}]: {post.get('CONTENT')}")
-    else:
+    # Newest first, one page at a time
+    page = 0
+    posts, more = post_history.page(user_id, page, PAGE_SIZE)
+    if not posts:
         print_safe(f"No posts found by {user_id}.")
+        return
+    print_safe(f"--- Posts by {user_id} ---")
+    while True:
+        for post in posts:
+            likes = post_history.like_count(user_id, post.timestamp)
+            like_note = f" ({likes} like{'s' if likes != 1 else ''})" if likes else ""
+            print_safe(f"{user_id} [{post.timestamp}]: {post.content}{like_note}")
+        if not more or input("Show older posts? (y/n): ").strip().lower() != 'y':
+            return
+        page += 1
+        posts, more = post_history.page(user_id, page, PAGE_SIZE)
 
 def display_liked_posts():
     if not liked_posts:
         print_safe("No liked posts.")
         return
     print_safe("--- Liked Posts ---")
-    for (user_id, timestamp) in liked_posts:
-        user_posts = post_history.get(user_id, [])
-        # Find the post with that timestamp
-        for post in user_posts:
-            if post.get("TIMESTAMP") == timestamp:
-                content = post.get("CONTENT")
-                print_safe(f"{user_id} [{timestamp}]: {content}")
-                break
+    keys = list(liked_posts)[::-1] # Most recently liked first
+    for start in range(0, len(keys), PAGE_SIZE):
+        if start and input("Show more? (y/n): ").strip().lower() != 'y':
+            return
+        for (user_id, timestamp) in keys[start:start + PAGE_SIZE]:
+            post = post_history.get_post(user_id, timestamp)
+            if post:
+                print_safe(f"{user_id} [{timestamp}]: {post.content}")
 
 def display_groups():
     if not groups:
         print_safe("No groups yet.")
         return
     print_safe("--- Groups ---")
-    for group_id, group_info in groups.items():
-        name = group_info.get("GROUP_NAME", "Unnamed Group")
-        members = group_info.get("MEMBERS", "")
+    for group_id, group in groups.items():
         print_safe(f"Group ID: {group_id}")
-        print_safe(f"Name: {name}")
-        print_safe(f"Members: {members}")
+        print_safe(f"Name: {group.name or 'Unnamed Group'}")
+        print_safe(f"Members: {', '.join(sorted(group.members))}")
         print_safe("-" * 14)
 
+def display_search_results(text):
+    query, filters = parse_query(text)
+    if filters.get("kind") and filters["kind"] not in KINDS:
+        print_safe(f"Unknown kind. Use one of: {', '.join(KINDS)}")
+        return
+    start = time.perf_counter()
+    hits = search_index.search(query, **filters)
+    if store:
+        # This session's messages come from memory; everything persisted, from SQLite. Recent
+        # messages can be in both while their write is queued, so drop the duplicates
+        seen = {(hit.kind, hit.scope, hit.record.sender, hit.record.timestamp, hit.record.content) for hit in hits}
+        for score, kind, scope, record in store.search(fts_query(query), **filters):
+            if (kind, scope, record.sender, record.timestamp, record.content) not in seen:
+                hits.append(SearchHit(score, kind, scope, record))
+        hits.sort(key=lambda hit: (hit.score, hit.record.timestamp), reverse=True)
+        hits = hits[:20]
+    elapsed = (time.perf_counter() - start) * 1000
+    if not hits:
+        print_safe("No matching messages.")
+        return
+    print_safe(f"--- {len(hits)} result{'s' if len(hits) != 1 else ''} ({elapsed:.1f} ms) ---")
+    for hit in hits:
+        record = hit.record
+        where = f"group {hit.scope}" if hit.kind == GROUP_KIND else f"{hit.kind} with {hit.scope}"
+        print_safe(f"[{record.timestamp}] ({where}) {record.sender}: {record.content}")
+
 def display_pending_invites():
     print_safe("Pending Invites:")
-    for gid, invite in received_invites.items():
+    for (_, gid), invite in games.invites():
         print_safe(f"Game ID: {gid}, from {invite['FROM']} as {invite['SYMBOL']}")
 
-def view_profile(user_id):
+def view_profile(user_id, network_handler, own_user_id, logger):
     """Display a user's profile and download their avatar if available."""
     if user_id not in online_peers:
         print_safe(f"User '{user_id}' not found in online peers.")
         return
     
-    peer_info = online_peers[user_id]
-    display_name = peer_info.get('DISPLAY_NAME', 'N/A')
-    status = peer_info.get('STATUS', 'N/A')
+    peer = online_peers[user_id]
+    display_name = peer.display_name if peer.display_name is not None else 'N/A'
+    status = peer.status if peer.status is not None else 'N/A'
     
     print_safe(f"\n--- Profile for {user_id} ---")
     print_safe(f"Display Name: {display_name}")
     print_safe(f"Status: {status}")
     
     # Check if user has an avatar
-    if 'AVATAR_DATA' in peer_info and peer_info['AVATAR_DATA']:
-        print_safe("User has an avatar.")
+    if peer.has_avatar:
+        print_safe(f"User has an avatar ({peer.avatar_size or '?'} bytes).")
         download_avatar = input("Download avatar? (y/n): ").strip().lower()
         if download_avatar == 'y':
-            download_user_avatar(user_id)
+            download_user_avatar(user_id, network_handler, own_user_id, logger)
     else:
         print_safe("User has no avatar.")
 
-def download_user_avatar(user_id):
+def absorb_inline_avatar(message):
+    """Replaces a legacy inline AVATAR_DATA with its hash and size.
+
+    The bytes are only cached if we are waiting for that avatar; anyone can broadcast a
+    PROFILE, and unrequested images would evict real avatars from the disk cache.
+    """
+    avatar_data = message.pop('AVATAR_DATA', None)
+    message.pop('AVATAR_ENCODING', None)
+    if not avatar_data:
+        return
+    try:
+        image_data = base64.b64decode(avatar_data)
+    except ValueError:
+        return
+    avatar_hash = hash_avatar(image_data)
+    message['AVATAR_HASH'] = avatar_hash
+    message['AVATAR_SIZE'] = len(image_data)
+    arrived = pending_avatar_requests.get(avatar_hash)
+    if arrived and avatar_cache.put(image_data, expected_hash=avatar_hash):
+        arrived.set()
+
+def fetch_avatar(network_handler, own_user_id, peer_id, avatar_hash, logger, timeout=3):
+    """Returns avatar bytes from the cache, requesting them from the peer only on a miss."""
+    image_data = avatar_cache.get(avatar_hash)
+    if image_data is not None:
+        return image_data
+
+    arrived = pending_avatar_requests.setdefault(avatar_hash, threading.Event())
+    request = protocol.create_avatar_request(own_user_id, peer_id, avatar_hash)
+    target_addr = online_peers.address(relay_id or peer_id)
+    network_handler.send_to(protocol.serialize_message(request), target_addr)
+    logger.log(request, origin=f"Sent to {target_addr[0]}")
+    arrived.wait(timeout)
+    pending_avatar_requests.pop(avatar_hash, None)
+    return avatar_cache.get(avatar_hash)
+
+def download_user_avatar(user_id, network_handler, own_user_id, logger):
     """Download and save a user's avatar."""
     if user_id not in online_peers:
         print_safe(f"User '{user_id}' not found.")
         return
     
-    peer_info = online_peers[user_id]
+    peer = online_peers[user_id]
     
-    # Check if user has avatar data
-    if 'AVATAR_DATA' not in peer_info or not peer_info['AVATAR_DATA']:
+    # Check if user has an avatar
+    avatar_hash = peer.avatar_hash
+    if not avatar_hash:
         print_safe(f"User '{user_id}' has no avatar to download.")
         return
     
-    avatar_data = peer_info['AVATAR_DATA']
-    avatar_type = peer_info.get('AVATAR_TYPE', 'image/png')
+    avatar_type = peer.avatar_type or 'image/png'
     
     # Determine file extension based on MIME type
     if 'jpeg' in avatar_type or 'jpg' in avatar_type:
@@ -349,10 +582,12 @@ def download_user_avatar(user_id):
     # Create filename
     filename = f"avatar_{user_id.split('@')[0]}{ext}"
     
+    image_data = fetch_avatar(network_handler, own_user_id, user_id, avatar_hash, logger)
+    if image_data is None:
+        print_safe(f"Could not fetch avatar from {user_id}.")
+        return
+
     try:
-        # Decode base64 data and save to file
-        import base64
-        image_data = base64.b64decode(avatar_data)
         with open(filename, 'wb') as f:
             f.write(image_data)
         print_safe(f"Avatar saved as '{filename}'")
@@ -361,12 +596,9 @@ def download_user_avatar(user_id):
 
 def handle_user_input(network_handler, user_id, logger):
     """Handles commands typed by the user."""
-    global game_in_progress
     while True:
         try:
-            if game_in_progress:
-                time.sleep(2)
-                continue
+            play_queued_turns(network_handler, user_id, logger)
             print_menu()
             select = input("> ").strip()
             if not select:
@@ -385,24 +617,30 @@ def handle_user_input(network_handler, user_id, logger):
                         case "2": # create post
                             content = input("Enter your post: ")
                             post_message = protocol.create_post_message(user_id, content)
-                            post_history[user_id] = post_message
-                            issued_tokens.add(post_message["TOKEN"])
-                            for follower in followers:
-                                target_ip = follower.split('@')[1]
-                                network_handler.unicast(protocol.serialize_message(post_message), target_ip)
-                                logger.log(post_message, origin="Sent")
+                            post_history.append(user_id, StoredMessage.from_message(post_message))
+                            serialized = protocol.serialize_message(post_message)
+                            send_to_audience(network_handler, serialized, follower_audience(user_id), followers)
+                            post_gossip.first_seen(post_message["MESSAGE_ID"])
+                            if relay_posts:
+                                # Also seed a few random non-followers, who relay it onwards
+                                for target in post_gossip.pick_targets(list(online_peers), exclude=followers):
+                                    network_handler.send_to(serialized, online_peers.address(target))
+                            logger.log(post_message, origin="Sent")
                         case "3": # like
                             target_user_id = input("Like post by (user_id): ")
-                            if target_user_id not in online_peers:
+                            if not is_known_peer(target_user_id):
                                 print_safe(f"Error: Peer '{target_user_id}' not found.")
                                 continue
                             display_posts(target_user_id)
-                            post_timestamp = input("Enter timestamp of post: ")
+                            post_timestamp = input("Enter timestamp of post: ").strip()
+                            if to_timestamp(post_timestamp) is None:
+                                print_safe(f"Error: '{post_timestamp}' is not a valid timestamp.")
+                                continue
                             like_message = protocol.create_like_message(user_id, target_user_id, post_timestamp)
-                            target_ip = target_user_id.split('@')[1]
-                            network_handler.unicast(protocol.serialize_message(like_message), target_ip)
-                            logger.log(like_message, origin=f"Sent to {target_ip}")
+                            send_reliable(like_message, target_user_id, logger)
                             liked_posts[(target_user_id, post_timestamp)] = like_message
+                            if store:
+                                store.set_like(target_user_id, post_timestamp, True)
 
                         case "4": # unlike
                             if not liked_posts:
@@ -417,10 +655,10 @@ def handle_user_input(network_handler, user_id, logger):
                                 continue
                         
                             like_message = protocol.create_like_message(user_id, target_user_id, post_timestamp, action="UNLIKE")
-                            target_ip = target_user_id.split('@')[1]
-                            network_handler.unicast(protocol.serialize_message(like_message), target_ip)
-                            logger.log(like_message, origin=f"Sent to {target_ip}")
+                            send_reliable(like_message, target_user_id, logger)
                             del liked_posts[key]
+                            if store:
+                                store.set_like(target_user_id, post_timestamp, False)
 
                         case "5": # back
                             continue
@@ -438,22 +676,19 @@ def handle_user_input(network_handler, user_id, logger):
                             print_safe(f"--- Message History with {target_user_id} ---")
                             if message_history[target_user_id]:
                                 for msg in message_history[target_user_id]:
-                                    direction = "To" if msg.get('FROM') == user_id else "From"
-                                    print_safe(f"[DM {direction} {target_user_id}] {msg.get('CONTENT')}")
+                                    direction = "To" if msg.sender == user_id else "From"
+                                    print_safe(f"[DM {direction} {target_user_id}] {msg.content}")
                             else:
                                 print_safe(f"No messages found for {target_user_id}.")
                         case "2": # send dm
                             target_user_id = input("Send to (user_id): ").strip()
-                            if target_user_id not in online_peers:
+                            if not is_known_peer(target_user_id):
                                 print_safe(f"Error: Peer '{target_user_id}' not found.")
                                 continue
                             content = input("Message: ").strip()
                             dm_message = protocol.create_dm_message(user_id, target_user_id, content)
-                            issued_tokens.add(dm_message["TOKEN"])
-                            target_ip = target_user_id.split('@')[1]
-                            network_handler.unicast(protocol.serialize_message(dm_message), target_ip)
-                            logger.log(dm_message, origin=f"Sent to {target_ip}")
-                            message_history[target_user_id].append(dm_message)
+                            send_reliable(dm_message, target_user_id, logger)
+                            message_history.append(target_user_id, StoredMessage.from_message(dm_message))
                         case "3": # back
                             continue
                         case _:
@@ -466,27 +701,27 @@ def handle_user_input(network_handler, user_id, logger):
                         case "1":
                             print_safe("--- Online Peers ---")
                             if online_peers:
-                                for peer_id, peer_info in online_peers.items():
-                                    has_avatar = "(has avatar)" if peer_info.get('AVATAR_DATA') else ""
-                                    print_safe(f"- {peer_info.get('DISPLAY_NAME', 'Unknown')} ({peer_id}) {has_avatar}")
+                                for peer_id, peer in list(online_peers.items()):
+                                    has_avatar = "(has avatar)" if peer.has_avatar else ""
+                                    print_safe(f"- {peer.display_name or 'Unknown'} ({peer_id}) {has_avatar}")
                             else:
                                 print_safe("No other peers detected.")
 
                         case "2":
                             target_user_id = input("View profile of user (user_id): ").strip()
-                            view_profile(target_user_id)
+                            view_profile(target_user_id, network_handler, user_id, logger)
 
                         case "3":
                             target_user_id = input("Follow user (user_id): ").strip()
-                            if target_user_id not in online_peers:
+                            if not is_known_peer(target_user_id):
                                 print_safe(f"Error: Peer '{target_user_id}' not found.")
                                 continue
                             follow_message = protocol.create_follow_message(user_id, target_user_id)
-                            issued_tokens.add(follow_message["TOKEN"])
-                            target_ip = target_user_id.split('@')[1]
-                            network_handler.unicast(protocol.serialize_message(follow_message), target_ip)
-                            logger.log(follow_message, origin=f"Sent to {target_ip}")
+                            send_reliable(follow_message, target_user_id, logger)
                             following.add(target_user_id)
+                            network_handler.join_group(follower_audience(target_user_id))
+                            if store:
+                                store.set_follow("following", target_user_id, True)
 
                         case "4":
                             target_user_id = input("Unfollow user (user_id): ").strip()
@@ -494,11 +729,11 @@ def handle_user_input(network_handler, user_id, logger):
                                 print_safe(f"Error: You are not following '{target_user_id}'.")
                                 continue
                             unfollow_message = protocol.create_unfollow_message(user_id, target_user_id)
-                            issued_tokens.add(unfollow_message["TOKEN"])
-                            target_ip = target_user_id.split('@')[1]
-                            network_handler.unicast(protocol.serialize_message(unfollow_message), target_ip)
-                            logger.log(unfollow_message, origin=f"Sent to {target_ip}")
+                            send_reliable(unfollow_message, target_user_id, logger)
                             following.remove(target_user_id)
+                            network_handler.leave_group(follower_audience(target_user_id))
+                            if store:
+                                store.set_follow("following", target_user_id, False)
 
                             if target_user_id in post_history:
                                 del post_history[target_user_id]
@@ -536,9 +771,9 @@ def handle_user_input(network_handler, user_id, logger):
                             if fileid in pending_file_offers:
                                 offer = pending_file_offers[fileid]
                                 ack_message = protocol.create_ack_message(offer['message_id'], "ACCEPTED")
-                                target_ip = offer['from'].split('@')[1]
-                                network_handler.unicast(protocol.serialize_message(ack_message), target_ip)
-                                logger.log(ack_message, origin=f"Sent to {target_ip}")
+                                target_addr = online_peers.address(offer['from'])
+                                network_handler.send_to(protocol.serialize_message(ack_message), target_addr)
+                                logger.log(ack_message, origin=f"Sent to {target_addr[0]}")
                                 incoming_files[fileid] = {
                                     'filename': offer['filename'],
                                     'filesize': offer['filesize'],
@@ -577,12 +812,15 @@ def handle_user_input(network_handler, user_id, logger):
                             members.add(user_id)
 
                             group_create_msg = protocol.create_group_create(user_id, group_name, members=list(members))
-                            target_ips = [m.split('@')[1] for m in members]
-                            for ip in target_ips:
-                                network_handler.unicast(protocol.serialize_message(group_create_msg), ip)
+                            target_addrs = [online_peers.address(m) for m in members if not online_peers.is_departed(m)]
+                            serialized = protocol.serialize_message(group_create_msg)
+                            for addr in target_addrs:
+                                network_handler.send_to(serialized, addr)
                             
                             logger.log(group_create_msg)
-                            groups[group_create_msg["GROUP_ID"]] = group_create_msg
+                            groups[group_create_msg["GROUP_ID"]] = Group.from_message(group_create_msg)
+                            persist_group(group_create_msg["GROUP_ID"])
+                            network_handler.join_group(group_audience(group_create_msg["GROUP_ID"]))
 
 
                         case "2":
@@ -593,37 +831,32 @@ def handle_user_input(network_handler, user_id, logger):
                             if group_id not in groups:
                                 print_safe("Group not found.")
                                 continue
-                            group_info = groups[group_id]
-                            if user_id != group_info.get('FROM'):
+                            group = groups[group_id]
+                            if user_id != group.owner:
                                 print_safe("You do not have permission to update this group.")
                                 continue
-                            members_str = group_info.get('MEMBERS', '')
-                            print_safe(f"Current members: {members_str}")
+                            print_safe(f"Current members: {', '.join(sorted(group.members))}")
 
                             add_members = input("Enter members to add (comma-separated), or leave blank: ").strip()
                             remove_members = input("Enter members to remove (comma-separated), or leave blank: ").strip()
 
-                            to_add = set()
-                            to_remove = set()
-
-                            current_members = set(m.strip() for m in members_str.split(",") if m.strip())
-
-                            if add_members:
-                                to_add = set(m.strip() for m in add_members.split(",") if m.strip())
-                                current_members.update(to_add)
-
-                            if remove_members:
-                                to_remove = set(m.strip() for m in remove_members.split(",") if m.strip())
-                                current_members.difference_update(to_remove)
-
-                            # Save updated members list back
-                            group_info["MEMBERS"] = ",".join(sorted(current_members))
+                            # Only real changes go into the delta
+                            to_add = split_members(add_members) - group.members
+                            to_remove = (split_members(remove_members) & group.members) - {user_id}
+                            if not to_add and not to_remove:
+                                print_safe("No changes to the member list.")
+                                continue
 
-                            group_update_msg = protocol.create_group_update(user_id, group_id, to_add, to_remove)
-                            notify = current_members.union(to_remove)
-                            target_ips = [m.split('@')[1] for m in notify]
-                            for ip in target_ips:
-                                network_handler.unicast(protocol.serialize_message(group_update_msg), ip)
+                            group_update_msg = protocol.create_group_update(user_id, group_id, to_add, to_remove, base_version=group.version)
+                            group.members |= to_add
+                            group.members -= to_remove
+                            group.version += 1
+                            persist_group(group_id)
+                            notify = (group.members | to_remove) - {user_id}
+                            target_addrs = [online_peers.address(m) for m in notify if not online_peers.is_departed(m)]
+                            serialized = protocol.serialize_message(group_update_msg)
+                            for addr in target_addrs:
+                                network_handler.send_to(serialized, addr)
                             
                             logger.log(group_update_msg)
 
@@ -632,17 +865,16 @@ def handle_user_input(network_handler, user_id, logger):
                             if group_id not in groups:
                                 print_safe("Group not found.")
                                 continue
-                            group_info = groups[group_id]
                             content = input("Enter message: ").strip()
-                            members_str = group_info.get("MEMBERS", "")
-                            members = [m.strip() for m in members_str.split(",") if m.strip()]
 
-                            msg = protocol.create_group_message(user_id, group_id, content)
-                            target_ips = [m.split('@')[1] for m in members]
-                            for ip in target_ips:
-                                network_handler.unicast(protocol.serialize_message(msg), ip)
+                            seq = group_sequencer.next_seq(group_id)
+                            msg = protocol.create_group_message(user_id, group_id, content, seq=seq, epoch=group_sequencer.epoch)
+                            serialized = protocol.serialize_message(msg)
+                            group_sequencer.remember(group_id, seq, serialized)
+                            send_to_audience(network_handler, serialized, group_audience(group_id), group_members(group_id) - {user_id})
 
                             logger.log(msg)
+                            group_history.append(group_id, StoredMessage.from_message(msg))
 
                         case "5":
                             logger.show_only_group_messages = not logger.show_only_group_messages
@@ -671,7 +903,7 @@ def handle_user_input(network_handler, user_id, logger):
                                 print_safe("Invalid symbol choice. Choose X or O.")
                                 continue
                             try:
-                                gameid = generate_gameid()
+                                gameid = games.allocate(target_user_id)
                             except RuntimeError as e:
                                 print_safe(str(e))
                                 continue
@@ -679,22 +911,28 @@ def handle_user_input(network_handler, user_id, logger):
                             invite_thread = threading.Thread(target=send_ttt_invite_with_retry, args=(user_id, target_user_id, gameid, symbol, network_handler, logger), daemon=True)
                             invite_thread.start()
                         case "2":
-                            if not received_invites:
+                            pending = games.invites()
+                            if not pending:
                                 print_safe("No pending invites.")
                                 continue
                             display_pending_invites()
                             gameid = input("Enter Game ID to accept: ").strip()
-                            if gameid not in received_invites:
+                            inviters = [opponent for (opponent, gid), _ in pending if gid == gameid]
+                            if len(inviters) > 1:
+                                # Peers pick GAMEIDs independently, so two of them may have used the same one
+                                inviter = input("Enter the inviter's user ID: ").strip()
+                                inviters = [inviter] if inviter in inviters else []
+                            invite = games.take_invite(inviters[0], gameid) if inviters else None
+                            if invite is None:
                                 print_safe("Invalid Game ID")
                                 continue
 
-                            invite = received_invites.pop(gameid)
                             message_id = invite['MESSAGE_ID']
                             symbol = "O" if invite['SYMBOL'] == "X" else "X"
                             ack = protocol.create_ack_message(message_id, "ACCEPTED")
                             from_user = invite['FROM']
-                            target_ip = from_user.split('@')[1]
-                            network_handler.unicast(protocol.serialize_message(ack), target_ip)
+                            target_addr = online_peers.address(from_user)
+                            network_handler.send_to(protocol.serialize_message(ack), target_addr)
                             logger.log(ack)
                             print_safe(f"Accepted invite for game {gameid}")
                             if symbol == "O":
@@ -703,11 +941,10 @@ def handle_user_input(network_handler, user_id, logger):
                             else:
                                 player_o = from_user
                                 player_x = user_id
-                            active_games[gameid] = TicTacToe(player_x, player_o, symbol)
-                            game_in_progress = True
+                            games.start(gameid, player_x, player_o, symbol)
 
                             if player_x == user_id:
-                                ttt_game = active_games.get(gameid)
+                                ttt_game = games.get(from_user, gameid)
                                 make_move(gameid, ttt_game, user_id, network_handler, logger)
                             else:
                                 print_safe(f"Waiting for {from_user} to make their move.")
@@ -720,8 +957,15 @@ def handle_user_input(network_handler, user_id, logger):
 
 
                 case "7":
+                    print_safe("Terms must all match; end a term with * to match a prefix.")
+                    print_safe("Filters: from:<user_id> peer:<user_id> group:<group_id> kind:dm|post|group since:<unix time> until:<unix time>")
+                    text = input("Search: ").strip()
+                    if text:
+                        display_search_results(text)
+
+                case "8":
                     print_safe("Exiting...")
-                    send_revoke_messages(network_handler, user_id, issued_tokens)
+                    send_revoke_messages(network_handler, user_id, token_manager.issued_tokens())
                     shutdown_event.set()
                     break
 
@@ -749,7 +993,33 @@ def main():
     # parser.add_argument('user_id', type=str, help='User ID for the client (e.g., alice@192.168.1.11)')
     # parser.add_argument('display_name', type=str, help='Display name for the client')
     parser.add_argument('--verbose', action='store_true', help='Enable verbose logging')
+    parser.add_argument('--history-limit', type=int, default=None, help='Keep at most this many DMs and posts per peer')
+    parser.add_argument('--gossip', action='store_true', help='Relay posts to a few random peers so they reach beyond direct followers')
+    parser.add_argument('--gossip-fanout', type=int, default=3, help='Peers each post is relayed to in gossip mode')
+    parser.add_argument('--bot', choices=sorted(BOTS), default=None, help='Let a bot play our Tic-Tac-Toe moves')
+    parser.add_argument('--relay', type=str, default=None, help='User ID of a relay (see relay.py) that answers discovery for this client')
+    parser.add_argument('--no-multicast', action='store_true', help='Unicast group messages and posts to each recipient instead of using IP multicast')
+    parser.add_argument('--db', type=str, default=None, help='Persist messages, follows, groups and likes to this SQLite file')
     args = parser.parse_args()
+    message_history.max_per_peer = args.history_limit
+    global relay_posts, relay_id, ttt_bot
+    relay_posts = args.gossip
+    relay_id = args.relay
+    ttt_bot = BOTS[args.bot]() if args.bot else None
+    post_gossip.fanout = args.gossip_fanout
+    post_history.max_per_peer = args.history_limit
+    group_history.max_per_peer = args.history_limit
+
+    global store
+    if args.db:
+        store = SQLiteStore(args.db)
+        message_history.attach(store, "DM")
+        post_history.attach(store, "POST")
+        group_history.attach(store, GROUP_KIND)
+        restore_state() # Stored messages stay on disk; search reaches them through SQLite full-text search
+    message_history.index_with(search_index, "DM")
+    post_history.index_with(search_index, "POST")
+    group_history.index_with(search_index, GROUP_KIND)
 
     
     
@@ -764,16 +1034,18 @@ def main():
     user_id = f"{username}@{ip}"
 
     avatar_type = None
-    avatar_encoding = None
-    avatar_data = None
+    avatar_hash = None
+    avatar_size = None
     if avatar_path and os.path.exists(avatar_path):
         try:
             with open(avatar_path, "rb") as f:
                 avatar_data_raw = f.read()
             if len(avatar_data_raw) < 20000:
-                avatar_data = base64.b64encode(avatar_data_raw).decode('utf-8')
+                # PROFILE only advertises the hash; peers fetch the bytes on demand
                 avatar_type = f"image/{avatar_path.split('.')[-1]}"
-                avatar_encoding = "base64"
+                avatar_hash = avatar_cache.put(avatar_data_raw)
+                avatar_size = len(avatar_data_raw)
+                own_avatar.update(hash=avatar_hash, type=avatar_type, data=base64.b64encode(avatar_data_raw).decode('utf-8'))
             else:
                 print_safe("Avatar image is too large (must be under 20KB). Skipping.")
         except Exception as e:
@@ -781,13 +1053,31 @@ def main():
 
     logger = Logger(verbose=args.verbose, user_id=user_id, online_peers=online_peers, groups=groups)
     logger.following = following  
-    network_handler = NetworkHandler()
-
-    # Create profile message
-    profile_message = protocol.create_profile_message(user_id, display_name, status, avatar_type, avatar_encoding, avatar_data)
+    network_handler = NetworkHandler(multicast=not args.no_multicast)
+    protocol.use_token_manager(token_manager)
+    # Receive multicasts for our groups and for the users we follow
+    for group_id in groups:
+        network_handler.join_group(group_audience(group_id))
+    for followed in following:
+        network_handler.join_group(follower_audience(followed))
+
+    # Create profile message; the encoded frame is cached and shared by every sender
+    profile_message = protocol.create_profile_message(user_id, display_name, status, avatar_type, avatar_hash=avatar_hash, avatar_size=avatar_size,
+                                                      multicast=network_handler.multicast_enabled)
+    profile_cache = ProfileCache(profile_message)
+
+    # A GROUP_SYNC follows each burst of our group messages so members notice a lost last one
+    group_sequencer.send_sync = lambda group_id, last_seq: send_group_sync(network_handler, user_id, group_id, last_seq)
+    outbox.send = lambda serialized, peer_id: network_handler.send_to(serialized, online_peers.address(peer_id))
+
+    # Discovery replies are jittered, deduplicated and rate capped
+    discovery_replier = DiscoveryReplier(network_handler, profile_cache, logger)
+    # The first neighbors found are asked for their whole peer directory
+    directory_sync = DirectorySync(network_handler, user_id, logger, relay_id=relay_id)
+    feed_sync = FeedSync(network_handler, user_id, logger)
     
     # Start broadcasting in a separate thread
-    broadcast_thread = threading.Thread(target=broadcast_profile, args=(network_handler, profile_message, logger), daemon=True)
+    broadcast_thread = threading.Thread(target=broadcast_profile, args=(network_handler, profile_cache, logger, discovery_replier), daemon=True)
     broadcast_thread.start()
 
     # Start broadcasting ping
@@ -804,6 +1094,20 @@ def main():
     try:
         while not shutdown_event.is_set():
             data, addr = network_handler.receive()
+
+            # Drop peers that have gone quiet; departures count as churn for the heartbeat
+            departed = online_peers.expire()
+            if departed:
+                heartbeat.record_churn(len(departed))
+
+            # Reliable messages whose ACK is overdue wait for their peer to be heard from again
+            outbox.due()
+
+            # Re-request group messages that are still missing; give up on ones that will not come
+            delivered, nacks = group_receiver.due()
+            deliver_group_messages(delivered, logger, origin="Received (after gap)")
+            send_group_nacks(network_handler, user_id, nacks, logger)
+
             if data is None:
                 continue
 
@@ -821,89 +1125,190 @@ def main():
                 revoked_token = message.get('TOKEN')
                 if revoked_token:
                     revoked_tokens.add(revoked_token)
+                bulk_tokens = message.get('TOKENS')
+                if bulk_tokens:
+                    # A sender may only revoke its own tokens
+                    sender_prefix = f"{message.get('FROM')}|"
+                    revoked_tokens.add_many(t for t in bulk_tokens.split(',') if t.startswith(sender_prefix))
                 continue
 
             token = message.get('TOKEN')
             sender_id = message.get('USER_ID') or message.get('FROM')
+            if sender_id and address_of(sender_id, online_peers.port) is None:
+                continue # Not name@ip: we could neither reply nor track it
             expected_scope = expected_scope_map.get(msg_type)
 
             if expected_scope:
                 if not protocol.validate_token(token, expected_scope, sender_id, revoked_tokens):
                     continue
-            logger.log(message, origin=f"Received from {addr}")
+
+            if msg_type == protocol.MessageType.POST:
+                # Relayed posts can arrive more than once
+                post_id = message.get('MESSAGE_ID')
+                if post_id and not post_gossip.first_seen(post_id):
+                    continue
+
+            # Any valid traffic counts as a sign of life (a relayed post says nothing about its author)
+            interval = message.get('INTERVAL')
+            if Gossip.hops(message) == 0:
+                online_peers.seen(sender_id, int(interval) if interval and interval.isdigit() else None)
+                outbox.on_seen(sender_id) # Deliver whatever we queued while it was away
+
+            if msg_type in RELIABLE_TYPES and not delivered_ids.add(message.get('MESSAGE_ID')):
+                # A resend of something we already handled, so our ACK was lost: just ACK again
+                ack_message = protocol.create_ack_message(message['MESSAGE_ID'], "RECEIVED")
+                network_handler.send_to(protocol.serialize_message(ack_message), online_peers.address(sender_id))
+                continue
+            if msg_type != protocol.MessageType.GROUP_MESSAGE:
+                logger.log(message, origin=f"Received from {addr}")
 
             if msg_type == protocol.MessageType.PING:
                 from_user_id = message.get('USER_ID')
-                if from_user_id and from_user_id not in online_peers:
-                    online_peers[from_user_id] = message
-                
-                target_ip = from_user_id.split('@')[1]
-                network_handler.unicast(protocol.serialize_message(profile_message), target_ip)
-                logger.log(profile_message)
+                if address_of(from_user_id, online_peers.port) is None:
+                    continue # Missing or malformed USER_ID (not name@ip)
+                if from_user_id not in online_peers:
+                    online_peers.add(from_user_id)
+                    heartbeat.record_churn()
+                    # Back from being away (or new): catch up on what it sent meanwhile
+                    feed_sync.on_peer_discovered(from_user_id, following, post_history, group_receiver, groups)
+                    # Only newcomers are answered; heartbeats from known peers need no reply
+                    if not relay_id: # Otherwise the relay greets newcomers for us
+                        discovery_replier.request_reply(online_peers.address(from_user_id)[0])
 
             
             elif msg_type == protocol.MessageType.PROFILE:
                 from_user_id = message.get('USER_ID')
-                if from_user_id and from_user_id not in online_peers:
-                    online_peers[from_user_id] = message
-                    network_handler.broadcast(protocol.serialize_message(profile_message))
-                    logger.log(profile_message)
+                if address_of(from_user_id, online_peers.port) is None:
+                    continue # Missing or malformed USER_ID (not name@ip)
+                absorb_inline_avatar(message)
+                if from_user_id not in online_peers:
+                    peer = online_peers.add(from_user_id)
+                    peer.update_from_profile(message)
+                    heartbeat.record_churn()
+                    # Answer the newcomer with a jittered unicast instead of a subnet-wide broadcast
+                    if not relay_id:
+                        discovery_replier.request_reply(peer.addr[0])
+                    directory_sync.on_peer_discovered(from_user_id)
+                    feed_sync.on_peer_discovered(from_user_id, following, post_history, group_receiver, groups)
                 else: # Update existing peer
-                    online_peers[from_user_id].update(message)
+                    online_peers[from_user_id].update_from_profile(message)
+
+            elif msg_type == protocol.MessageType.PROFILE_REQUEST:
+                from_user_id = message.get('FROM')
+                if from_user_id and message.get('TO') == user_id:
+                    discovery_replier.reply_now(online_peers.address(from_user_id)[0])
+
+            elif msg_type == protocol.MessageType.PEER_LIST_REQUEST:
+                from_user_id = message.get('FROM')
+                if from_user_id and message.get('TO') == user_id:
+                    directory_sync.answer(from_user_id, online_peers)
+
+            elif msg_type == protocol.MessageType.PEER_LIST:
+                if message.get('TO') == user_id:
+                    missing = directory_sync.missing_peers(message, online_peers)
+                    if missing:
+                        threading.Thread(target=directory_sync.fetch_profiles, args=(missing,), daemon=True).start()
             
+            elif msg_type == protocol.MessageType.FEED_DIGEST:
+                from_user_id = message.get('FROM')
+                if from_user_id and message.get('TO') == user_id:
+                    feed_sync.answer(message, online_peers.address(from_user_id), addr, followers, post_history, group_sequencer, groups)
+
+            elif msg_type == protocol.MessageType.AVATAR_REQUEST:
+                from_user_id = message.get('FROM')
+                if from_user_id and message.get('AVATAR_HASH') == own_avatar.get('hash'):
+                    response = protocol.create_avatar_response(user_id, from_user_id, own_avatar['hash'], own_avatar['type'], own_avatar['data'])
+                    target_addr = online_peers.address(from_user_id)
+                    network_handler.send_to(protocol.serialize_message(response), target_addr)
+                    logger.log(response, origin=f"Sent to {target_addr[0]}")
+
+            elif msg_type == protocol.MessageType.AVATAR_RESPONSE:
+                avatar_hash = message.get('AVATAR_HASH')
+                try:
+                    image_data = base64.b64decode(message.get('AVATAR_DATA', ''))
+                except ValueError:
+                    image_data = None
+                # Only keep bytes we asked for, and only if they match that hash; unsolicited images could evict real avatars
+                arrived = pending_avatar_requests.get(avatar_hash)
+                if arrived and image_data and avatar_cache.put(image_data, expected_hash=avatar_hash):
+                    arrived.set()
+
             elif msg_type == protocol.MessageType.POST:
                 from_user_id = message.get('USER_ID')
                 if from_user_id in following:
-                    post_history[from_user_id].append(message)
-                # Send ACK for POST message
+                    post_history.append(from_user_id, StoredMessage.from_message(message))
+                if relay_posts and post_gossip.should_forward(message):
+                    # Pass it on to a few random peers other than the author and whoever sent it to us
+                    candidates = [p for p, peer in list(online_peers.items()) if peer.addr[0] != addr[0]]
+                    relayed = protocol.serialize_message(post_gossip.relay_copy(message))
+                    for target in post_gossip.pick_targets(candidates, exclude={from_user_id, user_id}):
+                        network_handler.send_to(relayed, online_peers.address(target))
+                # Send ACK for POST message, only when it came straight from the author
+                message_id = message.get('MESSAGE_ID')
+                if message_id and Gossip.hops(message) == 0:
+                    ack_message = protocol.create_ack_message(message_id, "RECEIVED")
+                    target_addr = online_peers.address(from_user_id)
+                    network_handler.send_to(protocol.serialize_message(ack_message), target_addr)
+                    logger.log(ack_message, origin=f"Sent to {target_addr[0]}")
+
+            elif msg_type == protocol.MessageType.LIKE:
+                # Likes of our posts update the like count incrementally
+                if message.get('TO') == user_id:
+                    post_history.apply_like(user_id, message.get('POST_TIMESTAMP'), message.get('FROM'), message.get('ACTION', 'LIKE'))
+                # Send ACK for LIKE message (older peers send LIKEs without a MESSAGE_ID)
                 message_id = message.get('MESSAGE_ID')
                 if message_id:
                     ack_message = protocol.create_ack_message(message_id, "RECEIVED")
-                    target_ip = from_user_id.split('@')[1]
-                    network_handler.unicast(protocol.serialize_message(ack_message), target_ip)
-                    logger.log(ack_message, origin=f"Sent to {target_ip}")
+                    target_addr = online_peers.address(message.get('FROM'))
+                    network_handler.send_to(protocol.serialize_message(ack_message), target_addr)
+                    logger.log(ack_message, origin=f"Sent to {target_addr[0]}")
 
             elif msg_type == protocol.MessageType.DM:
                 from_user_id = message.get('FROM')
                 to_user_id = message.get('TO')
                 if to_user_id == user_id:
-                    message_history[from_user_id].append(message)
+                    message_history.append(from_user_id, StoredMessage.from_message(message))
                 # Send ACK for DM message
                 message_id = message.get('MESSAGE_ID')
                 if message_id:
                     ack_message = protocol.create_ack_message(message_id, "RECEIVED")
-                    target_ip = from_user_id.split('@')[1]
-                    network_handler.unicast(protocol.serialize_message(ack_message), target_ip)
-                    logger.log(ack_message, origin=f"Sent to {target_ip}")
+                    target_addr = online_peers.address(from_user_id)
+                    network_handler.send_to(protocol.serialize_message(ack_message), target_addr)
+                    logger.log(ack_message, origin=f"Sent to {target_addr[0]}")
             
             elif msg_type == protocol.MessageType.FOLLOW:
                 from_user_id = message.get('FROM')
                 followers.add(from_user_id)
+                if store:
+                    store.set_follow("follower", from_user_id, True)
                 # print_safe(f"\n> {from_user_id} has followed you.")
                 # Send ACK for FOLLOW message
                 message_id = message.get('MESSAGE_ID')
                 if message_id:
                     ack_message = protocol.create_ack_message(message_id, "RECEIVED")
-                    target_ip = from_user_id.split('@')[1]
-                    network_handler.unicast(protocol.serialize_message(ack_message), target_ip)
-                    logger.log(ack_message, origin=f"Sent to {target_ip}")
+                    target_addr = online_peers.address(from_user_id)
+                    network_handler.send_to(protocol.serialize_message(ack_message), target_addr)
+                    logger.log(ack_message, origin=f"Sent to {target_addr[0]}")
 
             elif msg_type == protocol.MessageType.UNFOLLOW:
                 from_user_id = message.get('FROM')
                 if from_user_id in followers:
                     followers.remove(from_user_id)
+                    if store:
+                        store.set_follow("follower", from_user_id, False)
                     # print_safe(f"\n> {from_user_id} has unfollowed you.")
                 # Send ACK for UNFOLLOW message
                 message_id = message.get('MESSAGE_ID')
                 if message_id:
                     ack_message = protocol.create_ack_message(message_id, "RECEIVED")
-                    target_ip = from_user_id.split('@')[1]
-                    network_handler.unicast(protocol.serialize_message(ack_message), target_ip)
-                    logger.log(ack_message, origin=f"Sent to {target_ip}")
+                    target_addr = online_peers.address(from_user_id)
+                    network_handler.send_to(protocol.serialize_message(ack_message), target_addr)
+                    logger.log(ack_message, origin=f"Sent to {target_addr[0]}")
 
             elif msg_type == protocol.MessageType.ACK:
                 message_id = message.get('MESSAGE_ID')
                 status = message.get('STATUS')
+                outbox.on_ack(message_id)
                 if message_id in sent_file_offers:
                     if status == 'ACCEPTED':
                         offer = sent_file_offers[message_id]
@@ -911,20 +1316,19 @@ def main():
                         target_user_id = offer['target_user_id']
                         fileid = offer['fileid']
                         filesize = offer['filesize']
-                        
-                        # Read file and send chunks
-                        chunk_size = 1024 # 1KB chunks
-                        total_chunks = math.ceil(filesize / chunk_size)
-                        with open(filepath, 'rb') as f:
-                            for i in range(total_chunks):
-                                chunk_data = f.read(chunk_size)
-                                send_chunk_with_retry(network_handler, user_id, logger, target_user_id, fileid, i, total_chunks, chunk_data)
                         del sent_file_offers[message_id]
+
+                        # Stream the chunks from a separate thread so this loop keeps receiving ACKs
+                        transfer_thread = threading.Thread(target=send_file_chunks, args=(network_handler, user_id, logger, target_user_id, filepath, fileid, filesize), daemon=True)
+                        transfer_thread.start()
                     elif status == 'REJECTED':
                         print_safe(f"\n> File offer {message_id} was rejected.")
                         del sent_file_offers[message_id]
                 elif message_id in pending_chunks:
-                    del pending_chunks[message_id]
+                    fileid, chunk_index = pending_chunks.pop(message_id)
+                    transfer = outgoing_transfers.get(fileid)
+                    if transfer:
+                        transfer.on_chunk_ack(chunk_index)
 
                 elif message_id in sent_invites:
                     if status == 'ACCEPTED':
@@ -939,14 +1343,13 @@ def main():
                             player_x = opponent
                             player_o = user_id
 
-                        active_games[gameid] = TicTacToe(player_x, player_o, symbol)
+                        games.start(gameid, player_x, player_o, symbol)
                         print_safe(f"\n> Your invite was accepted by {opponent}. Starting game...")
-                        global game_in_progress
-                        game_in_progress = True
                         
-                        if player_x == user_id:
-                            ttt_game = active_games.get(gameid)
-                            make_move(gameid, ttt_game, user_id, network_handler, logger)
+                        if player_x == user_id and ttt_bot:
+                            make_move(gameid, games.get(opponent, gameid), user_id, network_handler, logger) # Never blocks
+                        elif player_x == user_id:
+                            queue_turn(opponent, gameid)
                         else:
                             print_safe(f"Waiting for {opponent} to make their move.")
                         del sent_invites[message_id]
@@ -955,6 +1358,7 @@ def main():
                         opponent = invite.get('TO')
                         print_safe(f"\n> Your invite was rejected by {opponent}.")
                         del sent_invites[message_id]
+                        games.release(invite.get('GAMEID'))
                         
                     
 
@@ -977,88 +1381,166 @@ def main():
             elif msg_type == protocol.MessageType.FILE_CHUNK:
                 fileid = message.get('FILEID')
                 if fileid in incoming_files:
+                    incoming = incoming_files[fileid]
                     chunk_index = int(message.get('CHUNK_INDEX'))
                     total_chunks = int(message.get('TOTAL_CHUNKS'))
-                    data = base64.b64decode(message.get('DATA'))
-                    message_id = message.get('MESSAGE_ID')
-                    incoming_files[fileid]['received_chunks'][chunk_index] = data
-
-                    # Send ACK for the chunk
-                    ack_message = protocol.create_ack_message(message_id, "RECEIVED")
-                    target_ip = incoming_files[fileid]['from'].split('@')[1]
-                    network_handler.unicast(protocol.serialize_message(ack_message), target_ip)
-                    logger.log(ack_message, origin=f"Sent to {target_ip}")
+                    if 'acks' not in incoming:
+                        # Acknowledge every 16 chunks or after a short delay, not each chunk
+                        from_user = incoming['from']
+                        incoming['acks'] = ChunkAckTracker(total_chunks, lambda cum, sack, fileid=fileid, from_user=from_user:
+                                                           send_file_ack(network_handler, user_id, logger, from_user, fileid, cum, sack))
+                    if not incoming['acks'].add(chunk_index):
+                        continue
+                    incoming['received_chunks'][chunk_index] = base64.b64decode(message.get('DATA'))
 
-                    if len(incoming_files[fileid]['received_chunks']) == total_chunks:
+                    if incoming['acks'].complete:
                         # Reassemble file
-                        filename = incoming_files[fileid]['filename']
+                        filename = incoming['filename']
                         with open(filename, 'wb') as f:
                             for i in range(total_chunks):
-                                f.write(incoming_files[fileid]['received_chunks'][i])
+                                f.write(incoming['received_chunks'][i])
                         print_safe(f"\n> File '{filename}' received successfully.")
                         
                         # Send FILE_RECEIVED message
-                        file_received_message = protocol.create_file_received_message(user_id, incoming_files[fileid]['from'], fileid, "COMPLETE")
-                        target_ip = incoming_files[fileid]['from'].split('@')[1]
-                        network_handler.unicast(protocol.serialize_message(file_received_message), target_ip)
-                        logger.log(file_received_message, origin=f"Sent to {target_ip}")
+                        file_received_message = protocol.create_file_received_message(user_id, incoming['from'], fileid, "COMPLETE")
+                        target_addr = online_peers.address(incoming['from'])
+                        network_handler.send_to(protocol.serialize_message(file_received_message), target_addr)
+                        logger.log(file_received_message, origin=f"Sent to {target_addr[0]}")
 
+                        incoming['acks'].close()
                         del incoming_files[fileid]
+                        completed_files[fileid] = (incoming['from'], total_chunks)
+                        while len(completed_files) > 64:
+                            del completed_files[next(iter(completed_files))]
+                elif fileid in completed_files:
+                    # Our final FILE_ACK was lost; tell the sender again that everything arrived
+                    from_user, total_chunks = completed_files[fileid]
+                    send_file_ack(network_handler, user_id, logger, from_user, fileid, total_chunks, "")
+
+            elif msg_type == protocol.MessageType.FILE_ACK:
+                transfer = outgoing_transfers.get(message.get('FILEID'))
+                if transfer:
+                    cum = message.get('CUM', "0")
+                    transfer.on_ack(int(cum) if cum.isdigit() else 0, parse_ranges(message.get('SACK')))
 
             elif msg_type == protocol.MessageType.FILE_RECEIVED:
                 fileid = message.get('FILEID')
                 status = message.get('STATUS')
                 if status == "COMPLETE":
+                    transfer = outgoing_transfers.get(fileid)
+                    if transfer:
+                        transfer.finish()
                     print_safe(f"\n> File with ID '{fileid}' was successfully received.")
 
             elif msg_type == protocol.MessageType.GROUP_CREATE:
                 group_id = message.get("GROUP_ID")
                 if group_id:
-                    groups[group_id] = message
+                    groups[group_id] = Group.from_message(message)
+                    persist_group(group_id)
+                    network_handler.join_group(group_audience(group_id))
                 else:
                     print_safe("Received GROUP_CREATE message with no GROUP_ID")
             
             elif msg_type == protocol.MessageType.GROUP_UPDATE:
                 group_id = message.get("GROUP_ID")
-                if group_id:
-                    group_name = groups.get(group_id, {}).get("GROUP_NAME", "Unknown Group")
-                    remove_list = message.get("REMOVE", "")
-                    remove_members = set(m.strip() for m in remove_list.split(",") if m.strip())
-                    if user_id in remove_members:
-                        if group_id in groups:
-                            del groups[group_id]
-                            print_safe(f"You were removed from group \"{group_name}\"")
-                    groups[group_id] = message
-                else:
+                owner = message.get("FROM")
+                group = groups.get(group_id)
+                if not group_id:
                     print_safe("Received GROUP_UPDATE message with no GROUP_ID")
+                elif group is not None and owner != group.owner:
+                    print_safe(f"Ignoring GROUP_UPDATE for \"{group.name}\" from non-owner {owner}")
+                elif user_id in split_members(message.get("REMOVE")):
+                    if group:
+                        leave_group(network_handler, group_id)
+                        print_safe(f"You were removed from group \"{group.name}\"")
+                elif group is None:
+                    # We were just added; the delta alone does not tell us the rest of the group
+                    request_group_snapshot(network_handler, user_id, group_id, owner, logger)
+                elif group.apply_update(message):
+                    persist_group(group_id)
+                else:
+                    # Missed an earlier update; fetch the owner's current membership
+                    request_group_snapshot(network_handler, user_id, group_id, owner, logger)
+
+            elif msg_type == protocol.MessageType.GROUP_SNAPSHOT_REQUEST:
+                group = groups.get(message.get("GROUP_ID"))
+                requester = message.get("FROM")
+                if group and group.owner == user_id and requester in group.members:
+                    snapshot = protocol.create_group_snapshot(user_id, requester, group)
+                    target_addr = online_peers.address(requester)
+                    network_handler.send_to(protocol.serialize_message(snapshot), target_addr)
+                    logger.log(snapshot, origin=f"Sent to {target_addr[0]}")
+
+            elif msg_type == protocol.MessageType.GROUP_SNAPSHOT:
+                group_id = message.get("GROUP_ID")
+                snapshot = Group.from_message(message)
+                current = groups.get(group_id)
+                # An unknown group is only taken from the owner we asked; a known one only from its owner
+                expected_owner = snapshot_requests.get(group_id) if current is None else current.owner
+                if group_id and user_id in snapshot.members and snapshot.owner == expected_owner and (
+                        current is None or snapshot.version > current.version):
+                    snapshot_requests.pop(group_id, None)
+                    groups[group_id] = snapshot
+                    persist_group(group_id)
+                    network_handler.join_group(group_audience(group_id))
+
+            elif msg_type == protocol.MessageType.GROUP_MESSAGE:
+                group_id = message.get("GROUP_ID")
+                if group_id in groups:
+                    seq = message.get("SEQ", "")
+                    if seq.isdigit():
+                        delivered, nacks = group_receiver.on_message(group_id, message.get("FROM"), message.get("EPOCH"), int(seq), message)
+                        deliver_group_messages(delivered, logger, origin=f"Received from {addr}")
+                        send_group_nacks(network_handler, user_id, nacks, logger)
+                    else:
+                        deliver_group_messages([message], logger, origin=f"Received from {addr}")
+
+            elif msg_type == protocol.MessageType.GROUP_SYNC:
+                group_id = message.get("GROUP_ID")
+                seq = message.get("SEQ", "")
+                if group_id in groups and seq.isdigit():
+                    nacks = group_receiver.on_sync(group_id, message.get("FROM"), message.get("EPOCH"), int(seq))
+                    send_group_nacks(network_handler, user_id, nacks, logger)
+
+            elif msg_type == protocol.MessageType.GROUP_NACK:
+                # Resend what a member missed, straight from the retransmit buffer
+                group_id = message.get("GROUP_ID")
+                requester = message.get("FROM")
+                if requester in group_members(group_id) and message.get("EPOCH") == str(group_sequencer.epoch):
+                    seqs = [seq for a, b in parse_ranges(message.get("SEQS")) for seq in range(a, min(b, a + 255) + 1)]
+                    target_addr = online_peers.address(requester)
+                    for serialized in group_sequencer.lookup(group_id, seqs[:256]):
+                        network_handler.send_to(serialized, target_addr)
 
             elif msg_type == protocol.MessageType.TICTACTOE_INVITE:
                 from_user_id = message.get('FROM')
                 gameid = message.get('GAMEID')
                 symbol = message.get('SYMBOL')
-                message_id = message.get('MESSAGE_ID')
-                if gameid not in received_invites:
-                    received_invites[gameid] = message
+                # Refuse an invite reusing a GAMEID we already have with this peer, rather than overwrite that game
+                status = "RECEIVED" if games.add_invite(from_user_id, gameid, message) else "REJECTED"
                 # Send ACK for TICTACTOE_INVITE message
                 message_id = message.get('MESSAGE_ID')
                 if message_id:
-                    ack_message = protocol.create_ack_message(message_id, "RECEIVED")
-                    target_ip = from_user_id.split('@')[1]
-                    network_handler.unicast(protocol.serialize_message(ack_message), target_ip)
-                    logger.log(ack_message, origin=f"Sent to {target_ip}")
+                    ack_message = protocol.create_ack_message(message_id, status)
+                    target_addr = online_peers.address(from_user_id)
+                    network_handler.send_to(protocol.serialize_message(ack_message), target_addr)
+                    logger.log(ack_message, origin=f"Sent to {target_addr[0]}")
 
             elif msg_type == protocol.MessageType.TICTACTOE_MOVE:
+                from_user_id = message.get('FROM')
                 gameid = message.get('GAMEID')
-                ttt_game = active_games.get(gameid)
+                ttt_game = games.get(from_user_id, gameid)
                 if ttt_game:
                     position = int(message.get('POSITION'))
                     symbol = message.get('SYMBOL')
                     turn = message.get('TURN')
-                    from_user = message.get('FROM')
-                    success, msg = ttt_game.make_move(symbol, position, turn, from_user)
+                    success, msg = ttt_game.make_move(symbol, position, turn, from_user_id)
                     if success:
                         ttt_game.turn += 2
-                        make_move(gameid, ttt_game, user_id, network_handler, logger)
+                        if ttt_bot:
+                            make_move(gameid, ttt_game, user_id, network_handler, logger) # Never blocks
+                        else:
+                            queue_turn(from_user_id, gameid) # Our reply is typed on the input thread
                     else:
                         print_safe(f"Received invalid move: {msg}")
 
@@ -1068,23 +1550,21 @@ def main():
                 message_id = message.get('MESSAGE_ID')
                 if message_id:
                     ack_message = protocol.create_ack_message(message_id, "RECEIVED")
-                    target_ip = from_user_id.split('@')[1]
-                    network_handler.unicast(protocol.serialize_message(ack_message), target_ip)
-                    logger.log(ack_message, origin=f"Sent to {target_ip}")
+                    target_addr = online_peers.address(from_user_id)
+                    network_handler.send_to(protocol.serialize_message(ack_message), target_addr)
+                    logger.log(ack_message, origin=f"Sent to {target_addr[0]}")
              
             elif msg_type == protocol.MessageType.TICTACTOE_RESULT:
                 from_user_id = message.get('FROM')
                 gameid = message.get('GAMEID')
-                ttt_game = active_games.get(gameid)
-                if ttt_game:
-                    del active_games[gameid]
+                games.end(from_user_id, gameid)
                 # Send ACK for TICTACTOE_RESULT message
                 message_id = message.get('MESSAGE_ID')
                 if message_id:
                     ack_message = protocol.create_ack_message(message_id, "RECEIVED")
-                    target_ip = from_user_id.split('@')[1]
-                    network_handler.unicast(protocol.serialize_message(ack_message), target_ip)
-                    logger.log(ack_message, origin=f"Sent to {target_ip}")
+                    target_addr = online_peers.address(from_user_id)
+                    network_handler.send_to(protocol.serialize_message(ack_message), target_addr)
+                    logger.log(ack_message, origin=f"Sent to {target_addr[0]}")
 
 
 
@@ -1093,6 +1573,9 @@ def main():
         shutdown_event.set()
     finally:
         print_safe("\nShutting down client.")
+        discovery_replier.stop()
+        if store:
+            store.close()
         network_handler.close()
         broadcast_thread.join(timeout=1)
         input_thread.join(timeout=1)
@@ -1,28 +1,149 @@
 #Sidney Chan
 #Kellie Kaw
+import hashlib
 import socket
+from collections import deque
+import fragment
+from coalesce import Coalescer, BATCH_PREFIX, decode_batch
+
+def multicast_address(name):
+    """Maps an audience name such as 'group:<group_id>' to a fixed address in 239.255.0.0/16."""
+    digest = hashlib.sha1(name.encode('utf-8')).digest()
+    return f"239.255.{digest[0]}.{digest[1] or 1}"
 
 class NetworkHandler:
-    def __init__(self, port=50999):
+    def __init__(self, port=50999, fragment_size=1200, coalesce_window=0.002, multicast=True, bind='', broadcast_address='<broadcast>'):
         self.port = port
+        self.broadcast_address = broadcast_address # e.g. a subnet's broadcast address to stay on one interface
+        self.fragment_size = fragment_size # Messages larger than this are sent as FRAGMENTs
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        self.sock.bind(('', self.port))
+        self.sock.bind((bind, self.port))
         self.sock.settimeout(1.0)
+        self.sent_fragments = fragment.SentFragments()
+        self.reassembler = fragment.Reassembler()
+        # Small messages to the same address within coalesce_window seconds share a BATCH datagram
+        self.coalescer = Coalescer(self.sock.sendto, coalesce_window, fragment_size) if coalesce_window else None
+        self._ready = deque() # (message bytes, addr) unpacked from a BATCH, not yet returned
+        self.joined_groups = set()
+        self.multicast_enabled = multicast and self._enable_multicast()
+
+    def _enable_multicast(self):
+        # Multicast stays on the local link; our own copies are dropped like our own broadcasts
+        try:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            probe = multicast_address("probe")
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, self._membership(probe))
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, self._membership(probe))
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def _membership(group_ip):
+        return socket.inet_aton(group_ip) + socket.inet_aton('0.0.0.0')
+
+    def _send(self, message, addr, coalesce=True):
+        # Accepts a serialized message or pre-encoded bytes
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        if len(message) <= self.fragment_size:
+            if self.coalescer and coalesce:
+                self.coalescer.add(message, addr)
+            else:
+                self.sock.sendto(message, addr)
+            return
+        if self.coalescer:
+            self.coalescer.flush(addr) # Keep earlier small messages ahead of this one
+        frag_id, datagrams = fragment.split_message(message, self.fragment_size)
+        self.sent_fragments.add(frag_id, datagrams)
+        for datagram in datagrams:
+            self.sock.sendto(datagram, addr)
 
     def broadcast(self, message):
-        self.sock.sendto(message.encode('utf-8'), ('<broadcast>', self.port))
+        self._send(message, (self.broadcast_address, self.port))
 
     def unicast(self, message, ip_address):
-        self.sock.sendto(message.encode('utf-8'), (ip_address, self.port))
+        self._send(message, (ip_address, self.port))
+
+    def send_to(self, message, addr):
+        # addr is a pre-resolved (ip, port) tuple
+        self._send(message, addr)
+
+    def join_group(self, group_ip):
+        """Starts receiving datagrams sent to a multicast address. Returns False if multicast is unavailable."""
+        if not self.multicast_enabled:
+            return False
+        if group_ip not in self.joined_groups:
+            try:
+                self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, self._membership(group_ip))
+            except OSError:
+                return False
+            self.joined_groups.add(group_ip)
+        return True
+
+    def leave_group(self, group_ip):
+        if group_ip in self.joined_groups:
+            self.joined_groups.discard(group_ip)
+            try:
+                self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, self._membership(group_ip))
+            except OSError:
+                pass
+
+    def multicast(self, message, group_ip):
+        """Sends one copy to a multicast address. Returns False if it could not be sent, so the caller can unicast."""
+        if not self.multicast_enabled:
+            return False
+        try:
+            self._send(message, (group_ip, self.port), coalesce=False)
+        except OSError:
+            self.multicast_enabled = False # No multicast route; fall back to unicast from now on
+            return False
+        return True
 
     def receive(self):
+        """Returns the next complete message and its sender address, or (None, None).
+
+        Fragments are collected until their message is whole, NACKs for stalled
+        messages are sent from here, and BATCH datagrams are unpacked, so callers
+        only ever see single complete messages.
+        """
+        if self._ready:
+            data, addr = self._ready.popleft()
+            return data.decode('utf-8'), addr
+        for addr, frag_id, missing in self.reassembler.due():
+            self.sock.sendto(fragment.encode_nack(frag_id, missing), addr)
+        deadline = self.reassembler.next_deadline()
+        self.sock.settimeout(1.0 if deadline is None else min(1.0, max(deadline, 0.01)))
         try:
             data, addr = self.sock.recvfrom(32768) # Buffer size 32KB
-            return data.decode('utf-8'), addr
         except socket.timeout:
             return None, None
 
+        if data.startswith(fragment.FRAGMENT_PREFIX):
+            decoded = fragment.decode_fragment(data)
+            if decoded is None:
+                return None, None
+            data = self.reassembler.add(addr, *decoded)
+            if data is None:
+                return None, None
+        elif data.startswith(fragment.NACK_PREFIX):
+            nack = fragment.decode_nack(data)
+            if nack is not None:
+                for datagram in self.sent_fragments.get(*nack):
+                    self.sock.sendto(datagram, addr)
+            return None, None
+        if data.startswith(BATCH_PREFIX):
+            messages = decode_batch(data)
+            if not messages:
+                return None, None
+            self._ready.extend((m, addr) for m in messages[1:])
+            data = messages[0]
+        return data.decode('utf-8'), addr
+
     def close(self):
+        if self.coalescer:
+            self.coalescer.stop()
         self.sock.close()
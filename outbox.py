@@ -0,0 +1,136 @@
+#Sidney Chan
+#Kellie Kaw
+# Store-and-forward for reliable messages (DM, FOLLOW, UNFOLLOW, LIKE). Each message is
+# sent once and tracked until its ACK arrives; one that goes unacknowledged, or that was
+# meant for a peer we consider gone, waits in that peer's queue. The queue is bounded in
+# size and age and goes out in one paced burst as soon as the peer is heard from again.
+import threading
+import time
+from collections import OrderedDict
+import protocol
+
+
+class RecentIds:
+    """Remembers the last `limit` MESSAGE_IDs, to spot resends we already delivered."""
+
+    def __init__(self, limit=4096):
+        self.limit = limit
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, message_id):
+        """Records a MESSAGE_ID. Returns False if it was already recorded."""
+        if not message_id:
+            return True
+        with self._lock:
+            if message_id in self._ids:
+                self._ids.move_to_end(message_id)
+                return False
+            self._ids[message_id] = None
+            if len(self._ids) > self.limit:
+                self._ids.popitem(last=False)
+            return True
+
+
+class Outbox:
+    """Per-peer queues of reliable messages awaiting an ACK.
+
+    send(serialized, peer_id) puts a message on the wire. A message is given up on after
+    max_attempts sends or max_age seconds; each peer's queue holds at most max_per_peer
+    messages, the oldest being dropped first.
+    """
+
+    def __init__(self, send=None, ack_timeout=5.0, max_per_peer=100, max_age=3600, max_attempts=5, pace_every=32):
+        self.send = send
+        self.ack_timeout = ack_timeout
+        self.max_per_peer = max_per_peer
+        self.max_age = max_age
+        self.max_attempts = max_attempts
+        self.pace_every = pace_every  # Yield briefly after this many messages of a flush
+        self._in_flight = {}  # message_id -> (peer_id, message, queued_at, attempts, sent_at)
+        self._queues = {}     # peer_id -> OrderedDict of message_id -> (message, queued_at, attempts)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def submit(self, peer_id, message, online=True):
+        """Sends a message now, or only queues it if the peer is known to be away. Returns True if sent."""
+        now = time.time()
+        if not online:
+            with self._lock:
+                self._enqueue(peer_id, message['MESSAGE_ID'], message, now, 0)
+            return False
+        with self._lock:
+            self._in_flight[message['MESSAGE_ID']] = (peer_id, message, now, 1, time.monotonic())
+        self.send(protocol.serialize_message(message), peer_id)
+        return True
+
+    def on_ack(self, message_id):
+        """Settles a message when its ACK arrives. Returns True if it was one of ours."""
+        with self._lock:
+            if self._in_flight.pop(message_id, None) is not None:
+                return True
+            for queue in self._queues.values():
+                if queue.pop(message_id, None) is not None:
+                    return True  # A late ACK for a message we had already queued
+        return False
+
+    def due(self):
+        """Moves messages whose ACK is overdue into their peer's queue."""
+        now = time.monotonic()
+        with self._lock:
+            overdue = [message_id for message_id, entry in self._in_flight.items() if now - entry[4] >= self.ack_timeout]
+            for message_id in overdue:
+                peer_id, message, queued_at, attempts, _ = self._in_flight.pop(message_id)
+                self._enqueue(peer_id, message_id, message, queued_at, attempts)
+
+    def on_seen(self, peer_id):
+        """Flushes a peer's queue, if any, now that it has been heard from."""
+        if peer_id not in self._queues:
+            return False
+        now = time.time()
+        with self._lock:
+            queue = self._queues.pop(peer_id, None)
+            if not queue:
+                return False
+            batch = []
+            # Oldest first, so a conversation arrives in the order it was written
+            for message_id, (message, queued_at, attempts) in sorted(queue.items(), key=lambda item: item[1][1]):
+                if now - queued_at > self.max_age or attempts >= self.max_attempts:
+                    self.dropped += 1
+                    continue
+                self._in_flight[message_id] = (peer_id, message, queued_at, attempts + 1, time.monotonic())
+                batch.append(message)
+        if batch:
+            threading.Thread(target=self._flush, args=(peer_id, batch), daemon=True).start()
+        return bool(batch)
+
+    def queued(self, peer_id=None):
+        with self._lock:
+            if peer_id is not None:
+                return len(self._queues.get(peer_id, ()))
+            return sum(len(queue) for queue in self._queues.values())
+
+    def _enqueue(self, peer_id, message_id, message, queued_at, attempts):
+        queue = self._queues.setdefault(peer_id, OrderedDict())
+        queue[message_id] = (message, queued_at, attempts)
+        while len(queue) > self.max_per_peer:
+            queue.popitem(last=False)
+            self.dropped += 1
+
+    def _flush(self, peer_id, batch):
+        # Sent back to back so the coalescer packs them into BATCH datagrams
+        for i, message in enumerate(batch):
+            try:
+                self.send(protocol.serialize_message(self._refresh(message)), peer_id)
+            except OSError:
+                return
+            if (i + 1) % self.pace_every == 0:
+                time.sleep(0.001)
+
+    @staticmethod
+    def _refresh(message):
+        # A queued message can outlive its token; reissue it for the same user and scope
+        parts = message.get('TOKEN', "").split('|')
+        if len(parts) == 3:
+            message = dict(message, TOKEN=protocol.issue_token(parts[0], parts[2]))
+        return message
@@ -0,0 +1,190 @@
+#Sidney Chan
+#Kellie Kaw
+# Peer records and liveness: compact slotted Peer objects with a pre-resolved address,
+# last-seen tracking with a min-heap of expiry deadlines, and a heartbeat interval
+# that adapts to how much the peer set is churning.
+import heapq
+import sys
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+import protocol
+
+
+@lru_cache(maxsize=4096)
+def address_of(user_id, port):
+    """Resolves 'name@ip' to an (ip, port) tuple once and memoizes it. Returns None if user_id is malformed."""
+    parts = user_id.split('@') if isinstance(user_id, str) else ()
+    if len(parts) != 2 or not parts[0] or not parts[1]:
+        return None
+    return (parts[1], port)
+
+
+class Peer:
+    """What we keep about a known peer. Only the fields we display or route on are stored."""
+    __slots__ = ('user_id', 'addr', 'display_name', 'status', 'avatar_type', 'avatar_hash', 'avatar_size', 'profile_digest', 'flags')
+
+    HAS_PROFILE = 0x1  # A PROFILE has been received, not just a PING
+    HAS_AVATAR = 0x2
+    MULTICAST = 0x4    # Advertised MULTICAST:1, so it receives group and follower multicasts
+
+    def __init__(self, user_id, addr):
+        self.user_id = sys.intern(user_id)
+        self.addr = addr
+        self.display_name = None
+        self.status = None
+        self.avatar_type = None
+        self.avatar_hash = None
+        self.avatar_size = None
+        self.profile_digest = None
+        self.flags = 0
+
+    def update_from_profile(self, message):
+        self.display_name = message.get('DISPLAY_NAME') or ""
+        self.status = message.get('STATUS', "")
+        self.avatar_hash = message.get('AVATAR_HASH') or None
+        self.avatar_type = message.get('AVATAR_TYPE') if self.avatar_hash else None
+        size = message.get('AVATAR_SIZE')
+        self.avatar_size = int(size) if self.avatar_hash and str(size).isdigit() else None
+        self.profile_digest = protocol.profile_digest(message)
+        self.flags |= Peer.HAS_PROFILE
+        if self.avatar_hash:
+            self.flags |= Peer.HAS_AVATAR
+        else:
+            self.flags &= ~Peer.HAS_AVATAR
+        if message.get('MULTICAST') == "1":
+            self.flags |= Peer.MULTICAST
+        else:
+            self.flags &= ~Peer.MULTICAST
+
+    @property
+    def has_avatar(self):
+        return bool(self.flags & Peer.HAS_AVATAR)
+
+    @property
+    def multicast(self):
+        return bool(self.flags & Peer.MULTICAST)
+
+
+class PeerTable(dict):
+    """online_peers mapping (user_id -> Peer) that forgets peers once they go quiet.
+
+    Every packet from a known peer pushes its deadline out to last_seen + timeout,
+    where timeout is a few of the peer's advertised heartbeat intervals. Deadlines
+    live in a min-heap with lazy deletion, so expire() only looks at the heap top.
+    """
+
+    def __init__(self, port=50999, default_interval=300, missed_heartbeats=3, max_departed=4096):
+        super().__init__()
+        self.port = port
+        self.default_interval = default_interval
+        self.missed_heartbeats = missed_heartbeats
+        self.max_departed = max_departed
+        self._last_seen = {}   # user_id -> monotonic time of last packet
+        self._timeout = {}     # user_id -> seconds of silence before eviction
+        self._deadlines = []   # (deadline, user_id), stale entries skipped on pop
+        self._departed = OrderedDict()  # user_id -> eviction time, for peers known to be gone
+        self._lock = threading.Lock()
+
+    def __setitem__(self, user_id, info):
+        super().__setitem__(user_id, info)
+        self.seen(user_id)
+
+    def __delitem__(self, user_id):
+        super().__delitem__(user_id)
+        with self._lock:
+            self._last_seen.pop(user_id, None)
+            self._timeout.pop(user_id, None)
+
+    def address(self, user_id):
+        """Returns the cached (ip, port) of a peer, resolving unknown user_ids on the fly."""
+        peer = self.get(user_id)
+        if peer is not None:
+            return peer.addr
+        return address_of(user_id, self.port)
+
+    def add(self, user_id):
+        """Returns the Peer for user_id, creating it if we have not seen it before. None if user_id is malformed."""
+        peer = self.get(user_id)
+        if peer is None:
+            addr = address_of(user_id, self.port)
+            if addr is None:
+                return None
+            peer = Peer(user_id, addr)
+            self[user_id] = peer
+        return peer
+
+    def seen(self, user_id, interval=None):
+        """Records traffic from a peer. interval is the heartbeat period it advertised, if any."""
+        if user_id not in self:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if interval:
+                self._timeout[user_id] = interval * self.missed_heartbeats
+            timeout = self._timeout.setdefault(user_id, self.default_interval * self.missed_heartbeats)
+            self._last_seen[user_id] = now
+            self._departed.pop(user_id, None)
+            heapq.heappush(self._deadlines, (now + timeout, user_id))
+            if len(self._deadlines) > 4 * len(self) + 64:
+                self._compact()
+
+    def _compact(self):
+        # Rebuild the heap from live deadlines so repeated seen() calls do not grow it
+        self._deadlines = [(self._last_seen[u] + self._timeout[u], u) for u in self._last_seen]
+        heapq.heapify(self._deadlines)
+
+    def expire(self):
+        """Evicts every peer whose deadline has passed and returns their user_ids."""
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            heap = self._deadlines
+            while heap and heap[0][0] <= now:
+                deadline, user_id = heapq.heappop(heap)
+                last_seen = self._last_seen.get(user_id)
+                if last_seen is None or last_seen + self._timeout[user_id] != deadline:
+                    continue  # Superseded by a later packet or already removed
+                del self._last_seen[user_id]
+                del self._timeout[user_id]
+                self._departed[user_id] = now
+                while len(self._departed) > self.max_departed:
+                    self._departed.popitem(last=False)
+                evicted.append(user_id)
+        for user_id in evicted:
+            super().pop(user_id, None)
+        return evicted
+
+    def is_departed(self, user_id):
+        """True if the peer was evicted for silence and has not been heard from since."""
+        return user_id in self._departed
+
+    def last_seen(self, user_id):
+        return self._last_seen.get(user_id)
+
+
+class AdaptiveHeartbeat:
+    """Heartbeat period that shortens while peers are joining or leaving and relaxes back when the set is stable."""
+
+    def __init__(self, min_interval=30, max_interval=300):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = max_interval
+        self._churn = 0
+        self._lock = threading.Lock()
+
+    def record_churn(self, count=1):
+        with self._lock:
+            self._churn += count
+
+    def next_interval(self):
+        """Returns the period until the next heartbeat, adjusted for churn seen since the last one."""
+        with self._lock:
+            churn = self._churn
+            self._churn = 0
+        if churn:
+            self.interval = max(self.min_interval, self.interval / (1 + churn))
+        else:
+            self.interval = min(self.max_interval, self.interval * 1.5)
+        return int(self.interval)
@@ -0,0 +1,245 @@
+#Sidney Chan
+#Kellie Kaw
+# Optional SQLite persistence for histories, follows, groups and likes.
+# Writes are queued and applied in batches by a single writer thread (WAL mode),
+# so callers on the receive loop never wait on disk. Reads use their own connection.
+import queue
+import sqlite3
+import threading
+import time
+
+from shared import print_safe
+from storage import StoredMessage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    peer TEXT NOT NULL,
+    sender TEXT,
+    timestamp INTEGER NOT NULL,
+    content TEXT,
+    message_id TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_peer_ts ON messages (kind, peer, timestamp);
+CREATE INDEX IF NOT EXISTS messages_message_id ON messages (message_id);
+CREATE TABLE IF NOT EXISTS follows (
+    kind TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    PRIMARY KEY (kind, user_id)
+);
+CREATE TABLE IF NOT EXISTS groups (
+    group_id TEXT PRIMARY KEY,
+    group_name TEXT,
+    owner TEXT,
+    members TEXT,
+    version INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS likes (
+    author TEXT NOT NULL,
+    post_timestamp TEXT NOT NULL,
+    PRIMARY KEY (author, post_timestamp)
+);
+"""
+
+# Full-text index over message contents, kept in step with the messages table by triggers
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, content='messages', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+"""
+
+# Group messages are stored with kind 'GROUP' and the group ID as peer, so the
+# (kind, peer, timestamp) index doubles as the (group_id, timestamp) index.
+GROUP_KIND = "GROUP"
+
+
+class SQLiteStore:
+    def __init__(self, path, batch_size=256, flush_interval=0.2):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._closed = False
+
+        writer = sqlite3.connect(path, check_same_thread=False)
+        writer.execute("PRAGMA journal_mode=WAL")
+        writer.execute("PRAGMA synchronous=NORMAL")
+        writer.executescript(SCHEMA)
+        try:
+            # Databases created before groups were versioned
+            writer.execute("ALTER TABLE groups ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+        self.full_text = self._create_fts(writer)
+        writer.commit()
+        self._writer = writer
+
+        self._reader = sqlite3.connect(path, check_same_thread=False)
+        self._read_lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _create_fts(writer):
+        existed = writer.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone()
+        try:
+            writer.executescript(FTS_SCHEMA)
+        except sqlite3.OperationalError:
+            return False  # SQLite built without FTS5: stored messages are not searchable
+        if not existed:
+            # Databases created before full-text search: index what they already hold
+            writer.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        return True
+
+    # --- Writes (queued) ---
+
+    def _enqueue(self, sql, params):
+        if not self._closed:
+            self._queue.put((sql, params))
+
+    def save_message(self, kind, peer, record):
+        self._enqueue("INSERT INTO messages (kind, peer, sender, timestamp, content, message_id) VALUES (?, ?, ?, ?, ?, ?)",
+                      (kind, peer, record.sender, record.timestamp, record.content, record.message_id))
+
+    def delete_messages(self, kind, peer):
+        self._enqueue("DELETE FROM messages WHERE kind = ? AND peer = ?", (kind, peer))
+
+    def set_follow(self, kind, user_id, present):
+        if present:
+            self._enqueue("INSERT OR IGNORE INTO follows (kind, user_id) VALUES (?, ?)", (kind, user_id))
+        else:
+            self._enqueue("DELETE FROM follows WHERE kind = ? AND user_id = ?", (kind, user_id))
+
+    def save_group(self, group_id, group_name, owner, members, version=1):
+        self._enqueue("INSERT OR REPLACE INTO groups (group_id, group_name, owner, members, version) VALUES (?, ?, ?, ?, ?)",
+                      (group_id, group_name, owner, members, version))
+
+    def delete_group(self, group_id):
+        self._enqueue("DELETE FROM groups WHERE group_id = ?", (group_id,))
+
+    def set_like(self, author, post_timestamp, present):
+        if present:
+            self._enqueue("INSERT OR IGNORE INTO likes (author, post_timestamp) VALUES (?, ?)", (author, post_timestamp))
+        else:
+            self._enqueue("DELETE FROM likes WHERE author = ? AND post_timestamp = ?", (author, post_timestamp))
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            batch = [item]
+            # Gather whatever else arrives within the flush window into the same transaction
+            deadline = time.monotonic() + self.flush_interval
+            try:
+                while len(batch) < self.batch_size:
+                    nxt = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                    if nxt is None:
+                        self._queue.put(None)  # Re-queue the stop marker for after this batch
+                        self._queue.task_done()
+                        break
+                    batch.append(nxt)
+            except queue.Empty:
+                pass
+            try:
+                with self._writer:
+                    for sql, params in batch:
+                        self._writer.execute(sql, params)
+            except sqlite3.Error as e:
+                print_safe(f"Persistence error: {e}")
+            for _ in batch:
+                self._queue.task_done()
+
+    def flush(self):
+        """Blocks until every queued write has been committed."""
+        self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        self._writer.close()
+        self._reader.close()
+
+    # --- Reads ---
+
+    def _query(self, sql, params=()):
+        with self._read_lock:
+            return self._reader.execute(sql, params).fetchall()
+
+    def load_messages(self, kind, peer, limit=None):
+        """Returns a peer's stored messages oldest first, at most the newest `limit` of them."""
+        rows = self._query("SELECT sender, timestamp, content, message_id FROM messages WHERE kind = ? AND peer = ? "
+                           "ORDER BY timestamp DESC, id DESC LIMIT ?", (kind, peer, limit if limit else -1))
+        return [StoredMessage(*row) for row in reversed(rows)]
+
+    def has_messages(self, kind, peer):
+        return bool(self._query("SELECT 1 FROM messages WHERE kind = ? AND peer = ? LIMIT 1", (kind, peer)))
+
+    def find_message(self, message_id):
+        """Looks a message up by MESSAGE_ID. Returns (kind, peer, StoredMessage) or None."""
+        rows = self._query("SELECT kind, peer, sender, timestamp, content, message_id FROM messages WHERE message_id = ? LIMIT 1",
+                           (message_id,))
+        if not rows:
+            return None
+        kind, peer, *fields = rows[0]
+        return kind, peer, StoredMessage(*fields)
+
+    def last_message_id(self):
+        self.flush()
+        return self._query("SELECT COALESCE(MAX(id), 0) FROM messages")[0][0]
+
+    def search(self, match, kind=None, peer=None, group=None, sender=None, since=None, until=None, limit=20):
+        """Full-text search over stored messages, with the same filters as SearchIndex.search.
+
+        match is an FTS5 expression (see search.fts_query), or None to filter only. Returns
+        (score, kind, peer, StoredMessage) tuples, best first; a higher score is a better match.
+        """
+        if match and not self.full_text:
+            return []
+        where, params = [], []
+        if match:
+            source = "messages_fts JOIN messages m ON m.id = messages_fts.rowid"
+            score, order = "-bm25(messages_fts)", "bm25(messages_fts), m.timestamp DESC"
+            where.append("messages_fts MATCH ?")
+            params.append(match)
+        else:
+            source, score, order = "messages m", "0.0", "m.timestamp DESC"
+        if kind is not None:
+            where.append("m.kind = ?")
+            params.append(kind)
+        if peer is not None:
+            where.append("m.kind IN ('DM', 'POST') AND m.peer = ?")
+            params.append(peer)
+        if group is not None:
+            where.append(f"m.kind = '{GROUP_KIND}' AND m.peer = ?")
+            params.append(group)
+        for clause, value in (("m.sender = ?", sender), ("m.timestamp >= ?", since), ("m.timestamp <= ?", until)):
+            if value is not None:
+                where.append(clause)
+                params.append(value)
+        sql = (f"SELECT {score}, m.kind, m.peer, m.sender, m.timestamp, m.content, m.message_id FROM {source}"
+               f"{' WHERE ' + ' AND '.join(where) if where else ''} ORDER BY {order} LIMIT ?")
+        try:
+            rows = self._query(sql, params + [limit])
+        except sqlite3.OperationalError:
+            return []  # e.g. a query FTS5 cannot parse
+        return [(row_score, row_kind, row_peer, StoredMessage(*fields)) for row_score, row_kind, row_peer, *fields in rows]
+
+    def load_follows(self, kind):
+        return {row[0] for row in self._query("SELECT user_id FROM follows WHERE kind = ?", (kind,))}
+
+    def load_groups(self):
+        return self._query("SELECT group_id, group_name, owner, members, version FROM groups")
+
+    def load_likes(self):
+        return self._query("SELECT author, post_timestamp FROM likes")
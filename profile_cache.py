@@ -0,0 +1,26 @@
+#Sidney Chan
+#Kellie Kaw
+# Keeps our own PROFILE message pre-serialized so broadcasts and discovery replies reuse the same bytes.
+import threading
+import protocol
+
+
+class ProfileCache:
+    def __init__(self, profile_message):
+        self._message = dict(profile_message)
+        self._frame = None
+        self._lock = threading.Lock()
+
+    @property
+    def message(self):
+        return self._message
+
+    def frame(self):
+        """Returns the encoded PROFILE datagram, serializing it on first use."""
+        frame = self._frame
+        if frame is None:
+            with self._lock:
+                if self._frame is None:
+                    self._frame = protocol.serialize_message(self._message).encode('utf-8')
+                frame = self._frame
+        return frame
@@ -3,6 +3,8 @@
 # Defines the LSNP message formats and provides functions for creating and parsing messages.
 import time
 import secrets
+import hashlib
+from tokens import TokenCache
 
 SCOPES = {"chat", "file", "broadcast", "follow", "game", "group"}
 
@@ -20,6 +22,7 @@ class MessageType:
     FILE_OFFER = "FILE_OFFER"
     FILE_CHUNK = "FILE_CHUNK"
     FILE_RECEIVED = "FILE_RECEIVED"
+    FILE_ACK = "FILE_ACK"
     REVOKE = "REVOKE"
     
     TICTACTOE_INVITE = "TICTACTOE_INVITE"
@@ -30,34 +33,179 @@ class MessageType:
     GROUP_CREATE = "GROUP_CREATE"
     GROUP_UPDATE = "GROUP_UPDATE"
     GROUP_MESSAGE = "GROUP_MESSAGE"
+    GROUP_NACK = "GROUP_NACK"
+    GROUP_SNAPSHOT_REQUEST = "GROUP_SNAPSHOT_REQUEST"
+    GROUP_SNAPSHOT = "GROUP_SNAPSHOT"
+    GROUP_SYNC = "GROUP_SYNC"
 
+    AVATAR_REQUEST = "AVATAR_REQUEST"
+    AVATAR_RESPONSE = "AVATAR_RESPONSE"
 
-def create_profile_message(user_id, display_name, status, avatar_type=None, avatar_encoding=None, avatar_data=None):
-    """Creates a PROFILE message dictionary."""
+    PEER_LIST_REQUEST = "PEER_LIST_REQUEST"
+    PEER_LIST = "PEER_LIST"
+    PROFILE_REQUEST = "PROFILE_REQUEST"
+    FEED_DIGEST = "FEED_DIGEST"
+
+    # Transport-level, handled inside NetworkHandler (see fragment.py)
+    FRAGMENT = "FRAGMENT"
+    FRAGMENT_NACK = "FRAGMENT_NACK"
+    BATCH = "BATCH"
+
+
+def create_profile_message(user_id, display_name, status, avatar_type=None, avatar_encoding=None, avatar_data=None, avatar_hash=None, avatar_size=None, multicast=False):
+    """Creates a PROFILE message dictionary.
+
+    With avatar_hash the avatar is advertised by hash and size only; peers fetch the
+    bytes with AVATAR_REQUEST. avatar_data embeds the avatar inline (legacy form).
+    multicast advertises that group and follower messages can reach us by multicast.
+    """
     message = {
         "TYPE": MessageType.PROFILE,
         "USER_ID": user_id,
         "DISPLAY_NAME": display_name if display_name else "",
         "STATUS": status
     }
-    if avatar_type and avatar_encoding and avatar_data:
+    if avatar_type and avatar_hash:
+        message["AVATAR_TYPE"] = avatar_type
+        message["AVATAR_HASH"] = avatar_hash
+        message["AVATAR_SIZE"] = avatar_size
+    elif avatar_type and avatar_encoding and avatar_data:
         message["AVATAR_TYPE"] = avatar_type
         message["AVATAR_ENCODING"] = avatar_encoding
         message["AVATAR_DATA"] = avatar_data
+    if multicast:
+        message["MULTICAST"] = 1
     return message
 
-def create_ping_message(user_id):
-    """Creates a PING message dictionary."""
+def create_avatar_request(from_user_id, to_user_id, avatar_hash):
+    """Asks a peer for the avatar bytes matching a hash it advertised."""
+    return {
+        "TYPE": MessageType.AVATAR_REQUEST,
+        "FROM": from_user_id,
+        "TO": to_user_id,
+        "AVATAR_HASH": avatar_hash
+    }
+
+def create_avatar_response(from_user_id, to_user_id, avatar_hash, avatar_type, avatar_data):
     return {
+        "TYPE": MessageType.AVATAR_RESPONSE,
+        "FROM": from_user_id,
+        "TO": to_user_id,
+        "AVATAR_HASH": avatar_hash,
+        "AVATAR_TYPE": avatar_type,
+        "AVATAR_ENCODING": "base64",
+        "AVATAR_DATA": avatar_data
+    }
+
+def profile_digest(profile):
+    """Short fingerprint of the user-visible PROFILE fields, used to spot stale or missing profiles."""
+    fields = "\n".join(str(profile.get(key, "")) for key in ("USER_ID", "DISPLAY_NAME", "STATUS", "AVATAR_HASH"))
+    return hashlib.sha1(fields.encode('utf-8')).hexdigest()[:8]
+
+def create_peer_list_request(from_user_id, to_user_id):
+    """Asks a neighbor for a digest of every peer it knows."""
+    return {
+        "TYPE": MessageType.PEER_LIST_REQUEST,
+        "FROM": from_user_id,
+        "TO": to_user_id
+    }
+
+def create_peer_list_messages(from_user_id, to_user_id, entries, max_size=1200):
+    """Packs (user_id, profile_digest) pairs into as few PEER_LIST messages as fit within max_size bytes."""
+    parts = []
+    batch = []
+    size = 0
+    for peer_id, digest in entries:
+        item = f"{peer_id}={digest or ''}"
+        if batch and size + len(item) + 1 > max_size:
+            parts.append(batch)
+            batch = []
+            size = 0
+        batch.append(item)
+        size += len(item) + 1
+    if batch or not parts:
+        parts.append(batch)
+    return [{
+        "TYPE": MessageType.PEER_LIST,
+        "FROM": from_user_id,
+        "TO": to_user_id,
+        "PART": i + 1,
+        "TOTAL": len(parts),
+        "PEERS": ",".join(batch)
+    } for i, batch in enumerate(parts)]
+
+def create_feed_digest(from_user_id, to_user_id, posts_since=None, group_marks=()):
+    """High-water marks of what we hold from a peer: the TIMESTAMP of its newest post
+    and, per shared group, the EPOCH and last SEQ delivered from it."""
+    message = {
+        "TYPE": MessageType.FEED_DIGEST,
+        "FROM": from_user_id,
+        "TO": to_user_id,
+    }
+    if posts_since is not None:
+        message["POSTS_SINCE"] = posts_since
+    if group_marks:
+        message["GROUPS"] = ",".join(f"{group_id}={epoch}:{seq}" for group_id, epoch, seq in group_marks)
+    message["TOKEN"] = issue_token(from_user_id, "broadcast")
+    return message
+
+def parse_group_marks(message):
+    """Returns the (group_id, epoch, seq) marks carried by a FEED_DIGEST."""
+    marks = []
+    for item in message.get("GROUPS", "").split(","):
+        group_id, _, mark = item.rpartition("=")
+        epoch, _, seq = mark.partition(":")
+        if group_id and seq.isdigit():
+            marks.append((group_id, epoch, int(seq)))
+    return marks
+
+def parse_peer_list(message):
+    """Returns the (user_id, profile_digest) pairs carried by a PEER_LIST message."""
+    entries = []
+    for item in message.get("PEERS", "").split(","):
+        peer_id, _, digest = item.partition("=")
+        if peer_id:
+            entries.append((peer_id, digest or None))
+    return entries
+
+def create_profile_request(from_user_id, to_user_id):
+    """Asks a peer to send its PROFILE straight back."""
+    return {
+        "TYPE": MessageType.PROFILE_REQUEST,
+        "FROM": from_user_id,
+        "TO": to_user_id
+    }
+
+def create_ping_message(user_id, interval=None):
+    """Creates a PING message dictionary. interval advertises our current heartbeat period in seconds."""
+    message = {
         "TYPE": MessageType.PING,
         "USER_ID": user_id
     }
+    if interval:
+        message["INTERVAL"] = interval
+    return message
 
 def create_token(user_id, scope, ttl=3600):
     """Creates a token for a given scope."""
     expiration = int(time.time()) + ttl
     return f"{user_id}|{expiration}|{scope}"
 
+_token_cache = TokenCache()
+
+_token_manager = None
+
+def use_token_manager(manager):
+    """Routes token issuing through a TokenManager so live tokens are reused per scope."""
+    global _token_manager
+    _token_manager = manager
+
+def issue_token(user_id, scope, ttl=3600):
+    """Returns a token for a scope, reusing a live one when a token manager is set."""
+    if _token_manager is not None:
+        return _token_manager.get(user_id, scope, ttl)
+    return create_token(user_id, scope, ttl)
+
 def validate_token(token, expected_scope, sender_user_id=None, revoked_tokens=None):
     if not token:
         return False
@@ -65,24 +213,19 @@ def validate_token(token, expected_scope, sender_user_id=None, revoked_tokens=No
     if revoked_tokens and token in revoked_tokens:
         return False
     
-    parts = token.split('|')
-    if len(parts) != 3:
+    # Parsed tokens are cached, so a repeat token costs one dict lookup
+    parsed = _token_cache.get(token)
+    if parsed is None:
         return False
     
-    user_id, expiration, scope = parts
+    user_id, exp, scope = parsed
 
     # if user id and sender are same
     if sender_user_id and user_id != sender_user_id:
         return False
     
     # validate expiration timestamp
-    try:
-        exp = int(expiration)
-    except ValueError:
-        return False
-    
-    current_time = int(time.time())
-    if exp < current_time:
+    if exp < int(time.time()):
         return False
     
     # validate scope
@@ -97,16 +240,32 @@ def create_revoke_message(user_id, token):
         "TOKEN": token
     }
 
-def create_post_message(user_id, content, ttl=3600):
-    """Creates a POST message dictionary."""
+def create_bulk_revoke_messages(user_id, tokens, max_size=1200):
+    """Packs many tokens into as few REVOKE messages as fit within max_size bytes each."""
+    messages = []
+    batch = []
+    size = 0
+    for token in tokens:
+        if batch and size + len(token) + 1 > max_size:
+            messages.append({"TYPE": MessageType.REVOKE, "FROM": user_id, "TOKENS": ",".join(batch)})
+            batch = []
+            size = 0
+        batch.append(token)
+        size += len(token) + 1
+    if batch:
+        messages.append({"TYPE": MessageType.REVOKE, "FROM": user_id, "TOKENS": ",".join(batch)})
+    return messages
+
+def create_post_message(user_id, content, ttl=3600, message_id=None, timestamp=None):
+    """Creates a POST message dictionary. message_id and timestamp are given when re-sending an old post."""
     return {
         "TYPE": MessageType.POST,
         "USER_ID": user_id,
         "CONTENT": content,
         "TTL": ttl,
-        "MESSAGE_ID": secrets.token_hex(8),
-        "TOKEN": create_token(user_id, "broadcast", ttl),
-        "TIMESTAMP": int(time.time())
+        "MESSAGE_ID": message_id or secrets.token_hex(8),
+        "TOKEN": issue_token(user_id, "broadcast", ttl),
+        "TIMESTAMP": timestamp or int(time.time())
     }
 
 def create_dm_message(from_user_id, to_user_id, content):
@@ -118,7 +277,7 @@ def create_dm_message(from_user_id, to_user_id, content):
         "CONTENT": content,
         "TIMESTAMP": int(time.time()),
         "MESSAGE_ID": secrets.token_hex(8),
-        "TOKEN": create_token(from_user_id, "chat")
+        "TOKEN": issue_token(from_user_id, "chat")
     }
 
 def create_follow_message(from_user_id, to_user_id):
@@ -129,7 +288,7 @@ def create_follow_message(from_user_id, to_user_id):
         "TO": to_user_id,
         "TIMESTAMP": int(time.time()),
         "MESSAGE_ID": secrets.token_hex(8),
-        "TOKEN": create_token(from_user_id, "follow")
+        "TOKEN": issue_token(from_user_id, "follow")
     }
 
 def create_unfollow_message(from_user_id, to_user_id):
@@ -140,7 +299,7 @@ def create_unfollow_message(from_user_id, to_user_id):
         "TO": to_user_id,
         "TIMESTAMP": int(time.time()),
         "MESSAGE_ID": secrets.token_hex(8),
-        "TOKEN": create_token(from_user_id, "follow")
+        "TOKEN": issue_token(from_user_id, "follow")
     }
 
 def create_ack_message(message_id, status):
@@ -164,7 +323,7 @@ def create_file_offer_message(from_user_id, to_user_id, filename, filesize, file
         "DESCRIPTION": description,
         "TIMESTAMP": int(time.time()),
         "MESSAGE_ID": secrets.token_hex(8),
-        "TOKEN": create_token(from_user_id, "file")
+        "TOKEN": issue_token(from_user_id, "file")
     }
 
 def create_file_chunk_message(from_user_id, to_user_id, fileid, chunk_index, total_chunks, chunk_size, data):
@@ -179,8 +338,22 @@ def create_file_chunk_message(from_user_id, to_user_id, fileid, chunk_index, tot
         "CHUNK_SIZE": chunk_size,
         "DATA": data,
         "MESSAGE_ID": secrets.token_hex(8),
-        "TOKEN": create_token(from_user_id, "file")
+        "TOKEN": issue_token(from_user_id, "file")
+    }
+
+def create_file_ack_message(from_user_id, to_user_id, fileid, cum, sack=""):
+    """Creates a FILE_ACK: CUM chunks received in order, plus SACK ranges (e.g. '20-35,40') beyond them."""
+    message = {
+        "TYPE": MessageType.FILE_ACK,
+        "FROM": from_user_id,
+        "TO": to_user_id,
+        "FILEID": fileid,
+        "CUM": cum,
     }
+    if sack:
+        message["SACK"] = sack
+    message["TOKEN"] = issue_token(from_user_id, "file")
+    return message
 
 def create_file_received_message(from_user_id, to_user_id, fileid, status):
     """Creates a FILE_RECEIVED message dictionary."""
@@ -201,7 +374,8 @@ def create_like_message(from_user_id, to_user_id, post_timestamp, action="LIKE")
         "POST_TIMESTAMP": post_timestamp,
         "ACTION": action,
         "TIMESTAMP": int(time.time()),
-        "TOKEN": create_token(from_user_id, "broadcast")
+        "MESSAGE_ID": secrets.token_hex(8),
+        "TOKEN": issue_token(from_user_id, "broadcast")
     }
 
 def create_group_create(from_user, group_name, members):
@@ -212,30 +386,86 @@ def create_group_create(from_user, group_name, members):
         "GROUP_ID": f"{group_name.replace(' ', '').lower()}{ts}",
         "GROUP_NAME": group_name,
         "MEMBERS": ",".join(members),
+        "VERSION": 1,
         "TIMESTAMP": ts,
-        "TOKEN": create_token(from_user, "group")
+        "TOKEN": issue_token(from_user, "group")
     }
 
-def create_group_update(from_user, group_id, add=None, remove=None):
+def create_group_update(from_user, group_id, add=None, remove=None, base_version=None):
     msg = {
         "TYPE": MessageType.GROUP_UPDATE,
         "FROM": from_user,
         "GROUP_ID": group_id,
         "TIMESTAMP": int(time.time()),
-        "TOKEN": create_token(from_user, "group")
+        "TOKEN": issue_token(from_user, "group")
     }
     if add: msg["ADD"] = ",".join(add)
     if remove: msg["REMOVE"] = ",".join(remove)
+    if base_version is not None:
+        # The deltas apply to BASE_VERSION and produce VERSION
+        msg["BASE_VERSION"] = base_version
+        msg["VERSION"] = base_version + 1
     return msg
 
-def create_group_message(from_user, group_id, content):
+def create_group_snapshot_request(from_user, to_user, group_id):
+    """Asks a group's owner for its current membership after a version mismatch."""
+    return {
+        "TYPE": MessageType.GROUP_SNAPSHOT_REQUEST,
+        "FROM": from_user,
+        "TO": to_user,
+        "GROUP_ID": group_id,
+        "TOKEN": issue_token(from_user, "group")
+    }
+
+def create_group_snapshot(from_user, to_user, group):
+    """Full membership of a group at its current version."""
     return {
+        "TYPE": MessageType.GROUP_SNAPSHOT,
+        "FROM": from_user,
+        "TO": to_user,
+        "GROUP_ID": group.group_id,
+        "GROUP_NAME": group.name,
+        "MEMBERS": group.members_field(),
+        "VERSION": group.version,
+        "TOKEN": issue_token(from_user, "group")
+    }
+
+def create_group_message(from_user, group_id, content, seq=None, epoch=None):
+    msg = {
         "TYPE": MessageType.GROUP_MESSAGE,
         "FROM": from_user,
         "GROUP_ID": group_id,
         "CONTENT": content,
         "TIMESTAMP": int(time.time()),
-        "TOKEN": create_token(from_user, "group")
+    }
+    if seq is not None:
+        # Per-sender sequence number; EPOCH changes when the sender restarts
+        msg["SEQ"] = seq
+        msg["EPOCH"] = epoch
+    msg["TOKEN"] = issue_token(from_user, "group")
+    return msg
+
+def create_group_nack(from_user, to_user, group_id, epoch, seqs):
+    """Asks a group message sender to resend the listed SEQ ranges (e.g. '4-6,9')."""
+    return {
+        "TYPE": MessageType.GROUP_NACK,
+        "FROM": from_user,
+        "TO": to_user,
+        "GROUP_ID": group_id,
+        "EPOCH": epoch,
+        "SEQS": seqs,
+        "TOKEN": issue_token(from_user, "group")
+    }
+
+def create_group_sync(from_user, group_id, epoch, last_seq):
+    """Announces the last SEQ sent to a group, so members can detect a lost final message."""
+    return {
+        "TYPE": MessageType.GROUP_SYNC,
+        "FROM": from_user,
+        "GROUP_ID": group_id,
+        "EPOCH": epoch,
+        "SEQ": last_seq,
+        "TOKEN": issue_token(from_user, "group")
     }
 
 def create_ttt_invite(from_user, to_user, gameid, symbol):
@@ -247,7 +477,7 @@ def create_ttt_invite(from_user, to_user, gameid, symbol):
         "MESSAGE_ID": secrets.token_hex(8),
         "SYMBOL": symbol,
         "TIMESTAMP": int(time.time()),
-        "TOKEN": create_token(from_user, "game")
+        "TOKEN": issue_token(from_user, "game")
     }
 
 def create_ttt_move(from_user, to_user, gameid, position, symbol, turn):
@@ -260,7 +490,7 @@ def create_ttt_move(from_user, to_user, gameid, position, symbol, turn):
         "POSITION": position,
         "SYMBOL": symbol,
         "TURN": turn,
-        "TOKEN": create_token(from_user, "game")
+        "TOKEN": issue_token(from_user, "game")
     }
 
 def create_ttt_result(from_user, to_user, gameid, result, symbol, winning_line):
@@ -273,7 +503,8 @@ def create_ttt_result(from_user, to_user, gameid, result, symbol, winning_line):
         "RESULT": result,
         "SYMBOL": symbol,
         "WINNING_LINE": winning_line,
-        "TIMESTAMP": int(time.time())
+        "TIMESTAMP": int(time.time()),
+        "TOKEN": issue_token(from_user, "game")
     }
 
 
@@ -0,0 +1,257 @@
+#Sidney Chan
+#Kellie Kaw
+# Headless relay ("supernode") for large segments. It caches every peer's PROFILE and the
+# avatars it has fetched, greets newcomers with its whole directory so they need not hear
+# from every peer, answers PROFILE_REQUEST and AVATAR_REQUEST from its cache on behalf of
+# sleeping or busy clients, and can repeat PING/PROFILE broadcasts between two ports or
+# interfaces. Clients started with --relay <relay user_id> leave discovery replies to it.
+# Run: python relay.py relay@192.168.1.5 [--bridge-port 51000] [--verbose]
+import argparse
+import base64
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+import protocol
+from network import NetworkHandler
+from logger import Logger
+from avatar_cache import AvatarCache
+from peers import address_of
+from shared import print_safe
+
+BRIDGED_TYPES = (protocol.MessageType.PING, protocol.MessageType.PROFILE)
+
+
+class Relay:
+    def __init__(self, user_id, sides, logger, profile_ttl=3600, greet_cooldown=60, avatar_cache=None,
+                 fetch_timeout=5, max_avatar_types=4096):
+        self.user_id = user_id
+        self.sides = sides                  # NetworkHandlers; broadcasts heard on one are repeated on the others
+        self.logger = logger
+        self.profile_ttl = profile_ttl      # Cached profiles are served this long after the peer was last heard
+        self.greet_cooldown = greet_cooldown
+        self.fetch_timeout = fetch_timeout  # Ask an avatar's owner again if it has not answered within this
+        self.max_avatar_types = max_avatar_types
+        self.avatar_cache = avatar_cache or AvatarCache("relay_avatar_cache")
+        self.profile_frame = protocol.serialize_message(protocol.create_profile_message(user_id, "Relay", "relay"))
+        self.profiles = {}         # user_id -> [PROFILE frame, profile digest, last heard]
+        self._avatar_types = OrderedDict()  # avatar hash -> AVATAR_TYPE from the owner's profile, oldest first
+        self._waiting = {}         # avatar hash -> [time we asked the owner, set of (side, requester, addr) waiting]
+        self._greeted = {}         # ip -> time we last sent it our directory
+        self._bridged = OrderedDict()  # hash of each frame we repeated -> time, to drop the echoes
+        self._lock = threading.Lock()
+
+    def handle(self, side, text, addr):
+        message = protocol.parse_message(text)
+        msg_type = message.get('TYPE')
+        if msg_type in BRIDGED_TYPES:
+            if self._echo(text):
+                return
+            self._bridge(side, text)
+        self.logger.log(message, origin=f"Received from {addr}")
+        reply_addr = (addr[0], side.port)
+
+        if msg_type == protocol.MessageType.PING:
+            peer_id = message.get('USER_ID')
+            with self._lock:
+                entry = self.profiles.get(peer_id)
+                if entry:
+                    entry[2] = time.monotonic()
+            self._greet(side, peer_id, reply_addr)
+
+        elif msg_type == protocol.MessageType.PROFILE:
+            peer_id = message.get('USER_ID')
+            if not peer_id or peer_id == self.user_id:
+                return
+            with self._lock:
+                self.profiles[peer_id] = [text, protocol.profile_digest(message), time.monotonic()]
+                if message.get('AVATAR_HASH') and message.get('AVATAR_TYPE'):
+                    self._note_avatar_type(message['AVATAR_HASH'], message['AVATAR_TYPE'])
+            self._greet(side, peer_id, reply_addr)
+
+        elif msg_type == protocol.MessageType.PEER_LIST_REQUEST:
+            requester = message.get('FROM')
+            if requester:
+                self._send_directory(side, requester, reply_addr)
+
+        elif msg_type == protocol.MessageType.PROFILE_REQUEST:
+            target = message.get('TO')
+            if target == self.user_id:
+                side.send_to(self.profile_frame, reply_addr)
+                return
+            with self._lock:
+                entry = self.profiles.get(target)
+            if entry:
+                side.send_to(entry[0], reply_addr)
+
+        elif msg_type == protocol.MessageType.AVATAR_REQUEST:
+            avatar_hash = message.get('AVATAR_HASH')
+            if not avatar_hash:
+                return
+            if avatar_hash in self.avatar_cache:
+                self._send_avatar(side, message.get('FROM'), reply_addr, avatar_hash)
+                return
+            # Fetch it once from the owner (again if that went unanswered); everyone who asks
+            # meanwhile is answered when it arrives
+            now = time.monotonic()
+            with self._lock:
+                pending = self._waiting.setdefault(avatar_hash, [float('-inf'), set()])
+                ask = now - pending[0] >= self.fetch_timeout
+                if ask:
+                    pending[0] = now
+                pending[1].add((side, message.get('FROM'), reply_addr))
+            owner = message.get('TO')
+            owner_addr = address_of(owner, side.port)
+            if ask and owner_addr and owner != self.user_id:
+                request = protocol.create_avatar_request(self.user_id, owner, avatar_hash)
+                side.send_to(protocol.serialize_message(request), owner_addr)
+
+        elif msg_type == protocol.MessageType.AVATAR_RESPONSE:
+            avatar_hash = message.get('AVATAR_HASH')
+            with self._lock:
+                requested = avatar_hash in self._waiting
+            if not requested:
+                return  # Only cache avatars we fetched; anything else could evict real ones
+            try:
+                image_data = base64.b64decode(message.get('AVATAR_DATA', ''))
+            except ValueError:
+                return
+            if not image_data or not self.avatar_cache.put(image_data, expected_hash=avatar_hash):
+                return
+            with self._lock:
+                if message.get('AVATAR_TYPE'):
+                    self._note_avatar_type(avatar_hash, message['AVATAR_TYPE'])
+                pending = self._waiting.pop(avatar_hash, None)
+            waiters = pending[1] if pending else ()
+            for waiting_side, requester, waiting_addr in waiters:
+                self._send_avatar(waiting_side, requester, waiting_addr, avatar_hash)
+
+    def _note_avatar_type(self, avatar_hash, avatar_type):
+        # Called with the lock held
+        self._avatar_types[avatar_hash] = avatar_type
+        self._avatar_types.move_to_end(avatar_hash)
+        while len(self._avatar_types) > self.max_avatar_types:
+            self._avatar_types.popitem(last=False)
+
+    def _echo(self, text):
+        # Our own repeated broadcasts come back to us; drop a frame seen within the last few seconds
+        key = hashlib.sha1(text.encode('utf-8')).digest()
+        now = time.monotonic()
+        with self._lock:
+            seen = self._bridged.get(key)
+            if seen is not None and now - seen < 5:
+                return True
+            self._bridged[key] = now
+            self._bridged.move_to_end(key)
+            while len(self._bridged) > 4096:
+                self._bridged.popitem(last=False)
+        return False
+
+    def _bridge(self, side, text):
+        for other in self.sides:
+            if other is not side:
+                other.broadcast(text)
+
+    def _greet(self, side, peer_id, reply_addr):
+        # A newcomer gets our profile and directory, so clients using this relay need not answer it
+        if not peer_id or peer_id == self.user_id:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._greeted.get(reply_addr[0], float('-inf')) < self.greet_cooldown:
+                return
+            self._greeted[reply_addr[0]] = now
+        side.send_to(self.profile_frame, reply_addr)
+        self._send_directory(side, peer_id, reply_addr)
+
+    def _send_directory(self, side, requester, reply_addr):
+        with self._lock:
+            entries = [(peer_id, entry[1]) for peer_id, entry in self.profiles.items() if peer_id != requester]
+        if not entries:
+            return
+        for message in protocol.create_peer_list_messages(self.user_id, requester, entries):
+            side.send_to(protocol.serialize_message(message), reply_addr)
+            self.logger.log(message, origin=f"Sent to {reply_addr[0]}")
+
+    def _send_avatar(self, side, requester, reply_addr, avatar_hash):
+        image_data = self.avatar_cache.get(avatar_hash)
+        if image_data is None:
+            return
+        response = protocol.create_avatar_response(self.user_id, requester, avatar_hash,
+                                                   self._avatar_types.get(avatar_hash, "image/png"),
+                                                   base64.b64encode(image_data).decode('utf-8'))
+        side.send_to(protocol.serialize_message(response), reply_addr)
+
+    def expire(self):
+        """Drops profiles of peers not heard from within profile_ttl, and avatar fetches nobody
+        answered. Returns how many profiles were dropped."""
+        now = time.monotonic()
+        cutoff = now - self.profile_ttl
+        with self._lock:
+            stale = [peer_id for peer_id, entry in self.profiles.items() if entry[2] < cutoff]
+            for peer_id in stale:
+                del self.profiles[peer_id]
+            # Requesters will have given up on these by now; a later request starts a fresh fetch
+            self._waiting = {h: pending for h, pending in self._waiting.items() if now - pending[0] < 6 * self.fetch_timeout}
+            self._greeted = {ip: t for ip, t in self._greeted.items() if t >= time.monotonic() - self.greet_cooldown}
+        return len(stale)
+
+    def announce(self):
+        for side in self.sides:
+            side.broadcast(self.profile_frame)
+
+    def serve(self, side, stop):
+        while not stop.is_set():
+            try:
+                text, addr = side.receive()
+            except OSError:
+                return
+            if text is not None:
+                self.handle(side, text, addr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LSNP relay')
+    parser.add_argument('user_id', type=str, help='User ID of the relay (e.g., relay@192.168.1.5)')
+    parser.add_argument('--port', type=int, default=50999, help='Port of the main segment')
+    parser.add_argument('--bind', type=str, default='', help='Address to bind on the main segment')
+    parser.add_argument('--broadcast', type=str, default='<broadcast>', help='Broadcast address of the main segment')
+    parser.add_argument('--bridge-port', type=int, default=None, help='Also serve, and repeat discovery broadcasts to, this port')
+    parser.add_argument('--bridge-bind', type=str, default='', help='Address to bind on the bridged segment')
+    parser.add_argument('--bridge-broadcast', type=str, default='<broadcast>', help='Broadcast address of the bridged segment')
+    parser.add_argument('--profile-ttl', type=int, default=3600, help='Seconds a cached profile is served after its peer was last heard')
+    parser.add_argument('--verbose', action='store_true', help='Enable verbose logging')
+    args = parser.parse_args()
+
+    sides = [NetworkHandler(port=args.port, multicast=False, bind=args.bind, broadcast_address=args.broadcast)]
+    if args.bridge_port is not None:
+        sides.append(NetworkHandler(port=args.bridge_port, multicast=False, bind=args.bridge_bind,
+                                    broadcast_address=args.bridge_broadcast))
+    logger = Logger(verbose=args.verbose, user_id=args.user_id)
+    if not args.verbose:
+        logger.log = lambda message, origin=None: None  # Headless: only verbose mode prints traffic
+    relay = Relay(args.user_id, sides, logger, profile_ttl=args.profile_ttl)
+
+    stop = threading.Event()
+    for side in sides:
+        threading.Thread(target=relay.serve, args=(side, stop), daemon=True).start()
+    print_safe(f"Relay {args.user_id} serving port(s) {', '.join(str(side.port) for side in sides)}")
+
+    try:
+        while True:
+            relay.announce()
+            for _ in range(5):
+                time.sleep(60)
+                dropped = relay.expire()
+                if dropped:
+                    print_safe(f"Relay: dropped {dropped} stale profile(s), {len(relay.profiles)} cached")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        for side in sides:
+            side.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+#Sidney Chan
+#Kellie Kaw
+# Incremental full-text index over the DMs, posts and group messages of the running
+# session; with --db, persisted ones are searched in SQLite instead (fts_query).
+# Postings are compact arrays of document numbers in insertion order; queries
+# intersect the shortest lists first and only score the newest candidates.
+# Removed messages are tombstoned and swept from the postings once they pile up.
+import bisect
+import math
+import re
+import threading
+from array import array
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+KINDS = ("DM", "POST", "GROUP")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+def fts_query(query):
+    """Translates a search query into an SQLite FTS5 MATCH expression, or None if it has no terms."""
+    phrases = []
+    for word in query.lower().split():
+        prefix = word.endswith('*')
+        tokens = tokenize(word[:-1] if prefix else word)
+        if tokens:
+            phrases.append('"' + ' '.join(tokens) + '"' + ('*' if prefix else ''))
+    return ' '.join(phrases) or None
+
+
+def _same(a, b):
+    # A history may hold its own copy of a record indexed from disk, so compare by value too
+    return a is b or (a.sender == b.sender and a.timestamp == b.timestamp and a.content == b.content)
+
+
+class SearchHit:
+    __slots__ = ('score', 'kind', 'scope', 'record')
+
+    def __init__(self, score, kind, scope, record):
+        self.score = score
+        self.kind = kind      # "DM", "POST" or "GROUP"
+        self.scope = scope    # Peer user_id for DMs and posts, group_id for group messages
+        self.record = record  # StoredMessage
+
+
+class SearchIndex:
+    def __init__(self, max_candidates=500, max_prefix_terms=64):
+        self.max_candidates = max_candidates      # Newest matches that get scored per query
+        self.max_prefix_terms = max_prefix_terms  # Cap on terms a prefix query expands to
+        self._docs = []        # doc number -> (kind, scope, record), or None once removed
+        self._live = 0         # Docs not removed
+        self._dead = 0         # Removed docs still listed in the postings
+        self._postings = {}    # term -> array of doc numbers, ascending
+        self._terms = []       # sorted vocabulary, for prefix lookups
+        self._scopes = {}      # (kind, scope) -> array of doc numbers
+        self._senders = {}     # sender -> array of doc numbers
+        self._lock = threading.Lock()
+
+    def add(self, kind, scope, record):
+        """Indexes one stored message. Returns its document number."""
+        terms = set(tokenize(record.content))
+        with self._lock:
+            doc = len(self._docs)
+            self._docs.append((kind, scope, record))
+            self._live += 1
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = array('I')
+                    bisect.insort(self._terms, term)
+                postings.append(doc)
+            self._scopes.setdefault((kind, scope), array('I')).append(doc)
+            if record.sender:
+                self._senders.setdefault(record.sender, array('I')).append(doc)
+        return doc
+
+    def remove(self, kind, scope, record):
+        """Drops one message, e.g. when its history evicts it. Returns True if it was indexed."""
+        with self._lock:
+            for doc in self._scopes.get((kind, scope), ()):
+                entry = self._docs[doc]
+                if entry is not None and _same(entry[2], record):
+                    self._docs[doc] = None
+                    self._removed(1)
+                    return True
+        return False
+
+    def remove_scope(self, kind, scope):
+        """Drops every message of a peer's DMs or posts, or of a group. Returns how many were dropped."""
+        with self._lock:
+            count = 0
+            for doc in self._scopes.pop((kind, scope), ()):
+                if self._docs[doc] is not None:
+                    self._docs[doc] = None
+                    count += 1
+            self._removed(count)
+        return count
+
+    def _removed(self, count):
+        self._live -= count
+        self._dead += count
+        if self._dead > max(1024, self._live):
+            self._compact()
+
+    def _compact(self):
+        # Rewrites the postings without removed docs; doc numbers themselves never change
+        docs = self._docs
+        for table in (self._postings, self._scopes, self._senders):
+            for key, postings in list(table.items()):
+                kept = array('I', (doc for doc in postings if docs[doc] is not None))
+                if kept:
+                    table[key] = kept
+                else:
+                    del table[key]
+        self._terms = sorted(self._postings)
+        self._dead = 0
+
+    def __len__(self):
+        return self._live
+
+    def _expand(self, prefix):
+        start = bisect.bisect_left(self._terms, prefix)
+        terms = []
+        for term in self._terms[start:start + self.max_prefix_terms]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+
+    def _prefix_postings(self, prefix):
+        terms = self._expand(prefix)
+        if len(terms) == 1:
+            return self._postings[terms[0]], terms
+        merged = set()
+        for term in terms:
+            merged.update(self._postings[term])
+        return array('I', sorted(merged)), terms
+
+    def search(self, query, kind=None, peer=None, group=None, sender=None, since=None, until=None, limit=20):
+        """Finds messages containing every query term. A term ending in '*' matches as a prefix.
+
+        Results can be narrowed to a kind ("DM", "POST", "GROUP"), a peer's DMs and
+        posts, a group, a sender and a timestamp range, and are ranked by tf-idf with
+        recency breaking ties. Returns a list of SearchHit, best first.
+        """
+        words = query.lower().split()
+        with self._lock:
+            total = self._live
+            if not total:
+                return []
+            lists = []
+            weights = []  # (terms matching this query word, idf)
+            for word in words:
+                if word.endswith('*'):
+                    prefix = ''.join(tokenize(word[:-1]))
+                    if not prefix:
+                        continue
+                    postings, terms = self._prefix_postings(prefix)
+                else:
+                    term = ''.join(tokenize(word))
+                    if not term:
+                        continue
+                    postings = self._postings.get(term, array('I'))
+                    terms = [term]
+                if not postings:
+                    return []
+                lists.append(postings)
+                weights.append((set(terms), math.log(1 + total / len(postings))))
+
+            if peer is not None:
+                scoped = [self._scopes.get((k, peer)) for k in ("DM", "POST") if kind is None or kind == k]
+                scoped = [s for s in scoped if s is not None]
+                if not scoped:
+                    return []
+                lists.append(scoped[0] if len(scoped) == 1 else array('I', sorted(set(scoped[0]) | set(scoped[1]))))
+            if group is not None:
+                scoped = self._scopes.get(("GROUP", group))
+                if scoped is None:
+                    return []
+                lists.append(scoped)
+            if sender is not None:
+                by_sender = self._senders.get(sender)
+                if by_sender is None:
+                    return []
+                lists.append(by_sender)
+            if not lists:
+                return []
+
+            candidates = self._intersect(lists, kind, since, until)
+            docs = [self._docs[doc] for doc in candidates]
+
+        hits = []
+        for doc_kind, scope, record in docs:
+            tokens = tokenize(record.content)
+            score = 0.0
+            for terms, idf in weights:
+                tf = sum(1 for token in tokens if token in terms)
+                score += idf * (1 + math.log(tf)) if tf else 0.0
+            hits.append(SearchHit(score, doc_kind, scope, record))
+        hits.sort(key=lambda hit: (hit.score, hit.record.timestamp), reverse=True)
+        return hits[:limit]
+
+    def _intersect(self, lists, kind, since, until):
+        # Walk the shortest list newest-first and probe the others by binary search
+        lists = sorted(lists, key=len)
+        shortest, others = lists[0], lists[1:]
+        found = []
+        for i in range(len(shortest) - 1, -1, -1):
+            doc = shortest[i]
+            if any(not self._contains(other, doc) for other in others):
+                continue
+            entry = self._docs[doc]
+            if entry is None:
+                continue
+            doc_kind, _, record = entry
+            if kind is not None and doc_kind != kind:
+                continue
+            if since is not None and record.timestamp < since:
+                continue
+            if until is not None and record.timestamp > until:
+                continue
+            found.append(doc)
+            if len(found) >= self.max_candidates:
+                break
+        return found
+
+    @staticmethod
+    def _contains(postings, doc):
+        i = bisect.bisect_left(postings, doc)
+        return i < len(postings) and postings[i] == doc
+
+
+def parse_query(text):
+    """Splits 'from:alice@10.0.0.2 group:g1 kind:dm since:1700000000 lunch plan*' into terms and filters."""
+    filters = {}
+    words = []
+    for word in text.split():
+        key, sep, value = word.partition(':')
+        key = key.lower()
+        if sep and value and key in ("from", "peer", "group", "kind", "since", "until"):
+            if key in ("since", "until"):
+                try:
+                    filters[key] = int(value)
+                except ValueError:
+                    continue
+            elif key == "kind":
+                filters[key] = value.upper()
+            elif key == "from":
+                filters["sender"] = value
+            else:
+                filters[key] = value
+        else:
+            words.append(word)
+    return " ".join(words), filters
@@ -0,0 +1,278 @@
+#Sidney Chan
+#Kellie Kaw
+# Compact in-memory storage for DM and post histories. Messages are kept as slotted
+# records holding only what is displayed, with interned user IDs and integer timestamps.
+import bisect
+import sys
+import threading
+import time
+from collections import deque
+
+
+def intern_id(user_id):
+    return sys.intern(user_id) if user_id else user_id
+
+
+def to_timestamp(value):
+    """Parses a TIMESTAMP field. Returns None if it is missing or not an integer."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def pack_message_id(message_id):
+    # 16-hex-digit IDs fit in a small int, about half the size of the string
+    if message_id and len(message_id) == 16 and message_id.isalnum():
+        try:
+            return int(message_id, 16)
+        except ValueError:
+            pass
+    return message_id
+
+
+class StoredMessage:
+    __slots__ = ('sender', 'timestamp', 'content', '_message_id')
+
+    def __init__(self, sender, timestamp, content, message_id=None):
+        self.sender = intern_id(sender)
+        timestamp = to_timestamp(timestamp)
+        self.timestamp = timestamp if timestamp is not None else int(time.time())  # Stamped on arrival if unusable
+        self.content = content
+        self._message_id = pack_message_id(message_id)
+
+    @property
+    def message_id(self):
+        message_id = self._message_id
+        return f"{message_id:016x}" if isinstance(message_id, int) else message_id
+
+    @classmethod
+    def from_message(cls, message):
+        """Builds a record from a parsed DM, POST or GROUP_MESSAGE, dropping TYPE, TOKEN and routing fields."""
+        sender = message.get('FROM') or message.get('USER_ID')
+        return cls(sender, message.get('TIMESTAMP'), message.get('CONTENT', ""), message.get('MESSAGE_ID'))
+
+    def __repr__(self):
+        return f"StoredMessage({self.sender!r}, {self.timestamp}, {self.content!r})"
+
+
+class History:
+    """Per-peer message lists with an optional cap on how many are kept for each peer.
+
+    With a persistent backend attached, every append is also queued for storage and a
+    peer's history is only read back from disk the first time it is looked at.
+    """
+
+    def __init__(self, max_per_peer=None):
+        self.max_per_peer = max_per_peer
+        self.backend = None
+        self.kind = None
+        self.index = None
+        self.index_kind = None
+        self._by_peer = {}
+        self._lock = threading.Lock()
+
+    def attach(self, backend, kind):
+        """Persists this history through backend (e.g. SQLiteStore) under the given kind."""
+        self.backend = backend
+        self.kind = kind
+
+    def index_with(self, index, kind):
+        """Feeds every appended message to a SearchIndex under the given kind, and removes evicted ones."""
+        self.index = index
+        self.index_kind = kind
+
+    def append(self, peer, record):
+        peer = intern_id(peer)
+        if self.backend is not None:
+            self.backend.save_message(self.kind, peer, record)
+        if self.index is not None:
+            self.index.add(self.index_kind, peer, record)
+        evicted = None
+        with self._lock:
+            records = self._by_peer.get(peer)
+            if records is None:
+                if self.backend is not None:
+                    return  # Not loaded yet; the backend has it and will return it on first read
+                records = deque(maxlen=self.max_per_peer)
+                self._by_peer[peer] = records
+            if records.maxlen is not None and len(records) == records.maxlen:
+                evicted = records[0]
+            records.append(record)
+        if evicted is not None and self.index is not None:
+            self.index.remove(self.index_kind, peer, evicted)
+
+    def __getitem__(self, peer):
+        records = self._by_peer.get(peer)
+        if records is None and self.backend is not None:
+            records = self._load(peer)
+        # Unknown peers read as an empty history without creating an entry
+        return records if records is not None else ()
+
+    get = __getitem__
+
+    def _load(self, peer):
+        self.backend.flush()
+        loaded = self.backend.load_messages(self.kind, peer, self.max_per_peer)
+        with self._lock:
+            records = self._by_peer.get(peer)
+            if records is None:
+                records = deque(loaded, maxlen=self.max_per_peer)
+                self._by_peer[intern_id(peer)] = records
+        return records
+
+    def __contains__(self, peer):
+        if peer in self._by_peer:
+            return True
+        return self.backend is not None and self.backend.has_messages(self.kind, peer)
+
+    def __delitem__(self, peer):
+        if self.backend is not None:
+            self.backend.delete_messages(self.kind, peer)
+        with self._lock:
+            self._by_peer.pop(peer, None)
+        if self.index is not None:
+            self.index.remove_scope(self.index_kind, peer)
+
+    def peers(self):
+        return list(self._by_peer)
+
+    def __len__(self):
+        return sum(len(records) for records in list(self._by_peer.values()))
+
+
+class PostIndex(History):
+    """Post history indexed by (author, TIMESTAMP) and by MESSAGE_ID, with live like counts.
+
+    Each author's posts are kept sorted by timestamp so pages can be read newest-first
+    without scanning, and likes are counted as LIKE/UNLIKE messages arrive.
+    """
+
+    def __init__(self, max_per_peer=None):
+        super().__init__(max_per_peer)
+        self._by_key = {}   # (author, timestamp) -> StoredMessage
+        self._by_id = {}    # message_id -> (author, StoredMessage)
+        self._likes = {}    # (author, timestamp) -> set of user_ids who like it
+
+    def append(self, peer, record):
+        peer = intern_id(peer)
+        message_id = record.message_id
+        if message_id and message_id in self._by_id:
+            return  # Already have this post
+        if self.backend is not None:
+            self.backend.save_message(self.kind, peer, record)
+        if self.index is not None:
+            self.index.add(self.index_kind, peer, record)
+        with self._lock:
+            records = self._by_peer.get(peer)
+            if records is None:
+                if self.backend is not None:
+                    return  # Loaded with the rest of the author's posts on first read
+                records = []
+                self._by_peer[peer] = records
+            self._insert(peer, records, record)
+
+    def _insert(self, peer, records, record):
+        if records and record.timestamp < records[-1].timestamp:
+            bisect.insort(records, record, key=lambda r: r.timestamp)
+        else:
+            records.append(record)
+        self._by_key[(peer, record.timestamp)] = record
+        if record.message_id:
+            self._by_id[record.message_id] = (peer, record)
+        if self.max_per_peer and len(records) > self.max_per_peer:
+            evicted = records.pop(0)
+            self._unindex(peer, evicted)
+            if self.index is not None:
+                self.index.remove(self.index_kind, peer, evicted)
+
+    def _unindex(self, peer, record):
+        key = (peer, record.timestamp)
+        if self._by_key.get(key) is record:
+            del self._by_key[key]
+        if record.message_id:
+            self._by_id.pop(record.message_id, None)
+
+    def _load(self, peer):
+        self.backend.flush()
+        loaded = self.backend.load_messages(self.kind, peer, self.max_per_peer)
+        with self._lock:
+            records = self._by_peer.get(peer)
+            if records is None:
+                peer = intern_id(peer)
+                records = []
+                self._by_peer[peer] = records
+                for record in loaded:
+                    self._insert(peer, records, record)
+        return records
+
+    def __delitem__(self, peer):
+        if self.backend is not None:
+            self.backend.delete_messages(self.kind, peer)
+        with self._lock:
+            for record in self._by_peer.pop(peer, ()):
+                self._unindex(peer, record)
+        if self.index is not None:
+            self.index.remove_scope(self.index_kind, peer)
+
+    def get_post(self, author, timestamp):
+        """Returns the post an author made at a timestamp, or None."""
+        timestamp = to_timestamp(timestamp)
+        if timestamp is None:
+            return None
+        post = self._by_key.get((author, timestamp))
+        if post is None and author not in self._by_peer and self.backend is not None:
+            self._load(author)
+            post = self._by_key.get((author, timestamp))
+        return post
+
+    def get_by_id(self, message_id):
+        """Returns (author, post) for a MESSAGE_ID, or None."""
+        return self._by_id.get(message_id)
+
+    def page(self, author, page=0, page_size=10):
+        """Returns one page of an author's posts, newest first, and whether older pages exist."""
+        records = self[author]
+        end = len(records) - page * page_size
+        start = max(0, end - page_size)
+        if end <= 0:
+            return [], False
+        return records[start:end][::-1], start > 0
+
+    def latest(self, author):
+        """TIMESTAMP of the newest post held from an author, or 0 if there are none."""
+        records = self[author]
+        return records[-1].timestamp if records else 0
+
+    def newer_than(self, author, timestamp, limit=None):
+        """An author's posts made after timestamp, oldest first; at most the newest `limit` of them."""
+        records = self[author]
+        start = bisect.bisect_right(records, timestamp, key=lambda r: r.timestamp)
+        if limit is not None:
+            start = max(start, len(records) - limit)
+        return records[start:]
+
+    def apply_like(self, author, timestamp, liker, action="LIKE"):
+        """Updates the like count of a post from a LIKE or UNLIKE message. Returns the new count."""
+        timestamp = to_timestamp(timestamp)
+        if timestamp is None:
+            return 0  # Malformed POST_TIMESTAMP: not a post of ours
+        key = (author, timestamp)
+        likers = self._likes.get(key)
+        if action == "UNLIKE":
+            if likers:
+                likers.discard(liker)
+                if not likers:
+                    del self._likes[key]
+            return len(likers) if likers else 0
+        if likers is None:
+            likers = self._likes[key] = set()
+        likers.add(intern_id(liker))
+        return len(likers)
+
+    def like_count(self, author, timestamp):
+        timestamp = to_timestamp(timestamp)
+        if timestamp is None:
+            return 0
+        likers = self._likes.get((author, timestamp))
+        return len(likers) if likers else 0
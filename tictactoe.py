@@ -1,12 +1,41 @@
 #Sidney Chan
 #Kellie Kaw
+# Bitboard Tic-Tac-Toe. Each player's marks are a 9-bit int (bit i = cell i), so a move
+# is one OR and a win check is one lookup in a table precomputed over all 512 boards.
+# GameTable holds every active game and pending invite by (opponent, GAMEID), since each
+# peer picks GAMEIDs from the same g0.. space, and hands out our own IDs in O(1).
+import threading
+from collections import Counter, deque
 from shared import print_safe
 
+FULL_BOARD = 0x1FF
+
+WIN_LINES = (
+    (0, 1, 2), (3, 4, 5), (6, 7, 8),  # rows
+    (0, 3, 6), (1, 4, 7), (2, 5, 8),  # cols
+    (0, 4, 8), (2, 4, 6)              # diagonals
+)
+WIN_MASKS = tuple(sum(1 << pos for pos in line) for line in WIN_LINES)
+
+# For every possible set of one player's marks, the first win line it completes (or None)
+_WINNING_LINE = [next((list(line) for line, mask in zip(WIN_LINES, WIN_MASKS) if bits & mask == mask), None)
+                 for bits in range(FULL_BOARD + 1)]
+
+
+def completes_line(bits):
+    """True if a player holding these marks has three in a row."""
+    return _WINNING_LINE[bits] is not None
+
+
 class TicTacToe:
+    __slots__ = ('player_x', 'player_o', 'x_bits', 'o_bits', 'turn', 'winner', 'is_draw',
+                 'my_symbol', 'winning_line', 'winning_symbol')
+
     def __init__(self, player_x, player_o, my_symbol):
         self.player_x = player_x  # user_id with X
         self.player_o = player_o  # user_id with O
-        self.board = [' '] * 9  # 3x3 board flattened
+        self.x_bits = 0
+        self.o_bits = 0
         self.turn = 1  # X always starts
         self.winner = None
         self.is_draw = False
@@ -14,12 +43,19 @@ class TicTacToe:
         self.winning_line = None
         self.winning_symbol = None
 
+    @property
+    def opponent(self):
+        return self.player_o if self.my_symbol == "X" else self.player_x
+
+    @property
+    def board(self):
+        """The board as a list of 9 cells holding ' ', 'X' or 'O'."""
+        return ['X' if self.x_bits >> i & 1 else 'O' if self.o_bits >> i & 1 else ' ' for i in range(9)]
 
     def print_board(self):
-        # moves is a list of 9 elements: either 'X', 'O', or None (empty)
         moves = self.board
         display = [str(i) if moves[i] == ' ' else moves[i] for i in range(9)]
-        
+
         print_safe(f" {display[0]} | {display[1]} | {display[2]} ")
         print_safe("---+---+---")
         print_safe(f" {display[3]} | {display[4]} | {display[5]} ")
@@ -31,34 +67,35 @@ class TicTacToe:
         #     return False, "Invalid turn number"
         # if symbol != self.current_symbol:
         #     return False, "Not this player's turn"
-        if position < 0 or position > 8 or self.board[position] != ' ':
+        if not 0 <= position <= 8 or (self.x_bits | self.o_bits) >> position & 1:
             return False, "Invalid position"
 
-        self.board[position] = symbol
+        if symbol == "X":
+            self.x_bits |= 1 << position
+        else:
+            self.o_bits |= 1 << position
         # Check for win or draw
         if self.check_winner(symbol):
             self.winner = user_id
             self.winning_symbol = symbol
         elif self.check_draw():
             self.is_draw = True
-            
 
         return True, "Move accepted"
 
     def check_winner(self, symbol):
-        wins = [
-            [0,1,2], [3,4,5], [6,7,8],  # rows
-            [0,3,6], [1,4,7], [2,5,8],  # cols
-            [0,4,8], [2,4,6]            # diagonals
-        ]
-        for line in wins:
-            if all(self.board[pos] == symbol for pos in line):
-                self.winning_line = line
-                return True
+        line = _WINNING_LINE[self.x_bits if symbol == "X" else self.o_bits]
+        if line:
+            self.winning_line = line
+            return True
         return False
 
     def check_draw(self):
-        return all(s != ' ' for s in self.board) and not self.winner
+        return (self.x_bits | self.o_bits) == FULL_BOARD and not self.winner
+
+    def free_cells(self):
+        occupied = self.x_bits | self.o_bits
+        return [i for i in range(9) if not occupied >> i & 1]
 
     def get_status(self):
         if self.winner:
@@ -67,3 +104,94 @@ class TicTacToe:
             return "Game over! Draw."
         else:
             return f"Next turn: {self.turn}"
+
+
+class GameTable:
+    """Active games and pending invites by (opponent, GAMEID).
+
+    Our own IDs (g0 .. g<capacity-1>) come from a free list, skipping any a peer's game or
+    invite already uses, so an opponent never sees the same GAMEID twice from both sides.
+    """
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self._games = {}               # (opponent, GAMEID) -> TicTacToe, ours and ones we were invited to
+        self._invites = {}             # (opponent, GAMEID) -> TICTACTOE_INVITE we have not answered
+        self._held = Counter()         # GAMEID -> games and invites using it, with any opponent
+        self._free = deque(range(capacity))
+        self._ours = {}                # GAMEID we allocated and have not released -> opponent
+        self._lock = threading.Lock()  # Games start and end on both the input and receive threads
+
+    def allocate(self, opponent):
+        """Reserves an unused GAMEID for a new invite to opponent."""
+        with self._lock:
+            for _ in range(len(self._free)):
+                game_id = f"g{self._free.popleft()}"
+                if not self._held[game_id]:
+                    self._ours[game_id] = opponent
+                    return game_id
+                self._free.append(int(game_id[1:]))  # Used by a peer's game or invite; try it again later
+        raise RuntimeError("No available game IDs")
+
+    def release(self, game_id):
+        """Returns one of our GAMEIDs to the free list, e.g. when an invite is declined."""
+        with self._lock:
+            if self._ours.pop(game_id, None) is not None:
+                self._free.append(int(game_id[1:]))
+
+    def add_invite(self, opponent, game_id, invite):
+        """Records a received invite. Returns False if that GAMEID is already in use with opponent."""
+        key = (opponent, game_id)
+        with self._lock:
+            pending = self._invites.get(key)
+            if pending is not None and pending.get('MESSAGE_ID') == invite.get('MESSAGE_ID'):
+                return True  # The inviter's resend of the same invite
+            if key in self._games or key in self._invites or self._ours.get(game_id) == opponent:
+                return False
+            self._invites[key] = invite
+            self._held[game_id] += 1
+        return True
+
+    def take_invite(self, opponent, game_id):
+        """Removes and returns a pending invite, or None."""
+        with self._lock:
+            invite = self._invites.pop((opponent, game_id), None)
+            if invite is not None:
+                self._drop(game_id)
+        return invite
+
+    def invites(self):
+        with self._lock:
+            return list(self._invites.items())
+
+    def start(self, game_id, player_x, player_o, my_symbol):
+        game = TicTacToe(player_x, player_o, my_symbol)
+        key = (game.opponent, game_id)
+        with self._lock:
+            if key not in self._games:
+                self._held[game_id] += 1
+            self._games[key] = game
+        return game
+
+    def end(self, opponent, game_id):
+        """Removes a finished game and frees its ID if it was ours."""
+        with self._lock:
+            if self._games.pop((opponent, game_id), None) is not None:
+                self._drop(game_id)
+            ours = self._ours.get(game_id) == opponent
+        if ours:
+            self.release(game_id)
+
+    def get(self, opponent, game_id):
+        return self._games.get((opponent, game_id))
+
+    def _drop(self, game_id):
+        self._held[game_id] -= 1
+        if not self._held[game_id]:
+            del self._held[game_id]
+
+    def __contains__(self, key):
+        return key in self._games
+
+    def __len__(self):
+        return len(self._games)
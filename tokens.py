@@ -0,0 +1,151 @@
+#Sidney Chan
+#Kellie Kaw
+# Token bookkeeping: parsing, a cache of validated tokens and an expiry-aware revocation store.
+import heapq
+import threading
+import time
+
+
+def parse_token(token):
+    """Splits a token into (user_id, expiration, scope). Returns None if malformed."""
+    parts = token.split('|')
+    if len(parts) != 3:
+        return None
+    user_id, expiration, scope = parts
+    try:
+        exp = int(expiration)
+    except ValueError:
+        return None
+    return user_id, exp, scope
+
+
+class TokenCache:
+    """Remembers the parsed form of recently seen tokens so validation is a single dict hit."""
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self._entries = {}  # token -> (user_id, expiration, scope)
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        parsed = self._entries.get(token)
+        if parsed is not None:
+            return parsed
+
+        parsed = parse_token(token)
+        if parsed is None:
+            return None
+        with self._lock:
+            if len(self._entries) >= self.max_size:
+                self._evict()
+            self._entries[token] = parsed
+        return parsed
+
+    def _evict(self):
+        # Drop expired tokens first; if that frees nothing, drop the oldest quarter
+        now = int(time.time())
+        expired = [t for t, (_, exp, _) in self._entries.items() if exp < now]
+        for t in expired:
+            del self._entries[t]
+        if len(self._entries) >= self.max_size:
+            for t in list(self._entries)[:self.max_size // 4 or 1]:
+                del self._entries[t]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RevocationStore:
+    """Set of revoked tokens. Each entry is discarded once the token's own expiration passes,
+    since an expired token is rejected by validation anyway."""
+
+    def __init__(self):
+        self._tokens = set()
+        self._expiry_heap = []  # (expiration, token)
+        self._lock = threading.Lock()
+
+    def add(self, token):
+        """Revokes a token. Returns True if it was newly recorded."""
+        parsed = parse_token(token)
+        if parsed is None:
+            return False
+        exp = parsed[1]
+        now = int(time.time())
+        with self._lock:
+            self._prune(now)
+            if exp < now or token in self._tokens:
+                return False
+            self._tokens.add(token)
+            heapq.heappush(self._expiry_heap, (exp, token))
+        return True
+
+    def add_many(self, tokens):
+        """Revokes several tokens in one pass. Returns the number newly recorded."""
+        now = int(time.time())
+        added = 0
+        with self._lock:
+            self._prune(now)
+            for token in tokens:
+                parsed = parse_token(token)
+                if parsed is None or parsed[1] < now or token in self._tokens:
+                    continue
+                self._tokens.add(token)
+                heapq.heappush(self._expiry_heap, (parsed[1], token))
+                added += 1
+        return added
+
+    def prune(self):
+        with self._lock:
+            self._prune(int(time.time()))
+
+    def _prune(self, now):
+        heap = self._expiry_heap
+        while heap and heap[0][0] < now:
+            _, token = heapq.heappop(heap)
+            self._tokens.discard(token)
+
+    def __contains__(self, token):
+        return token in self._tokens
+
+    def __len__(self):
+        return len(self._tokens)
+
+
+class TokenManager:
+    """Issues one token per (user_id, scope, ttl) and keeps reusing it until it nears expiry.
+    Every token handed out is tracked so all of them can be revoked together on shutdown."""
+
+    def __init__(self, mint, refresh_margin=300):
+        self.mint = mint  # callable(user_id, scope, ttl) -> token string
+        self.refresh_margin = refresh_margin
+        self._live = {}    # (user_id, scope, ttl) -> (token, expiration)
+        self._issued = {}  # token -> expiration
+        self._lock = threading.Lock()
+
+    def get(self, user_id, scope, ttl=3600):
+        key = (user_id, scope, ttl)
+        now = time.time()
+        margin = min(self.refresh_margin, ttl / 4)
+        with self._lock:
+            live = self._live.get(key)
+            if live is not None and live[1] - now > margin:
+                return live[0]
+
+            token = self.mint(user_id, scope, ttl)
+            exp = parse_token(token)[1]
+            self._live[key] = (token, exp)
+            self._issued[token] = exp
+            self._prune(now)
+            return token
+
+    def _prune(self, now):
+        # Tokens past their expiration no longer need revoking
+        expired = [t for t, exp in self._issued.items() if exp < now]
+        for t in expired:
+            del self._issued[t]
+
+    def issued_tokens(self):
+        """Returns every issued token that has not yet expired."""
+        with self._lock:
+            self._prune(time.time())
+            return list(self._issued)